@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Check newtex's import time against a budget, using python -X importtime.
+
+    python benchmarks/import_time.py
+
+For each entry point below, runs a fresh interpreter with -X importtime,
+reports the time spent importing newtex's own modules and the slowest
+imports, and fails if the time is over budget or if a module that should
+be deferred was imported.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import subprocess
+
+
+# Time budgets (ms) for importing newtex's own modules, excluding
+# third-party and standard library modules they import.
+entry_points = {
+    'import newtex': {
+        'code': 'import newtex',
+        'budget_ms': 5,
+        'forbidden': ['click', 'yaml', 'newtex._version', 'newtex.scaffold'],
+    },
+    'newtex --version': {
+        'code': 'from newtex.__main__ import main; main(["--version"])',
+        'budget_ms': 10,
+        'forbidden': ['click', 'yaml', 'newtex.commands'],
+    },
+    'newtex --help': {
+        'code': ('from newtex.commands import cli; '
+                 'cli.main(["--help"], standalone_mode=False)'),
+        'budget_ms': 25,
+        'forbidden': ['yaml', 'newtex._git', 'newtex.bib', 'newtex.styles',
+                      'newtex.clean', 'newtex.batch', 'concurrent.futures'],
+    },
+}
+
+
+def import_times(code):
+    """Return a list of (module, self_us, cumulative_us) for the imports
+    made by running code in a fresh interpreter."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=env)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(err.decode('utf-8', 'replace'))
+
+    times = []
+    for line in err.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        times.append((module.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def check(name, spec):
+    """Return (newtex_ms, problems, times) for one entry point."""
+    times = import_times(spec['code'])
+    modules = set(module for module, self_us, cumulative_us in times)
+    newtex_ms = sum(self_us for module, self_us, cumulative_us in times
+                    if module.split('.')[0] == 'newtex') / 1000
+
+    problems = ["imports {0}".format(module) for module in spec['forbidden']
+                if module in modules]
+    if newtex_ms > spec['budget_ms']:
+        problems.append("newtex modules took {0:.1f} ms (budget {1} ms)"
+                        .format(newtex_ms, spec['budget_ms']))
+    return newtex_ms, problems, times
+
+
+def main():
+    failed = False
+    for name in sorted(entry_points):
+        newtex_ms, problems, times = check(name, entry_points[name])
+        total_ms = sum(self_us for module, self_us, c in times) / 1000
+        print("{0:20s} newtex {1:5.1f} ms   total {2:6.1f} ms".format(
+            name, newtex_ms, total_ms))
+        for module, self_us, cumulative_us in sorted(
+                times, key=lambda t: -t[2])[:5]:
+            print("    {0:8.1f} ms  {1}".format(cumulative_us / 1000, module))
+        for problem in problems:
+            print("    FAIL: " + problem)
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark document scaffolding and compare against stored baselines.
+
+    python benchmarks/suite.py [--quick] [--repeat N] [--save] [NAME ...]
+
+Each benchmark is run several times in a fresh temporary directory and the
+fastest time is compared with benchmarks/baseline.json. A benchmark more
+than --threshold (25% by default) slower than its baseline is reported as
+a regression and the script exits with status 1. --save records the
+current times as the new baselines; baselines are machine specific, so
+save them on the machine the comparison will run on. --quick skips the
+slowest benchmarks (the 50 MB bib copy).
+
+Benchmarks are generators that do any untimed setup and then yield the
+function to time, once per repetition.
+"""
+from __future__ import print_function, division
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import click  # noqa: E402
+import yaml  # noqa: E402
+from click.testing import CliRunner  # noqa: E402
+
+from newtex.scaffold import (new_path, pkg_config_dir, copy_tree,  # noqa: E402
+                             load_templates, tex_contents)
+from newtex.commands import cli  # noqa: E402
+from newtex._git import setup_repositories  # noqa: E402
+from newtex.clean import clean_dir  # noqa: E402
+from newtex.bib import sync_bib  # noqa: E402
+
+
+baseline_file = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Differences smaller than this are noise, whatever the percentage
+min_difference = 0.002
+
+benchmarks = []
+slow = set()
+
+
+def benchmark(function=None, is_slow=False):
+    def register(function):
+        benchmarks.append((function.__name__[len('bench_'):], function))
+        if is_slow:
+            slow.add(benchmarks[-1][0])
+        return function
+    return register(function) if function is not None else register
+
+
+def make_config(tmpdir, bib_size=1024):
+    """Set up a config directory, master bib and Dropbox folder in tmpdir;
+    returns the config directory."""
+    config_dir = tmpdir/'newtex_template'
+    shutil.copytree(str(pkg_config_dir), str(config_dir))
+    master_bib = tmpdir/'master.bib'
+    write_bib(master_bib, bib_size)
+    dropbox = tmpdir/'Dropbox'
+    os.mkdir(str(dropbox))
+    with open(str(config_dir/'config.yaml'), 'w') as f:
+        yaml.safe_dump({'master_bib_file': str(master_bib),
+                        'authors': ['Ryan Dwyer', 'John A. Marohn'],
+                        'affiliations': ['Cornell', 'Cornell'],
+                        'default_style': 'naturemag_jm.bst',
+                        'dropbox': str(dropbox),
+                        'registry': str(tmpdir/'registry.sqlite')}, f)
+    return config_dir
+
+
+def write_bib(filename, size):
+    """Write a synthetic bib file of about size bytes."""
+    written = 0
+    i = 0
+    with io.open(str(filename), 'w', encoding='utf-8') as f:
+        while written < size:
+            written += f.write(
+                u"@article{{Author{0}_{1},\n"
+                u"  author = {{Author, A. and Other, B.}},\n"
+                u"  title = {{Synthetic entry number {0}}},\n"
+                u"  journal = {{J. Benchmarks}},\n"
+                u"  year = {{{1}}},\n"
+                u"  volume = {{{2}}},\n  pages = {{1--10}}\n}}\n\n".format(
+                    i, 1990 + i % 30, i % 100))
+            i += 1
+
+
+def git_env():
+    for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+        os.environ.setdefault(var, 'newtex')
+    for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+        os.environ.setdefault(var, 'newtex@example.com')
+
+
+@benchmark
+def bench_cli(tmpdir):
+    """End-to-end newtex into a temporary directory."""
+    git_env()
+    config_dir = make_config(tmpdir)
+    runner = CliRunner()
+    launch = click.launch
+    click.launch = lambda *args, **kwargs: None
+    try:
+        for i in range(sys.maxsize):
+            args = ['--config-dir', str(config_dir), '--doc-type', 'RP',
+                    '--short-name', 'doc{0}'.format(i), '--title', 'Title',
+                    '--destination', str(tmpdir)]
+            yield lambda: check_result(runner.invoke(cli, args))
+    finally:
+        click.launch = launch
+
+
+def check_result(result):
+    if result.exit_code != 0:
+        raise RuntimeError(result.output)
+
+
+@benchmark
+def bench_copy_tree(tmpdir):
+    """Copy the package's template directory."""
+    for i in range(sys.maxsize):
+        yield lambda: copy_tree(pkg_config_dir, tmpdir/'copy{0}'.format(i))
+
+
+@benchmark
+def bench_tex_contents(tmpdir):
+    """Render template.tex with 200 authors."""
+    template = load_templates(pkg_config_dir)['tex']
+    authors = ["Author {0}".format(i) for i in range(200)]
+    affiliations = ["Department {0}, Cornell".format(i) for i in range(200)]
+    date = datetime.date(2015, 9, 1)
+    while True:
+        yield lambda: tex_contents(template, "Title", date, authors,
+                                   affiliations, 'naturemag_jm', 'master',
+                                   '/tmp/figs')
+
+
+def git_bootstrap(tmpdir, engine):
+    git_env()
+    dropbox = tmpdir/'Dropbox'
+    os.mkdir(str(dropbox))
+    for i in range(sys.maxsize):
+        doc_dir = tmpdir/'doc{0}'.format(i)
+        shutil.copytree(str(pkg_config_dir), str(doc_dir))
+        (doc_dir/'gitignore').rename(doc_dir/'.gitignore')
+        yield lambda: setup_repositories(doc_dir, dropbox, engine=engine,
+                                         out=io.StringIO())
+
+
+@benchmark
+def bench_git_native(tmpdir):
+    """Create the working and bare repositories in-process."""
+    return git_bootstrap(tmpdir, 'native')
+
+
+@benchmark
+def bench_git_subprocess(tmpdir):
+    """Create the working and bare repositories with the git tools."""
+    os.environ['GIT_CONFIG_PARAMETERS'] = "'init.defaultbranch=master'"
+    try:
+        for run in git_bootstrap(tmpdir, 'subprocess'):
+            yield run
+    finally:
+        del os.environ['GIT_CONFIG_PARAMETERS']
+
+
+@benchmark
+def bench_clean(tmpdir):
+    """fab clean over 50 directories of 40 aux files and 10 kept files."""
+    doc_dir = tmpdir/'doc'
+    shutil.copytree(str(pkg_config_dir), str(doc_dir))
+    (doc_dir/'gitignore').rename(doc_dir/'.gitignore')
+    while True:
+        for i in range(50):
+            sub = doc_dir/'sub{0}'.format(i)
+            if not sub.exists():
+                os.mkdir(str(sub))
+            for j in range(10):
+                for ext in ('aux', 'log', 'bbl', 'fls', 'tex'):
+                    open(str(sub/'f{0}.{1}'.format(j, ext)), 'w').close()
+        yield lambda: clean_dir(doc_dir, recursive=True)
+
+
+def bib_copy(tmpdir, size):
+    master_bib = tmpdir/'master.bib'
+    write_bib(master_bib, size)
+    dst = tmpdir/'doc'/'bib'/'master.bib'
+    os.makedirs(str(dst.parent))
+    while True:
+        if dst.exists():
+            os.remove(str(dst))
+        yield lambda: sync_bib(master_bib, dst)
+
+
+@benchmark
+def bench_bib_copy_1mb(tmpdir):
+    """Copy a 1 MB master bib file into a document."""
+    return bib_copy(tmpdir, 2**20)
+
+
+@benchmark(is_slow=True)
+def bench_bib_copy_50mb(tmpdir):
+    """Copy a 50 MB master bib file into a document."""
+    return bib_copy(tmpdir, 50 * 2**20)
+
+
+def measure(function, repeat):
+    """Return the fastest of repeat timings of the benchmark function."""
+    tmpdir = new_path(tempfile.mkdtemp())
+    generator = function(tmpdir)
+    try:
+        times = []
+        for i in range(repeat):
+            run = next(generator)
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        return min(times)
+    finally:
+        generator.close()
+        shutil.rmtree(str(tmpdir))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('names', nargs='*', help="Benchmarks to run")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Allowed slowdown relative to the baseline")
+    parser.add_argument('--quick', action='store_true',
+                        help="Skip the slowest benchmarks")
+    parser.add_argument('--save', action='store_true',
+                        help="Save the results as the new baselines")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(baseline_file) as f:
+            baselines = json.load(f)
+    except (IOError, OSError, ValueError):
+        baselines = {}
+
+    results = {}
+    regressions = []
+    for name, function in benchmarks:
+        if args.names and name not in args.names:
+            continue
+        if args.quick and name in slow and name not in args.names:
+            continue
+        seconds = results[name] = measure(function, args.repeat)
+        baseline = baselines.get(name)
+        line = "{0:20s} {1:9.2f} ms".format(name, 1000 * seconds)
+        if baseline is not None:
+            change = seconds / baseline - 1
+            line += "   baseline {0:9.2f} ms  {1:+6.1f}%".format(
+                1000 * baseline, 100 * change)
+            if change > args.threshold and \
+                    seconds - baseline > min_difference:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        baselines.update((name, round(seconds, 6))
+                         for name, seconds in results.items())
+        with open(baseline_file, 'w') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+            f.write('\n')
+        print("Saved baselines to {0}".format(baseline_file))
+    elif regressions:
+        print("{0} regressed by more than {1:.0f}%: {2}".format(
+            len(regressions), 100 * args.threshold, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare rendering template.tex with newtex.template against string.Template.
+
+    python benchmarks/template_render.py [documents]
+
+Renders the package's template.tex for many documents (1000 by default),
+each with a different title and a ten author block, once by building a
+string.Template for each document, as newtex used to, and once from a
+single compiled template.
+"""
+from __future__ import print_function, division
+
+import io
+import os
+import sys
+import string
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from newtex.scaffold import pkg_config_dir  # noqa: E402
+from newtex.template import compile_template  # noqa: E402
+
+
+author_affil = r"""
+    \author{$author}
+    \affiliation{$affiliation}"""
+
+
+def values(i):
+    authors = ["Author {0}".format(j) for j in range(10)]
+    return dict(title="Document {0}".format(i), main_author=authors[0],
+                date="September 1, 2015", default_style='naturemag_jm',
+                default_bib='master', large_figs_dir='/tmp/figs/',
+                authors=authors, affiliations=["Cornell"] * len(authors))
+
+
+def render_string_template(text, kwargs):
+    affil = string.Template(author_affil)
+    block = "\n".join(affil.substitute(author=a, affiliation=b) for a, b in
+                      zip(kwargs['authors'], kwargs['affiliations']))
+    return string.Template(text).substitute(
+        kwargs, author_affiliation_block=block)
+
+
+def render_compiled(text, kwargs):
+    affil = compile_template(author_affil)
+    block = "\n".join(affil.render({'author': a, 'affiliation': b}) for a, b
+                      in zip(kwargs['authors'], kwargs['affiliations']))
+    return compile_template(text).substitute(
+        kwargs, author_affiliation_block=block)
+
+
+def main(documents=1000):
+    with io.open(str(pkg_config_dir/'template.tex'), encoding='utf-8') as f:
+        text = f.read()
+    docs = [values(i) for i in range(documents)]
+    for kwargs in docs[:10]:
+        assert (render_string_template(text, kwargs) ==
+                render_compiled(text, kwargs))
+
+    results = {}
+    for name, render in (('string.Template', render_string_template),
+                         ('newtex.template', render_compiled)):
+        seconds = min(timeit.repeat(
+            lambda: [render(text, kwargs) for kwargs in docs],
+            number=1, repeat=5))
+        results[name] = seconds
+        print("{0:16s} {1:8.2f} us / document".format(
+            name, 1e6 * seconds / documents))
+    print("speedup: {0:.1f}x".format(
+        results['string.Template'] / results['newtex.template']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
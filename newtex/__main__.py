@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Entry point for the newtex command; also run by python -m newtex."""
+from __future__ import print_function, division, absolute_import
+
+import sys
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    # Fast path: print the version without importing click or the CLI
+    if list(args) == ['--version']:
+        import newtex
+        print("newtex version {0}".format(newtex.__version__))
+        return
+
+    from newtex.commands import cli
+    cli.main(args=list(args), prog_name='newtex')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,21 @@
 # -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import io
+import os
+import re
+import stat as statmod
+import time
+import zlib
+import asyncio
+import pathlib
+import struct
+import hashlib
+import binascii
+import threading
+
 import click
-from newtex.util import check_output
+from newtex.util import check_output, run, run_async
 
 
 def check_git():
@@ -16,36 +31,541 @@ reinstalling git and selecting 'Use Git from the Windows Command Prompt'
 if you'd prefer to use PowerShell.""")
 
 
-def inital_git_commit(path):
+def inital_git_commit(path, out=None):
     path_string = str(path.absolute())
-    print("cd {0}".format(path_string))
-    check_output(['git', 'init'], cwd=path_string)
-    check_output(['git', 'add', '-A'], cwd=path_string)
+    print("cd {0}".format(path_string), file=out)
+    check_output(['git', 'init'], cwd=path_string, out=out)
+    check_output(['git', 'add', '-A'], cwd=path_string, out=out)
     check_output(['git', 'commit', '-m', "Initial automatic commit by newtex"],
-                  cwd=path_string)
+                 cwd=path_string, out=out)
 
 
-def create_bare_repo(path, bare_path):
+def create_bare_repo(path, bare_path, out=None):
     """Takes an existing git repository at path, creates a corresponding bare
-    repository at bare_path """
+    repository at bare_path.
+
+    Output is printed to out (stdout by default)."""
     repository = path.name
     git_path = path/'.git'
     git_bare_path = bare_path/(repository+'.git')
 
     bare_path_string = str(bare_path.absolute())
 
-    print("cd {0}".format(bare_path_string))
+    print("cd {0}".format(bare_path_string), file=out)
     check_output(['git', "clone", "--bare",
                     "{git_path}".format(
-            git_path=str(git_path.absolute()))], cwd=bare_path_string)
+            git_path=str(git_path.absolute()))], cwd=bare_path_string, out=out)
 
 
     path_string = str(path.absolute())
-    print("cd {0}".format(path_string))
+    print("cd {0}".format(path_string), file=out)
 
     check_output(["git", "remote", "add", "origin",
            "{git_bare_path}".format(
             git_bare_path=str(git_bare_path.absolute()))],
-            cwd=path_string)
+            cwd=path_string, out=out)
     check_output(["git", "push", "-u", "origin", "master"],
-                      cwd=path_string)
+                     cwd=path_string, out=out)
+
+
+# In-process repository creation
+#
+# Rather than running git init / add / commit / clone --bare / remote add /
+# push, write the initial commit's objects directly into both the working
+# repository and the bare repository. The objects are zlib-compressed once
+# into a single packfile, and the same pack and pack index are written to
+# both repositories, which keeps the number of files created small.
+# The files to commit are listed by git ls-files, so that they are the
+# ones git add -A would add.
+
+commit_message = "Initial automatic commit by newtex"
+
+_identity = {}
+_identity_lock = threading.Lock()
+
+
+def git_identity():
+    """Return (author, committer) as 'Name <email>' strings, asking git once
+    per process so that user.name / user.email are resolved exactly as git
+    would resolve them."""
+    with _identity_lock:
+        if not _identity:
+            for role in ('AUTHOR', 'COMMITTER'):
+                ident = run(['git', 'var', 'GIT_{0}_IDENT'.format(role)],
+                            stderr=False).check().output[0]
+                # Strip the trailing timestamp and timezone
+                _identity[role] = ident.rsplit(' ', 2)[0]
+    return _identity['AUTHOR'], _identity['COMMITTER']
+
+
+def _timestamp():
+    now = int(time.time())
+    offset = -(time.altzone if time.localtime(now).tm_isdst > 0
+               else time.timezone)
+    sign = '+' if offset >= 0 else '-'
+    hours, minutes = divmod(abs(offset) // 60, 60)
+    return "{0} {1}{2:02d}{3:02d}".format(now, sign, hours, minutes)
+
+
+def glob_regex(pattern):
+    """Translate a glob pattern into a regular expression (without an end
+    anchor) in which wildcards do not match '/'."""
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '*':
+            regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        elif c == '[' and ']' in pattern[i+2:]:
+            end = pattern.index(']', i+2)
+            chars = pattern[i+1:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex.append('[' + chars.replace('\\', '\\\\') + ']')
+            i = end
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return ''.join(regex)
+
+
+def parse_gitignore(lines):
+    """Yield (glob, negate, dir_only, anchored) for each pattern in the
+    .gitignore lines. Anchored globs match the path relative to the
+    .gitignore file; other globs match the file name."""
+    for line in lines:
+        line = line.rstrip('\n').rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        anchored = '/' in line.lstrip('*/') or line.startswith('/')
+        pattern = line.lstrip('/')
+        if pattern.startswith('**'):
+            pattern = '*' + pattern.lstrip('*/')
+            anchored = False
+        yield pattern, negate, dir_only, anchored
+
+
+def _file_mode(stat_result):
+    if statmod.S_ISLNK(stat_result.st_mode):
+        return 0o120000
+    if os.name != 'nt' and stat_result.st_mode & statmod.S_IXUSR:
+        return 0o100755
+    return 0o100644
+
+
+def _tracked_files(path, git_dir):
+    """Return (relative_path, absolute_path, stat) for every file in path
+    that git add -A would add, in git's index order.
+
+    The list comes from git ls-files, so that .gitignore files anywhere in
+    the tree, core.excludesFile and the repository's info/exclude are
+    applied exactly as git applies them."""
+    output = run(['git', '--git-dir', str(git_dir), '--work-tree', str(path),
+                  'ls-files', '--others', '--exclude-standard', '-z'],
+                 cwd=str(path), log=None, echo=False,
+                 stderr=False).check().output
+    found = []
+    for rel in '\n'.join(output).split('\0'):
+        # Nested repositories are listed as directories; skip them
+        if not rel or rel.endswith('/'):
+            continue
+        full = os.path.join(str(path), *rel.split('/'))
+        found.append((rel, full, os.lstat(full)))
+
+    found.sort(key=lambda item: item[0].encode('utf-8'))
+    return found
+
+
+_pack_types = {'commit': 1, 'tree': 2, 'blob': 3}
+
+
+class PackWriter(object):
+    """Collect git objects in memory and write them out as a single packfile
+    (version 2, no deltas) with its index."""
+
+    def __init__(self):
+        self.objects = {}
+        self.chunks = []
+        self.offset = 12
+
+    @property
+    def count(self):
+        return len(self.objects)
+
+    def write(self, obj_type, data):
+        """Add an object to the pack, returning its binary sha1."""
+        sha = hashlib.sha1("{0} {1}\0".format(obj_type, len(data)).encode(
+            'ascii') + data).digest()
+        if sha in self.objects:
+            return sha
+
+        # Object header: type and size in a little-endian varint
+        size = len(data)
+        byte = (_pack_types[obj_type] << 4) | (size & 0x0F)
+        size >>= 4
+        header = bytearray()
+        while size:
+            header.append(byte | 0x80)
+            byte = size & 0x7F
+            size >>= 7
+        header.append(byte)
+
+        entry = bytes(header) + zlib.compress(data, 1)
+        self.objects[sha] = (self.offset, zlib.crc32(entry) & 0xFFFFFFFF)
+        self.chunks.append(entry)
+        self.offset += len(entry)
+        return sha
+
+    def write_tree(self, entries):
+        """Write tree objects for a sorted list of (path, mode, sha) entries,
+        returning the sha of the root tree."""
+        children = {}
+        for rel, mode, sha in entries:
+            parts = rel.split('/', 1)
+            if len(parts) == 1:
+                children[rel] = ('{0:o}'.format(mode), sha, False)
+            else:
+                children.setdefault(parts[0], ('40000', [], True))[1].append(
+                    (parts[1], mode, sha))
+
+        def sort_key(name):
+            is_tree = children[name][2]
+            return (name + '/' if is_tree else name).encode('utf-8')
+
+        data = []
+        for name in sorted(children, key=sort_key):
+            mode, sha, is_tree = children[name]
+            if is_tree:
+                sha = self.write_tree(sha)
+            data.append(mode.encode('ascii') + b' ' + name.encode('utf-8') +
+                        b'\0' + sha)
+        return self.write('tree', b''.join(data))
+
+    def save(self, git_dirs):
+        """Write the pack and its index into the objects/pack directory of
+        each git directory in git_dirs."""
+        pack = b''.join([b'PACK', struct.pack('>LL', 2, len(self.objects))]
+                        + self.chunks)
+        pack_sha = hashlib.sha1(pack).digest()
+        pack += pack_sha
+
+        shas = sorted(self.objects)
+        fanout = [0] * 256
+        for sha in shas:
+            fanout[bytearray(sha)[0]] += 1
+        total = 0
+        for i in range(256):
+            total += fanout[i]
+            fanout[i] = total
+
+        idx = b''.join(
+            [b'\377tOc', struct.pack('>L', 2), struct.pack('>256L', *fanout)]
+            + shas
+            + [struct.pack('>L', self.objects[sha][1]) for sha in shas]
+            + [struct.pack('>L', self.objects[sha][0]) for sha in shas]
+            + [pack_sha])
+        idx += hashlib.sha1(idx).digest()
+
+        name = 'pack-' + binascii.hexlify(pack_sha).decode('ascii')
+        for git_dir in git_dirs:
+            pack_dir = os.path.join(str(git_dir), 'objects', 'pack')
+            for ext, data in (('.pack', pack), ('.idx', idx)):
+                with open(os.path.join(pack_dir, name + ext), 'wb') as f:
+                    f.write(data)
+
+
+def _nanoseconds(st, field):
+    ns = getattr(st, 'st_{0}_ns'.format(field), None)
+    return ns % 1000000000 if ns is not None else 0
+
+
+def _write_index(git_dir, entries):
+    """Write a version 2 index for a list of (path, stat, mode, sha)."""
+    data = [b'DIRC', struct.pack('>LL', 2, len(entries))]
+    for rel, st, mode, sha in entries:
+        name = rel.encode('utf-8')
+        fields = (int(st.st_ctime), _nanoseconds(st, 'ctime'),
+                  int(st.st_mtime), _nanoseconds(st, 'mtime'), st.st_dev,
+                  st.st_ino, mode, st.st_uid, st.st_gid, st.st_size)
+        entry = (struct.pack('>10L', *[field & 0xFFFFFFFF for field in fields])
+                 + sha + struct.pack('>H', min(len(name), 0xFFF)) + name)
+        entry += b'\0' * (8 - len(entry) % 8)
+        data.append(entry)
+    body = b''.join(data)
+    with open(os.path.join(str(git_dir), 'index'), 'wb') as f:
+        f.write(body + hashlib.sha1(body).digest())
+
+
+def _init_git_dir(git_dir, bare, remote=None):
+    os.makedirs(os.path.join(str(git_dir), 'objects', 'info'))
+    os.mkdir(os.path.join(str(git_dir), 'objects', 'pack'))
+    for ref_dir in ('heads', 'tags'):
+        os.makedirs(os.path.join(str(git_dir), 'refs', ref_dir))
+    write = lambda name, text: io.open(os.path.join(str(git_dir), name), 'w',
+                                       encoding='utf-8', newline='\n').write(
+                                           text)
+    write('HEAD', u"ref: refs/heads/master\n")
+    config = [u"[core]",
+              u"\trepositoryformatversion = 0",
+              u"\tfilemode = {0}".format('false' if os.name == 'nt' else 'true'),
+              u"\tbare = {0}".format('true' if bare else 'false')]
+    if not bare:
+        config.append(u"\tlogallrefupdates = true")
+    if remote is not None:
+        config.extend([
+            u'[remote "origin"]',
+            u"\turl = {0}".format(remote.replace('\\', '/')),
+            u"\tfetch = +refs/heads/*:refs/remotes/origin/*",
+            u'[branch "master"]',
+            u"\tremote = origin",
+            u"\tmerge = refs/heads/master"])
+    write('config', u"\n".join(config) + u"\n")
+    return write
+
+
+def write_repositories(path, bare_path, out=None):
+    """Create a git repository at path containing an initial commit of every
+    file, and a bare copy of it in bare_path set up as the 'origin' remote
+    with master tracking origin/master, without running git init, commit,
+    clone or push."""
+    git_bare_path = (bare_path/(path.name+'.git')).absolute()
+    git_path = path/'.git'
+
+    if git_path.exists():
+        raise click.ClickException(
+            "{0} is already a git repository".format(str(path)))
+    if git_bare_path.exists():
+        raise click.ClickException(
+            "The bare repository {0} already exists".format(str(git_bare_path)))
+
+    author, committer = git_identity()
+
+    write_work = _init_git_dir(git_path, bare=False,
+                               remote=str(git_bare_path))
+    write_bare = _init_git_dir(git_bare_path, bare=True)
+    os.makedirs(str(git_path/'refs'/'remotes'/'origin'))
+
+    writer = PackWriter()
+    index = []
+    for rel, full, st in _tracked_files(path, git_path):
+        mode = _file_mode(st)
+        if mode == 0o120000:
+            data = os.readlink(full).encode('utf-8')
+        else:
+            with open(full, 'rb') as f:
+                data = f.read()
+        index.append((rel, st, mode, writer.write('blob', data)))
+
+    tree = writer.write_tree([(rel, mode, sha) for rel, st, mode, sha in index])
+    timestamp = _timestamp()
+    commit = writer.write('commit', (
+        u"tree {tree}\nauthor {author} {ts}\ncommitter {committer} {ts}\n\n"
+        u"{message}\n".format(tree=binascii.hexlify(tree).decode('ascii'),
+                              author=author, committer=committer,
+                              ts=timestamp, message=commit_message)
+    ).encode('utf-8'))
+    commit_hex = binascii.hexlify(commit).decode('ascii') + u"\n"
+
+    writer.save([git_path, git_bare_path])
+    _write_index(git_path, index)
+    write_work('refs/heads/master', commit_hex)
+    write_work('refs/remotes/origin/master', commit_hex)
+    write_bare('refs/heads/master', commit_hex)
+
+    print("Initialized {0} with {1} files ({2} objects)".format(
+        str(git_path.absolute()), len(index), writer.count), file=out)
+    print("Created bare repository {0}".format(str(git_bare_path)), file=out)
+
+
+# Asynchronous setup
+#
+# Creating the bare repository (in a possibly slow, synced Dropbox folder)
+# and the large figures directory doesn't depend on the working repository,
+# so they run concurrently with the initial commit. Each step is recorded in
+# a GitSetupResult rather than printed, and setup_many runs the setup for
+# many documents at once, a bounded number at a time.
+
+class GitStep(object):
+    """A step of the git setup: a command run in cwd (or, for the native
+    engine, a description), how long it took and its output lines."""
+
+    def __init__(self, name, cwd, seconds, output):
+        self.name = name
+        self.cwd = cwd
+        self.seconds = seconds
+        self.output = output
+
+
+class GitSetupResult(object):
+    """The steps run to set up a document's repositories, and the exception
+    that stopped them, if any."""
+
+    def __init__(self, path, bare_repo, large_figs_dir=None, engine='native',
+                 timer=None):
+        self.path = path
+        self.timer = timer
+        self.bare_repo = bare_repo
+        self.large_figs_dir = large_figs_dir
+        self.engine = engine
+        self.steps = []
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def write(self, out=None):
+        """Print the steps and their output, like the git commands would."""
+        cwd = None
+        for step in self.steps:
+            if step.cwd is not None:
+                if step.cwd != cwd:
+                    print("cd {0}".format(step.cwd), file=out)
+                    cwd = step.cwd
+                print('', file=out)
+                print(step.name, file=out)
+            for line in step.output:
+                print(line, file=out)
+
+
+async def _run_step(result, cwd, args):
+    start = time.perf_counter()
+    command = (await run_async(args, cwd=cwd)).check()
+    if result.timer is not None:
+        result.timer.add('git/' + command.command, start, command.seconds)
+    result.steps.append(GitStep(command.command, cwd, command.seconds,
+                                command.output))
+
+
+async def _in_thread(result, name, function, *args):
+    """Run function(*args, out=buffer) in a worker thread, recording its
+    printed output as a step."""
+    loop = asyncio.get_event_loop()
+    buf = io.StringIO()
+    start = time.perf_counter()
+    await loop.run_in_executor(None, lambda: function(*args, out=buf))
+    seconds = time.perf_counter() - start
+    if result.timer is not None:
+        result.timer.add('git/' + name, start, seconds)
+    result.steps.append(GitStep(name, None, seconds,
+                                buf.getvalue().splitlines()))
+
+
+def _mkdir(path, out=None):
+    os.mkdir(str(path))
+    print("Created {0}".format(str(path)), file=out)
+
+
+async def _setup_subprocess(result):
+    path_string = str(result.path.absolute())
+    bare_repo = str(result.bare_repo)
+
+    async def commit():
+        for args in (['git', 'init'],
+                     ['git', 'remote', 'add', 'origin', bare_repo],
+                     ['git', 'add', '-A'],
+                     ['git', 'commit', '-m', commit_message]):
+            await _run_step(result, path_string, args)
+
+    async def bare():
+        await _run_step(result, str(result.bare_repo.parent),
+                        ['git', 'init', '--bare', bare_repo])
+        await _run_step(result, bare_repo,
+                        ['git', 'symbolic-ref', 'HEAD', 'refs/heads/master'])
+
+    await _gather(commit(), bare(), _figs(result))
+    await _run_step(result, path_string,
+                    ['git', 'push', '-u', 'origin', 'master'])
+
+
+async def _setup_native(result):
+    await _gather(_in_thread(result, 'write repositories', write_repositories,
+                             result.path, result.bare_repo.parent),
+                  _figs(result))
+
+
+async def _figs(result):
+    if result.large_figs_dir is not None:
+        await _in_thread(result, 'create large figures directory', _mkdir,
+                         result.large_figs_dir)
+
+
+async def _gather(*coroutines):
+    """Run coroutines concurrently, waiting for all of them to finish
+    before raising the first exception."""
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+async def setup_repositories_async(path, bare_path, large_figs_dir=None,
+                                   engine='native', timer=None):
+    """Create the working repository at path, its bare 'origin' in bare_path
+    and, if given, large_figs_dir. Returns a GitSetupResult; errors are
+    stored in its error attribute rather than raised. Each step's time is
+    recorded as a 'git/' sub-phase in timer, if given."""
+    path = pathlib.Path(path)
+    result = GitSetupResult(path, (pathlib.Path(bare_path) /
+                                   (path.name+'.git')).absolute(),
+                            large_figs_dir, engine, timer)
+    start = time.time()
+    try:
+        if engine == 'native':
+            await _setup_native(result)
+        elif engine == 'subprocess':
+            if result.bare_repo.exists():
+                raise click.ClickException(
+                    "The bare repository {0} already exists".format(
+                        str(result.bare_repo)))
+            await _setup_subprocess(result)
+        else:
+            raise click.ClickException(
+                "Unknown git engine '{0}'; use 'native' or 'subprocess'".format(
+                    engine))
+    except Exception as e:
+        result.error = e
+    result.seconds = time.time() - start
+    return result
+
+
+async def _setup_many(documents, jobs):
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def setup(document):
+        async with semaphore:
+            return await setup_repositories_async(**document)
+
+    return await asyncio.gather(*[setup(document) for document in documents])
+
+
+def setup_many(documents, jobs=4):
+    """Set up the repositories for many documents, at most jobs at a time.
+    documents is a list of dictionaries of setup_repositories_async
+    arguments; returns a GitSetupResult for each, in order."""
+    return asyncio.run(_setup_many(documents, jobs))
+
+
+def setup_repositories(path, bare_path, engine='native', out=None,
+                       large_figs_dir=None, timer=None):
+    """Create the working repository at path and its bare 'origin' in
+    bare_path (and large_figs_dir, if given). engine='native' writes the git
+    objects directly; engine='subprocess' runs the git command line tools.
+
+    Progress is printed to out (stdout by default), and the first error is
+    raised."""
+    result = asyncio.run(setup_repositories_async(path, bare_path,
+                                                  large_figs_dir, engine,
+                                                  timer))
+    result.write(out)
+    if result.error is not None:
+        raise result.error
+    return result
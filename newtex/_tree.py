@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Copy the template tree into a new document.
+
+Most of the template (the .bst files, figs/ex.pdf, ...) is never modified
+after it is copied, so it can be shared with the template instead of being
+copied byte for byte. link_mode selects how files are placed:
+
+copy
+    Copy every file (the default).
+hardlink
+    Hard link every file except those that are rewritten in place after
+    copying (see copy_only), which are copied.
+reflink
+    Clone every file using copy-on-write reflinks (btrfs, XFS, APFS, ...).
+    Fails if the filesystem doesn't support reflinks.
+auto
+    Use reflinks where supported, otherwise hard links for everything but
+    copy_only files, otherwise copies (e.g. across filesystems).
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import sys
+import errno
+import shutil
+
+import click
+
+
+link_modes = ('copy', 'hardlink', 'reflink', 'auto')
+
+# Files rendered or edited in place after being copied into a new document;
+# these must never be hard linked to the template.
+rendered_files = ('template.tex', 'fabfile.py', 'gitignore')
+
+# errno values meaning "this filesystem / pair of paths can't do that"
+_unsupported = {errno.EXDEV, errno.EINVAL, errno.EPERM, errno.EMLINK,
+                getattr(errno, 'EOPNOTSUPP', errno.EINVAL),
+                getattr(errno, 'ENOTSUP', errno.EINVAL),
+                getattr(errno, 'ENOTTY', errno.EINVAL),
+                getattr(errno, 'ENOSYS', errno.EINVAL)}
+
+_FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Clone src to dst with a copy-on-write reflink, raising OSError if the
+    platform or filesystem doesn't support it."""
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with open(src, 'rb') as fsrc:
+            with open(dst, 'wb') as fdst:
+                try:
+                    fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                except (IOError, OSError):
+                    fdst.close()
+                    os.remove(dst)
+                    raise
+        shutil.copystat(src, dst)
+    elif sys.platform == 'darwin':
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if libc.clonefile(src.encode('utf-8'), dst.encode('utf-8'), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), dst)
+    else:
+        raise OSError(errno.ENOTSUP, "reflinks are not supported", dst)
+
+
+class TreeCopier(object):
+    """Place files from a template tree according to link_mode, remembering
+    which methods the filesystem supports for the rest of the copy."""
+
+    def __init__(self, link_mode='copy', copy_only=rendered_files):
+        if link_mode not in link_modes:
+            raise click.ClickException(
+                "Unknown link mode '{0}'; choose from {1}".format(
+                    link_mode, ", ".join(link_modes)))
+        self.link_mode = link_mode
+        self.copy_only = set(copy_only)
+        self.can_reflink = link_mode in ('reflink', 'auto')
+        self.can_hardlink = link_mode in ('hardlink', 'auto')
+        self.counts = {'copy': 0, 'hardlink': 0, 'reflink': 0}
+
+    def place(self, src, dst, rel):
+        if self.can_reflink:
+            try:
+                reflink(src, dst)
+                self.counts['reflink'] += 1
+                return
+            except (IOError, OSError) as e:
+                if self.link_mode == 'reflink':
+                    raise click.ClickException(
+                        "Could not reflink {0}: {1}".format(src, e))
+                if e.errno in _unsupported:
+                    self.can_reflink = False
+                else:
+                    raise
+
+        if self.can_hardlink and rel not in self.copy_only:
+            try:
+                os.link(src, dst)
+                self.counts['hardlink'] += 1
+                return
+            except OSError as e:
+                if e.errno not in _unsupported or self.link_mode == 'hardlink':
+                    raise
+                self.can_hardlink = False
+
+        shutil.copy2(src, dst)
+        self.counts['copy'] += 1
+
+
+def copy_tree(src_path, dst_path, link_mode='copy', copy_only=rendered_files,
+              exclude=()):
+    """Recursively copy all files and folders from src_path to dst_path,
+    creating dst_path if necessary. Files are placed according to link_mode
+    (see above); copy_only lists paths, relative to src_path and using '/',
+    that are always copied or reflinked, never hard linked. Paths in exclude
+    are skipped.
+
+    Returns a dictionary counting the files copied, hard linked and
+    reflinked."""
+    copier = TreeCopier(link_mode, copy_only)
+    exclude = set(exclude)
+    src_root = str(src_path)
+    dst_root = str(dst_path)
+
+    for dirpath, dirnames, filenames in os.walk(src_root):
+        rel_dir = os.path.relpath(dirpath, src_root).replace(os.sep, '/')
+        prefix = '' if rel_dir == '.' else rel_dir + '/'
+        dirnames[:] = [d for d in dirnames if prefix + d not in exclude]
+
+        dst_dir = os.path.join(dst_root, *prefix.split('/'))
+        if not os.path.isdir(dst_dir):
+            os.makedirs(dst_dir)
+
+        for filename in filenames:
+            rel = prefix + filename
+            if rel in exclude:
+                continue
+            dst = os.path.join(dst_dir, filename)
+            if os.path.lexists(dst):
+                os.remove(dst)
+            copier.place(os.path.join(dirpath, filename), dst, rel)
+
+    return copier.counts
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Create many documents from a single YAML manifest.
+
+The manifest lists one entry per document, with optional top-level defaults
+that apply to every entry::
+
+    destination: reports/fall2015
+    doc_type: RP
+
+    documents:
+        - short_name: cantilever noise
+          title: Cantilever noise measurements
+        - short_name: trEFM
+          title: Time-resolved EFM
+          doc_type: MS
+
+The config file and templates are loaded once and reused for every document.
+Documents can be created in parallel by a pool of worker threads; most of the
+time spent creating a document is waiting on git, so threads are sufficient.
+Each document's output is captured and reported in manifest order.
+"""
+from __future__ import print_function, division, absolute_import
+
+import io
+import time
+import datetime
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import yaml
+
+from newtex.scaffold import (create_document, load_templates, load_config,
+                             claim_names, new_path, doc_types,
+                             default_config_dir)
+from newtex._tree import link_modes
+from newtex.commands import profile_options, collision_option
+
+
+entry_keys = ('doc_type', 'short_name', 'title', 'destination')
+
+
+def load_manifest(filename, destination=None):
+    """Read and validate a batch manifest, returning a list of entries.
+
+    Every entry is validated before any documents are created, so that a
+    typo on the last line doesn't fail a run halfway through."""
+    with io.open(str(filename), encoding='utf-8') as f:
+        manifest = yaml.safe_load(f)
+
+    if isinstance(manifest, list):
+        manifest = {'documents': manifest}
+
+    if not isinstance(manifest, dict) or not manifest.get('documents') or \
+            not isinstance(manifest['documents'], list):
+        raise click.ClickException(
+            "The manifest {0} must contain a list of documents.".format(
+                filename))
+
+    defaults = {'destination': '.'}
+    defaults.update((key, manifest[key]) for key in entry_keys
+                    if key in manifest)
+    if destination is not None:
+        defaults['destination'] = destination
+
+    entries = []
+    errors = []
+    for i, document in enumerate(manifest['documents']):
+        if not isinstance(document, dict):
+            errors.append("Document {0}: must be a mapping of keys to "
+                          "values, not {1!r}".format(i, document))
+            continue
+        entry = dict(defaults)
+        entry.update(document)
+        errors.extend("Document {0}: {1}".format(i, error)
+                      for error in validate_entry(entry))
+        entries.append(entry)
+
+    if errors:
+        raise click.ClickException(
+            "Invalid manifest {0}\n{1}".format(filename, "\n".join(errors)))
+
+    return entries
+
+
+def validate_entry(entry):
+    """Return a list of problems with a single manifest entry."""
+    errors = []
+    unknown = set(entry) - set(entry_keys) - {'date'}
+    if unknown:
+        errors.append("unknown keys {0}".format(
+            ", ".join(sorted(str(key) for key in unknown))))
+
+    for key in ('doc_type', 'short_name', 'title'):
+        if not entry.get(key):
+            errors.append("'{0}' must be specified".format(key))
+
+    for key in entry_keys:
+        if entry.get(key) and not isinstance(entry[key], str):
+            errors.append("'{0}' must be a string, not {1!r}".format(
+                key, entry[key]))
+
+    if isinstance(entry.get('doc_type'), str) and \
+            entry['doc_type'] not in doc_types:
+        errors.append("'doc_type' must be one of {0}".format(
+            ", ".join(doc_types)))
+
+    if 'date' in entry and not isinstance(entry['date'], datetime.date):
+        errors.append("'date' must be formatted YYYY-MM-DD")
+
+    return errors
+
+
+class BatchResult(object):
+    """The outcome of creating a single document in a batch."""
+
+    def __init__(self, entry, paths=None, seconds=0.0, error=None,
+                 traceback=None, output=u'', timer=None):
+        self.entry = entry
+        self.timer = timer
+        self.paths = paths
+        self.seconds = seconds
+        self.error = error
+        self.traceback = traceback
+        self.output = output
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class BatchReport(object):
+    """Results and timings for a whole batch run."""
+
+    def __init__(self, results, seconds):
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def failures(self):
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def timers(self):
+        return [result.timer for result in self.results
+                if result.timer is not None]
+
+    def profile(self):
+        """Return percentiles of each phase's time across documents."""
+        from newtex.timing import aggregate_report
+        return aggregate_report(self.timers)
+
+    def summary(self):
+        lines = []
+        for result in self.results:
+            if result.ok:
+                lines.append("ok    {0:7.2f} s  {1}".format(
+                    result.seconds, result.paths['doc_dir']))
+            else:
+                lines.append("FAIL  {0:7.2f} s  {1}: {2}".format(
+                    result.seconds, result.entry['short_name'], result.error))
+
+        n = len(self.results)
+        mean = sum(r.seconds for r in self.results) / n if n else 0.0
+        lines.append("")
+        lines.append(
+            "Created {0} of {1} documents in {2:.2f} s ({3:.2f} s/document)"
+            .format(n - len(self.failures), n, self.seconds, mean))
+        return "\n".join(lines)
+
+
+def create_entry(entry, config, config_dir, templates, names=None):
+    """Create the document described by a manifest entry, returning a
+    BatchResult rather than raising. Output is captured in result.output.
+    If names (a newtex.registry.NameIndex) is given, the entry's name has
+    already been claimed in it (see check_names)."""
+    from newtex.timing import Timer
+
+    out = io.StringIO()
+    timer = Timer(entry['short_name'])
+    start = time.time()
+    try:
+        paths = create_document(config, config_dir, entry['doc_type'],
+                                entry['short_name'], entry['title'],
+                                destination=entry['destination'],
+                                date=entry.get('date'),
+                                templates=templates, out=out, timer=timer,
+                                names=names, claimed=names is not None)
+    except Exception as e:
+        return BatchResult(entry, seconds=time.time() - start,
+                           error="{0}: {1}".format(type(e).__name__, e),
+                           traceback=traceback.format_exc(),
+                           output=out.getvalue(), timer=timer)
+
+    return BatchResult(entry, paths, seconds=time.time() - start,
+                       output=out.getvalue(), timer=timer)
+
+
+def check_names(entries, config, on_collision=None, names=None):
+    """Claim a name for every entry before any document is created, so that
+    collisions with existing documents (or within the manifest) are found
+    up front. Returns a list of (entry, result): the entry with its short
+    name made unique if on_collision is 'suffix', and a failed BatchResult
+    if its name is taken (or None). The names are claimed in names (a
+    newtex.registry.NameIndex), by default a new one for the registry."""
+    from newtex.registry import Registry, NameIndex, default_registry
+
+    if names is None:
+        registry = config.get('registry', default_registry)
+        names = NameIndex(Registry(registry) if registry else None)
+    dropbox = new_path(config.get('dropbox', '~/Dropbox'))
+    if on_collision is None:
+        on_collision = config.get('on_collision', 'abort')
+
+    checked = []
+    for i, entry in enumerate(entries):
+        errors = validate_entry(entry)
+        if errors:
+            # Entries that didn't come through load_manifest
+            checked.append((entry, BatchResult(entry, error=(
+                "Document {0}: {1}".format(i, "; ".join(errors))))))
+            continue
+        try:
+            short_name, dir_name, doc_name = claim_names(
+                names, config, entry['doc_type'], entry['short_name'],
+                entry.get('date') or datetime.date.today(),
+                entry['destination'], dropbox, on_collision)
+        except click.ClickException as e:
+            checked.append((entry, BatchResult(
+                entry, error="{0}: {1}".format(type(e).__name__, e))))
+        else:
+            checked.append((dict(entry, short_name=short_name), None))
+    return checked
+
+
+def run_batch(entries, config, config_dir, keep_going=True, jobs=1,
+              echo=None, on_collision=None):
+    """Create every document in entries, reusing config and the parsed
+    templates. Returns a BatchReport.
+
+    Every name is checked first (see check_names); with keep_going=False,
+    nothing is created if any name is taken. Up to jobs documents are
+    created at once (jobs=0 uses one per CPU). If echo is given, it is
+    called with each document's output, in manifest order. With
+    keep_going=False, no new documents are started after the first
+    failure."""
+    from newtex.registry import Registry, NameIndex, default_registry
+
+    start = time.time()
+    registry = config.get('registry', default_registry)
+    names = NameIndex(Registry(registry) if registry else None)
+    checked = check_names(entries, config, on_collision, names)
+    collisions = [result for entry, result in checked if result is not None]
+    if collisions and not keep_going:
+        return BatchReport(collisions, time.time() - start)
+
+    templates = load_templates(config_dir)
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+
+    failed = threading.Event()
+
+    def create(checked_entry):
+        entry, result = checked_entry
+        if failed.is_set():
+            return None
+        if result is None:
+            result = create_entry(entry, config, config_dir, templates,
+                                  names)
+        if not result.ok and not keep_going:
+            failed.set()
+        return result
+
+    results = []
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        for result in executor.map(create, checked):
+            if result is None:
+                continue
+            if echo is not None:
+                echo(result.output)
+            results.append(result)
+    finally:
+        executor.shutdown()
+
+    return BatchReport(results, time.time() - start)
+
+
+@click.command(help="Create every document listed in a YAML manifest")
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--destination', default=None, type=click.Path(file_okay=False),
+              help="Default destination for documents in the manifest")
+@click.option('--config-dir', default=default_config_dir,
+              type=click.Path(),
+              help="Template directory or template pack")
+@click.option('--keep-going/--fail-fast', default=True,
+              help="Continue creating documents after a failure")
+@click.option('--jobs', '-j', default=1, type=click.IntRange(0),
+              help="Number of documents to create in parallel (0: one per CPU)")
+@click.option('--link-mode', default=None, type=click.Choice(link_modes),
+              help="How to copy template files (default: config file)")
+@click.option('--retries', default=None, type=click.IntRange(0),
+              help="Retry failed git setups, reusing the copied files "
+                   "(default: config file's git_retries)")
+@collision_option
+@profile_options
+def batch(manifest, destination, config_dir, keep_going, jobs, link_mode,
+          retries, on_collision, profile, profile_output, profile_format):
+    from newtex._git import check_git
+
+    entries = load_manifest(manifest, destination=destination)
+    config = load_config(config_dir)
+    check_git()
+
+    if link_mode is not None:
+        config = dict(config, link_mode=link_mode)
+    if retries is not None:
+        config = dict(config, git_retries=retries)
+
+    report = run_batch(entries, config, config_dir, keep_going=keep_going,
+                       jobs=jobs, echo=click.echo, on_collision=on_collision)
+
+    click.echo(report.summary())
+    if profile:
+        click.echo("")
+        click.echo(report.profile())
+    if profile_output is not None:
+        from newtex.timing import write_profile
+        write_profile(profile_output, report.timers, profile_format)
+    if report.failures:
+        raise click.ClickException(
+            "{0} of {1} documents failed".format(len(report.failures),
+                                                 len(report.results)))
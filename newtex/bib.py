@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""
+Keep a document's copy of the master bibliography up to date.
+
+The master bib file can be tens of megabytes, so rather than copying it
+blindly, sync_bib either
+
+full
+    copies the master bib file, skipping the copy if the document's copy
+    already has the same size and modification time (or contents), or
+cited
+    extracts only the entries \\cite'd in the document's .tex files (plus
+    @string and @preamble entries and crossref'd entries) into a slim
+    per-document bib file, rewriting it only if it changed.
+
+Entries are extracted using a persistent index of the master bib file (see
+BibIndex), which is built by reading the file as a stream of entries, so it
+is never held in memory all at once. The index is also available from the
+command line with ``newtex bib lookup`` and ``newtex bib extract``.
+"""
+from __future__ import print_function, division, absolute_import
+
+import io
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import warnings
+import threading
+
+import click
+
+from newtex.scaffold import default_config_dir
+
+
+bib_modes = ('full', 'cited')
+
+_entry_head = re.compile(br'\s*@\s*([A-Za-z]+)\s*([{(])\s*([^,\s})]*)')
+_closing = {b'{': b'}', b'(': b')'}
+_brackets = {b'{': re.compile(br'\\[{}]|[{}]'),
+             b'(': re.compile(br'\\[()]|[()]')}
+_crossref = re.compile(br'crossref\s*=\s*[{"]\s*([^}"\s]+)', re.IGNORECASE)
+_cite = re.compile(
+    r'\\(?:no)?cite[a-zA-Z]*\*?\s*(?:\[[^\]]*\]\s*){0,2}\{([^}]*)\}')
+_comment = re.compile(r'(?<!\\)%.*')
+
+
+def _file_digest(filename, block_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(str(filename), 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.digest()
+
+
+def _replace(filename, data):
+    """Atomically replace filename with data (bytes)."""
+    filename = str(filename)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+                               prefix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmp, filename)
+
+
+def sync_file(src, dst):
+    """Copy src to dst unless dst is already up to date. Returns True if the
+    file was copied.
+
+    Files with the same size and modification time are assumed to be the
+    same; if only the modification time differs, the contents are compared
+    and dst's modification time is updated so the next check is cheap."""
+    src, dst = str(src), str(dst)
+    src_stat = os.stat(src)
+    try:
+        dst_stat = os.stat(dst)
+    except OSError:
+        dst_stat = None
+
+    if dst_stat is not None and dst_stat.st_size == src_stat.st_size:
+        if int(dst_stat.st_mtime) == int(src_stat.st_mtime):
+            return False
+        if _file_digest(src) == _file_digest(dst):
+            shutil.copystat(src, dst)
+            return False
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst) or '.', prefix='.tmp')
+    os.close(fd)
+    shutil.copy2(src, tmp)
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(tmp, dst)
+    return True
+
+
+def iter_entries(bib_file):
+    """Yield (entry_type, key, offset, text) for each entry in bib_file,
+    reading it line by line. entry_type is lower case; text is the raw bytes
+    of the entry, from its '@' to its closing brace, and offset is the byte
+    offset of its '@'. An entry can start anywhere outside another entry,
+    including after the end of one on the same line."""
+    with open(str(bib_file), 'rb') as f:
+        offset = 0
+        current = None
+        for line in f:
+            i = 0
+            while i < len(line):
+                if current is None:
+                    at = line.find(b'@', i)
+                    if at < 0:
+                        break
+                    match = _entry_head.match(line, at)
+                    if match is None:
+                        i = at + 1
+                        continue
+                    current = [match.group(1).lower().decode('ascii'),
+                               match.group(3), offset + at, []]
+                    brackets = _brackets[match.group(2)]
+                    opening = match.group(2)
+                    closing = _closing[opening]
+                    depth = 0
+                    i = at
+
+                start = i
+                if line.find(b'@', i + 1) < 0:
+                    # Most lines are inside an entry: take the whole line
+                    # if the entry is still open at its end and no other
+                    # entry starts on it
+                    rest = line[i:] if i else line
+                    if b'\\' in rest:
+                        rest = rest.replace(b'\\' + opening, b'').replace(
+                            b'\\' + closing, b'')
+                    after = depth + rest.count(opening) - rest.count(closing)
+                    if after > 0:
+                        depth = after
+                        current[3].append(line[i:] if i else line)
+                        break
+                for bracket in brackets.finditer(line, i):
+                    if len(bracket.group()) > 1:
+                        continue    # \{ or \}
+                    depth += 1 if bracket.group() == opening else -1
+                    if depth == 0:
+                        i = bracket.end()
+                        break
+                else:
+                    current[3].append(line[start:])
+                    break
+
+                entry_type, key, entry_offset, parts = current
+                parts.append(line[start:i])
+                current = None
+                yield (entry_type, key.decode('utf-8', 'replace'),
+                       entry_offset, b''.join(parts))
+            offset += len(line)
+
+        if current is not None:
+            entry_type, key, entry_offset, parts = current
+            yield (entry_type, key.decode('utf-8', 'replace'), entry_offset,
+                   b''.join(parts))
+
+
+def tex_files(doc_dir='.'):
+    """Return the .tex files in doc_dir and its subdirectories."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(str(doc_dir)):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        found.extend(os.path.join(dirpath, filename)
+                     for filename in sorted(filenames)
+                     if filename.endswith('.tex'))
+    return found
+
+
+def cited_keys(filenames):
+    r"""Return the set of keys cited by \cite, \citet, \nocite, etc. in the
+    given .tex files. A '*' in the set means \nocite{*}."""
+    keys = set()
+    for filename in filenames:
+        with io.open(str(filename), encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = _comment.sub('', line)
+                for match in _cite.finditer(line):
+                    keys.update(key.strip() for key in match.group(1).split(',')
+                                if key.strip())
+    return keys
+
+
+default_index_dir = '~/.newtex/bib_index'
+
+
+class BibIndex(object):
+    """A persistent index of a bib file's entries.
+
+    The index maps each key to the byte offset and length of its entry, so
+    that looking up or extracting a set of keys reads only those entries
+    rather than the whole file. It is stored as JSON in index_dir and is
+    rebuilt, with a single streaming pass over the bib file, whenever the
+    bib file's size, modification time or first 64 KB change. As in
+    BibTeX, the first entry with a key is used if there is more than one."""
+
+    version = 2
+
+    def __init__(self, bib_file, index_dir=default_index_dir):
+        self.bib_file = os.path.abspath(os.path.expanduser(str(bib_file)))
+        name = hashlib.sha1(self.bib_file.encode('utf-8')).hexdigest()
+        self.index_file = os.path.join(
+            os.path.expanduser(str(index_dir)), name + '.json')
+        self.entries = {}
+        self.strings = []
+        self.guard = None
+
+    def _guard(self):
+        st = os.stat(self.bib_file)
+        with open(self.bib_file, 'rb') as f:
+            head = hashlib.sha1(f.read(1 << 16)).hexdigest()
+        return [self.version, st.st_size, st.st_mtime, head]
+
+    def load(self):
+        """Load the index, rebuilding it if it is missing or stale. Returns
+        True if the index was rebuilt."""
+        guard = self._guard()
+        if guard == self.guard:
+            return False
+        try:
+            with io.open(self.index_file, encoding='utf-8') as f:
+                data = json.load(f)
+            if data['guard'] == guard:
+                self.entries = data['entries']
+                self.strings = data['strings']
+                self.guard = guard
+                return False
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        self.build(guard)
+        return True
+
+    def build(self, guard=None):
+        """Rebuild the index from the bib file and save it."""
+        if guard is None:
+            guard = self._guard()
+        entries = {}
+        strings = []
+        for entry_type, key, offset, text in iter_entries(self.bib_file):
+            if entry_type in ('string', 'preamble'):
+                strings.append([offset, len(text)])
+            elif entry_type == 'comment':
+                continue
+            elif key in entries:
+                # BibTeX uses the first entry with a key
+                warnings.warn("Duplicate key {0} in {1}; using the first "
+                              "entry".format(key, self.bib_file))
+            else:
+                entries[key] = [offset, len(text), entry_type]
+        self.entries, self.strings, self.guard = entries, strings, guard
+
+        index_dir = os.path.dirname(self.index_file)
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        _replace(self.index_file, json.dumps(
+            {'bib_file': self.bib_file, 'guard': guard, 'entries': entries,
+             'strings': strings}).encode('utf-8'))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def _read(self, f, offset, length):
+        f.seek(offset)
+        return f.read(length)
+
+    def lookup(self, keys):
+        """Return a dictionary mapping each key found to its entry (bytes)."""
+        self.load()
+        found = {}
+        with open(self.bib_file, 'rb') as f:
+            for key in keys:
+                if key in self.entries:
+                    offset, length = self.entries[key][:2]
+                    found[key] = self._read(f, offset, length)
+        return found
+
+    def extract(self, keys):
+        """Return (bytes, missing_keys): the entries for keys, preceded by
+        every @string and @preamble entry and followed by any entries they
+        crossref, as BibTeX requires."""
+        self.load()
+        keys = set(keys)
+        found = self.lookup(keys)
+
+        crossrefs = set()
+        for text in found.values():
+            crossrefs.update(m.decode('utf-8', 'replace')
+                             for m in _crossref.findall(text))
+        refs = self.lookup(crossrefs - set(found))
+
+        by_offset = lambda key: self.entries[key][0]
+        with open(self.bib_file, 'rb') as f:
+            chunks = [self._read(f, offset, length)
+                      for offset, length in self.strings]
+        chunks.extend(found[key] for key in sorted(found, key=by_offset)
+                      if key not in crossrefs)
+        chunks.extend(found.get(key, refs.get(key))
+                      for key in sorted(crossrefs & set(self.entries),
+                                        key=by_offset))
+
+        data = b'\n'.join(text.rstrip() + b'\n' for text in chunks)
+        return data, keys - set(found)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(bib_file, index_dir=default_index_dir):
+    """Return the loaded BibIndex for bib_file, shared by every caller in
+    the process."""
+    key = (os.path.abspath(os.path.expanduser(str(bib_file))),
+           os.path.expanduser(str(index_dir)))
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = BibIndex(bib_file, index_dir)
+        index = _indexes[key]
+        index.load()
+    return index
+
+
+def extract_entries(bib_file, keys, index_dir=default_index_dir):
+    """Return (bytes, missing_keys): the entries of bib_file whose keys are
+    in keys, plus every @string and @preamble entry and any entries they
+    crossref. See BibIndex.extract."""
+    return get_index(bib_file, index_dir).extract(keys)
+
+
+def sync_bib(master_bib, dst, mode='full', doc_dir='.',
+             index_dir=default_index_dir):
+    """Bring dst up to date with master_bib, returning a short message
+    describing what was done. See the module docstring for the modes."""
+    if mode == 'full':
+        if sync_file(master_bib, dst):
+            return "Copied {0}".format(master_bib)
+        return "{0} is up to date".format(dst)
+
+    if mode != 'cited':
+        raise ValueError(
+            "Unknown bib mode '{0}'; use 'full' or 'cited'".format(mode))
+
+    keys = cited_keys(tex_files(doc_dir))
+    if '*' in keys:
+        return sync_bib(master_bib, dst, 'full', doc_dir)
+
+    data, missing = extract_entries(master_bib, keys, index_dir)
+    header = "% {0} entries cited from {1}\n\n".format(
+        len(keys) - len(missing), master_bib).encode('utf-8')
+    data = header + data
+
+    try:
+        with open(str(dst), 'rb') as f:
+            unchanged = f.read() == data
+    except (IOError, OSError):
+        unchanged = False
+
+    if not unchanged:
+        _replace(dst, data)
+
+    message = "{0} {1} of {2} cited entries from {3}".format(
+        "Kept" if unchanged else "Extracted", len(keys) - len(missing),
+        len(keys), master_bib)
+    if missing:
+        message += "\nNot found: " + ", ".join(sorted(missing))
+    return message
+
+
+@click.group(help="Look up and extract entries from the master bib file")
+@click.option('--master-bib', default=None, type=click.Path(dir_okay=False),
+              help="Bib file (default: master_bib_file in config.yaml)")
+@click.option('--config-dir', default=default_config_dir,
+              type=click.Path(),
+              help="Template directory or template pack")
+@click.pass_context
+def bib(ctx, master_bib, config_dir):
+    if master_bib is None:
+        from newtex.scaffold import load_config
+        master_bib = load_config(config_dir)['master_bib_file']
+    ctx.obj = get_index(master_bib)
+
+
+@bib.command(help="Print the entries for KEYS")
+@click.argument('keys', nargs=-1, required=True)
+@click.pass_obj
+def lookup(index, keys):
+    found = index.lookup(keys)
+    for key in keys:
+        if key in found:
+            click.echo(found[key].decode('utf-8', 'replace').rstrip() + '\n')
+        else:
+            click.echo("% {0} not found\n".format(key), err=True)
+    if len(found) < len(set(keys)):
+        raise click.ClickException("{0} keys not found".format(
+            len(set(keys)) - len(found)))
+
+
+@bib.command(help="Write the entries cited in PATHS (.tex files or "
+                  "directories), or listed with --key, to a new bib file")
+@click.argument('paths', nargs=-1, type=click.Path(exists=True))
+@click.option('--key', '-k', 'keys', multiple=True, help="Key to extract")
+@click.option('--output', '-o', default='-', type=click.File('wb'),
+              help="Output bib file (default: stdout)")
+@click.pass_obj
+def extract(index, paths, keys, output):
+    keys = set(keys)
+    for path in paths:
+        keys.update(cited_keys(tex_files(path) if os.path.isdir(path)
+                               else [path]))
+    data, missing = index.extract(keys)
+    output.write(data)
+    click.echo("Extracted {0} of {1} entries".format(
+        len(keys) - len(missing), len(keys)), err=True)
+    if missing:
+        click.echo("Not found: " + ", ".join(sorted(missing)), err=True)
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+"""
+Build a document, running pdflatex and bibtex only as often as needed.
+
+LaTeX is run with -recorder, and the files it reads (listed in the .fls
+file it writes) are hashed and saved, with the hashes of the files bibtex
+depends on, in .newtex_build.json. The next build:
+
+- does nothing if none of those files changed and the PDF exists;
+- runs bibtex only if the citations, \\bibdata and \\bibstyle in the .aux
+  files, or the .bib and .bst files they name, changed (or there is no
+  .bbl yet);
+- reruns pdflatex only while the .aux files keep changing (or the log asks
+  for a rerun), instead of always running pdflatex, bibtex, pdflatex,
+  pdflatex.
+
+Files outside the document directory, such as the figures in the large
+figures directory, are tracked too, except for the TeX distribution's
+classes, packages and fonts (the TEXMF trees kpsewhich reports); use
+--force after updating the distribution. Hashes are only recomputed for
+files whose size or modification time changed.
+
+With a cache (newtex.cache, used by default from the command line), a
+.bbl is reused for citations, .bib and .bst files seen before in any
+document instead of running bibtex, and if the document's inputs (all of
+the tracked files, in the document directory or not) are ones that were
+built before, the PDF and .aux are restored without running pdflatex at
+all.
+
+    newtex build
+    fab build
+"""
+from __future__ import print_function, division, absolute_import
+
+import io
+import os
+import re
+import json
+import time
+import shlex
+import hashlib
+
+import click
+
+from newtex.styles import file_hash
+from newtex.util import run, run_many
+from newtex.cache import cache_key, cache_option, get_cache
+
+
+state_name = '.newtex_build.json'
+default_engine = 'pdflatex'
+default_bibtex = 'bibtex'
+engine_flags = ['-recorder', '-interaction=nonstopmode', '-halt-on-error',
+                '-file-line-error']
+
+rerun_re = re.compile(r'Rerun to get|Label\(s\) may have changed|'
+                      r'Rerun LaTeX')
+bib_line_re = re.compile(r'\\(citation|bibdata|bibstyle)\{([^}]*)\}')
+aux_input_re = re.compile(r'\\@input\{([^}]*)\}')
+
+# kpsewhich variables naming the TeX distribution's trees
+texmf_variables = ('TEXMFROOT', 'TEXMFDIST', 'TEXMFMAIN', 'TEXMFLOCAL',
+                   'TEXMFSYSVAR', 'TEXMFSYSCONFIG', 'TEXMFVAR', 'TEXMFCONFIG')
+_texmf_roots = None
+
+
+def find_main(doc_dir='.'):
+    """Return the name of the .tex file in doc_dir with a \\documentclass."""
+    found = []
+    for name in sorted(os.listdir(str(doc_dir))):
+        if name.endswith('.tex'):
+            with io.open(os.path.join(str(doc_dir), name), encoding='utf-8',
+                         errors='replace') as f:
+                if '\\documentclass' in f.read(1 << 14):
+                    found.append(name)
+    if len(found) != 1:
+        raise click.ClickException(
+            "Found {0} main .tex files in {1}{2}; choose one with "
+            "--tex".format(len(found), doc_dir,
+                           " ({0})".format(", ".join(found)) if found else ""))
+    return found[0]
+
+
+def texmf_roots():
+    """Return the directories of the TeX distribution's trees, as reported
+    by kpsewhich ([] if it isn't installed)."""
+    global _texmf_roots
+    if _texmf_roots is None:
+        try:
+            results = run_many([['kpsewhich', '-var-value=' + name]
+                                for name in texmf_variables],
+                               log=None, echo=False)
+        except OSError:
+            results = []
+        roots = set()
+        for result in results:
+            for value in result.output if result.ok else []:
+                for path in re.split(r'[{},' + re.escape(os.pathsep) + ']',
+                                     value.replace('!!', '')):
+                    if path.strip() and os.path.isabs(path.strip()):
+                        roots.add(os.path.realpath(path.strip()))
+        _texmf_roots = sorted(roots)
+    return _texmf_roots
+
+
+def _below(path, roots):
+    return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+               for root in roots)
+
+
+def parse_fls(filename, doc_dir='.', ignore=()):
+    """Return the (inputs, outputs) in a -recorder .fls file, as sets of
+    paths: '/'-separated and relative to doc_dir for files in doc_dir,
+    absolute for the others. Files below the directories in ignore (such
+    as texmf_roots()) are left out."""
+    doc_dir = os.path.abspath(str(doc_dir))
+    ignore = [os.path.realpath(str(root)) for root in ignore]
+    pwd = doc_dir
+    files = {'INPUT': set(), 'OUTPUT': set()}
+    with io.open(str(filename), encoding='utf-8', errors='replace') as f:
+        for line in f:
+            kind, sep, path = line.rstrip('\r\n').partition(' ')
+            if kind == 'PWD':
+                pwd = path
+            elif kind in files:
+                path = os.path.normpath(os.path.join(pwd, path))
+                rel = os.path.relpath(path, doc_dir)
+                if not rel.startswith(os.pardir) and not os.path.isabs(rel):
+                    files[kind].add(rel.replace(os.sep, '/'))
+                elif not _below(os.path.realpath(path), ignore):
+                    files[kind].add(path)
+    return files['INPUT'], files['OUTPUT']
+
+
+def _full_path(doc_dir, path):
+    if os.path.isabs(path):
+        return path
+    return os.path.join(str(doc_dir), *path.split('/'))
+
+
+def hash_files(doc_dir, paths, previous=None):
+    """Return {path: [size, mtime_ns, sha256]} for paths (relative to
+    doc_dir, or absolute) (None for missing files), reusing the hash in
+    previous when a file's size and modification time are unchanged."""
+    previous = previous or {}
+    hashes = {}
+    for path in paths:
+        full = _full_path(doc_dir, path)
+        try:
+            st = os.stat(full)
+        except OSError:
+            hashes[path] = None
+            continue
+        old = previous.get(path)
+        if old is not None and old[:2] == [st.st_size, st.st_mtime_ns]:
+            hashes[path] = old
+        else:
+            hashes[path] = [st.st_size, st.st_mtime_ns, file_hash(full)]
+    return hashes
+
+
+def _unchanged(doc_dir, hashes):
+    current = hash_files(doc_dir, hashes, hashes)
+    return all((current[path] and current[path][2]) ==
+               (hashes[path] and hashes[path][2]) for path in hashes)
+
+
+def _aux_files(doc_dir, job):
+    """Return the main .aux file and the .aux files it \\@inputs."""
+    found = []
+    pending = [job + '.aux']
+    while pending:
+        path = pending.pop()
+        if path in found:
+            continue
+        try:
+            with io.open(os.path.join(str(doc_dir), path), encoding='utf-8',
+                         errors='replace') as f:
+                text = f.read()
+        except (IOError, OSError):
+            continue
+        found.append(path)
+        pending.extend(aux_input_re.findall(text))
+    return found
+
+
+def aux_hash(doc_dir, job):
+    """Return a hash of the contents of the document's .aux files."""
+    sha = hashlib.sha256()
+    for path in _aux_files(doc_dir, job):
+        sha.update(path.encode('utf-8') + b'\0')
+        with open(os.path.join(str(doc_dir), path), 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def bibtex_key(doc_dir, job, previous=None):
+    """Return (key, files): a hash of everything bibtex reads (the
+    citations, \\bibdata and \\bibstyle in the .aux files and the .bib and
+    .bst files they name) and the hashes of those files, or (None, {}) if
+    the document has no bibliography."""
+    lines = []
+    files = []
+    for path in _aux_files(doc_dir, job):
+        with io.open(os.path.join(str(doc_dir), path), encoding='utf-8',
+                     errors='replace') as f:
+            for command, argument in bib_line_re.findall(f.read()):
+                lines.append(u"{0}{{{1}}}".format(command, argument))
+                if command == 'bibdata':
+                    files.extend(name.strip() + '.bib'
+                                 for name in argument.split(','))
+                elif command == 'bibstyle':
+                    files.append(argument.strip() + '.bst')
+    if not any(line.startswith('bibdata') for line in lines):
+        return None, {}
+
+    hashes = hash_files(doc_dir, files, previous)
+    sha = hashlib.sha256(u"\n".join(lines).encode('utf-8'))
+    for path in files:
+        sha.update(u"\n{0} {1}".format(
+            path, hashes[path] and hashes[path][2]).encode('utf-8'))
+    return sha.hexdigest(), hashes
+
+
+def _read_state(doc_dir):
+    try:
+        with open(os.path.join(str(doc_dir), state_name)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_state(doc_dir, state):
+    with open(os.path.join(str(doc_dir), state_name), 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+
+class BuildReport(object):
+    """The commands a build ran, with how long each took, and an estimate
+    of the time saved compared to always running pdflatex, bibtex,
+    pdflatex, pdflatex."""
+
+    def __init__(self, tex_file, engine, seconds_per_run=None):
+        self.tex_file = tex_file
+        self.engine = engine
+        self.runs = []
+        self.cached = []
+        self.seconds = 0.0
+        self.seconds_per_run = dict(seconds_per_run or {})
+
+    def count(self, tool):
+        return sum(1 for name, seconds in self.runs if name == tool)
+
+    @property
+    def up_to_date(self):
+        return not self.runs and not self.cached
+
+    @property
+    def full_cycle(self):
+        """Estimated time of a blind pdflatex, bibtex, pdflatex, pdflatex
+        cycle, from the average time of each in this and earlier builds."""
+        latex = self.seconds_per_run.get('latex')
+        if latex is None:
+            return None
+        return 3 * latex + self.seconds_per_run.get('bibtex', 0.0)
+
+    @property
+    def saved(self):
+        full_cycle = self.full_cycle
+        if full_cycle is None:
+            return None
+        return max(0.0, full_cycle - self.seconds)
+
+    def summary(self):
+        if self.up_to_date:
+            line = "{0} is up to date".format(self.tex_file)
+        elif not self.runs:
+            line = "Restored {0} from the cache in {1:.2f} s".format(
+                ', '.join(self.cached), self.seconds)
+        else:
+            line = "Ran {0} {1} time{2} and bibtex {3} time{4} in " \
+                   "{5:.2f} s".format(
+                       self.engine, self.count('latex'),
+                       '' if self.count('latex') == 1 else 's',
+                       self.count('bibtex'),
+                       '' if self.count('bibtex') == 1 else 's', self.seconds)
+            if self.cached:
+                line += ", with {0} from the cache".format(
+                    ', '.join(self.cached))
+        if self.saved is not None:
+            line += " (saved {0:.2f} s)".format(self.saved)
+        return line
+
+
+def _average(state, tool, seconds):
+    """Update the running average time of tool in state."""
+    averages = state.setdefault('seconds_per_run', {})
+    old = averages.get(tool)
+    averages[tool] = seconds if old is None else 0.5 * (old + seconds)
+
+
+class BuildCancelled(Exception):
+    """Raised by build_document when its cancel event is set."""
+
+
+def _run(report, tool, args, doc_dir, log, cancel=None, env=None):
+    if cancel is not None and cancel.is_set():
+        raise BuildCancelled()
+    result = run(args, cwd=doc_dir, env=env, log=log, echo=log is not None,
+                 cancel=cancel)
+    report.runs.append((tool, result.seconds))
+    if result.cancelled:
+        raise BuildCancelled()
+    if not result.ok:
+        errors = [line for line in result.output
+                  if line.startswith('!') or re.match(r'.+:\d+: ', line)]
+        raise click.ClickException("{0} failed:\n{1}".format(
+            result.command, "\n".join(errors or result.output[-20:])))
+    return result
+
+
+def _output_parts(engine, tex_file, inputs, bib_files):
+    """Return the cache key parts for the PDF and .aux built by engine
+    from files with hashes inputs (every tracked input, including those
+    outside the document directory) and bib_files."""
+    files = sorted(inputs.items()) + sorted(bib_files.items())
+    return [engine, tex_file] + [u"{0} {1}".format(path, h and h[2])
+                                 for path, h in files]
+
+
+def _restore(cache, doc_dir, job, parts):
+    """Restore the PDF and .aux built from parts, if both are cached."""
+    outputs = [(ext, os.path.join(doc_dir, job + '.' + ext))
+               for ext in ('pdf', 'aux')]
+    tmp = [(ext, filename, filename + '.cached') for ext, filename in outputs]
+    try:
+        if not all(cache.get(cache_key(ext, *parts), cached)
+                   for ext, filename, cached in tmp):
+            return False
+        for ext, filename, cached in tmp:
+            os.replace(cached, filename)
+        return True
+    finally:
+        for ext, filename, cached in tmp:
+            if os.path.exists(cached):
+                os.remove(cached)
+
+
+def build_document(doc_dir='.', tex_file=None, engine=default_engine,
+                   bibtex=default_bibtex, force=False, max_runs=5, log=None,
+                   cache=None, cancel=None, env=None, draft=False):
+    """Build tex_file (by default, the .tex file in doc_dir with a
+    \\documentclass), running engine and bibtex (command lines) only as
+    needed. With force=True, everything is rerun. The commands' output is
+    sent to log (see newtex.util.run_async). Artifacts are reused from, and
+    saved in, cache (a newtex.cache.ArtifactCache), if given. If cancel (a
+    threading.Event) is set, the running command is killed and
+    BuildCancelled is raised; the next build starts over. The commands run
+    with environment env (default: this process's), with the figures made
+    by newtex.figs (the draft previews, if draft is True) first on
+    TEXINPUTS. Returns a BuildReport."""
+    from newtex.figs import texinputs
+
+    doc_dir = str(doc_dir)
+    if tex_file is None:
+        tex_file = find_main(doc_dir)
+    job = os.path.splitext(os.path.basename(tex_file))[0]
+    latex_args = shlex.split(engine) + engine_flags + [tex_file]
+    bibtex_args = shlex.split(bibtex) + [job]
+    env = texinputs(doc_dir, draft, env)
+
+    state = _read_state(doc_dir)
+    if state.get('tex_file') != tex_file or state.get('engine') != engine \
+            or state.get('draft', False) != draft:
+        state = {}
+    report = BuildReport(tex_file, os.path.basename(shlex.split(engine)[0]),
+                         state.get('seconds_per_run'))
+
+    pdf = os.path.join(doc_dir, job + '.pdf')
+    inputs = state.get('inputs')
+    if not force and inputs and os.path.exists(pdf) and \
+            _unchanged(doc_dir, inputs) and \
+            bibtex_key(doc_dir, job, state.get('bib_files'))[0] == \
+            state.get('bibtex_key'):
+        return report
+
+    start = time.time()
+    if cache is not None and not force and inputs:
+        bib_files = state.get('bib_files') or {}
+        parts = _output_parts(engine, tex_file,
+                              hash_files(doc_dir, inputs, inputs),
+                              hash_files(doc_dir, bib_files, bib_files))
+        if _restore(cache, doc_dir, job, parts):
+            report.cached.extend([job + '.pdf', job + '.aux'])
+            report.seconds = time.time() - start
+            state.update({
+                'inputs': hash_files(doc_dir, inputs, inputs),
+                'bibtex_key': bibtex_key(doc_dir, job, bib_files)[0],
+                'bib_files': hash_files(doc_dir, bib_files, bib_files)})
+            _write_state(doc_dir, state)
+            return report
+
+    before = aux_hash(doc_dir, job)
+    _run(report, 'latex', latex_args, doc_dir, log, cancel, env)
+
+    key, bib_files = bibtex_key(doc_dir, job, state.get('bib_files'))
+    rerun = False
+    bbl = os.path.join(doc_dir, job + '.bbl')
+    if key is not None and (force or key != state.get('bibtex_key') or
+                            not os.path.exists(bbl)):
+        if cache is not None and not force and \
+                cache.get(cache_key('bbl', key), bbl):
+            report.cached.append(job + '.bbl')
+        else:
+            _run(report, 'bibtex', bibtex_args, doc_dir, log, cancel, env)
+            if cache is not None:
+                cache.put(cache_key('bbl', key), 'bbl', bbl)
+        rerun = True
+
+    while report.count('latex') < max_runs:
+        after = aux_hash(doc_dir, job)
+        with io.open(os.path.join(doc_dir, job + '.log'), encoding='utf-8',
+                     errors='replace') as f:
+            rerun = rerun or after != before or bool(rerun_re.search(f.read()))
+        if not rerun:
+            break
+        before = after
+        rerun = False
+        _run(report, 'latex', latex_args, doc_dir, log, cancel, env)
+    report.seconds = time.time() - start
+
+    for tool in ('latex', 'bibtex'):
+        times = [seconds for name, seconds in report.runs if name == tool]
+        if times:
+            _average(state, tool, sum(times) / len(times))
+    report.seconds_per_run = state['seconds_per_run']
+
+    inputs, outputs = parse_fls(os.path.join(doc_dir, job + '.fls'), doc_dir,
+                                texmf_roots())
+    state.update({
+        'tex_file': tex_file, 'engine': engine, 'draft': draft,
+        'inputs': hash_files(doc_dir, sorted(inputs - outputs),
+                             state.get('inputs')),
+        'bibtex_key': key, 'bib_files': bib_files})
+    _write_state(doc_dir, state)
+
+    if cache is not None:
+        parts = _output_parts(engine, tex_file, state['inputs'], bib_files)
+        for ext in ('pdf', 'aux'):
+            cache.put(cache_key(ext, *parts), ext,
+                      os.path.join(doc_dir, job + '.' + ext))
+    return report
+
+
+@click.command(help="Build a document, running pdflatex and bibtex only as "
+                    "needed")
+@click.argument('doc_dir', default='.', type=click.Path(file_okay=False,
+                                                        exists=True))
+@click.option('--tex', default=None,
+              help="Main .tex file (default: the one with a \\documentclass)")
+@click.option('--engine', default=default_engine, show_default=True,
+              help="LaTeX command")
+@click.option('--bibtex', default=default_bibtex, show_default=True,
+              help="BibTeX command")
+@click.option('--force', '-f', is_flag=True,
+              help="Rerun everything, even if nothing changed")
+@click.option('--max-runs', default=5, type=click.IntRange(1),
+              show_default=True, help="Most LaTeX runs per build")
+@click.option('--draft', is_flag=True,
+              help="Use the draft previews of the figures (see newtex figs)")
+@click.option('--verbose', '-v', is_flag=True,
+              help="Show the output of pdflatex and bibtex")
+@cache_option
+@click.option('--no-cache', is_flag=True,
+              help="Don't use or fill the build artifact cache")
+def build(doc_dir, tex, engine, bibtex, force, max_runs, draft, verbose,
+          cache_dir, no_cache):
+    from newtex.figs import update_figures
+
+    tex = tex or find_main(doc_dir)
+    cache = None if no_cache else get_cache(cache_dir)
+    update_figures(doc_dir, tex, draft, cache, echo=click.echo)
+    click.echo(build_document(doc_dir, tex, engine, bibtex, force, max_runs,
+                              log=click.echo if verbose else None,
+                              cache=cache, draft=draft).summary())
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+A content-addressed cache of build artifacts, shared by every document.
+
+Documents created from the same template share a master bib file and
+style, so the .bbl bibtex writes for a given set of citations is the same
+whichever document asked for it. Build artifacts (.bbl files, PDFs,
+converted figures) are stored under a key made from the hashes of
+everything they were built from, so that a build whose inputs hash to a
+state seen before, in any document, is a cache hit.
+
+The cache (``~/.newtex/cache`` by default) looks like::
+
+    objects/<sha256[:2]>/<sha256>   artifact contents, named by their hash
+    index.sqlite                     key -> object, kind, size, last use
+
+Identical artifacts under different keys share one object. When the
+objects take up more than max_size, the least recently used entries are
+evicted.
+
+    newtex cache stats
+    newtex cache prune --max-size 200M
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import re
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+import click
+
+from newtex.styles import file_hash, sizeof_fmt
+
+
+default_cache = '~/.newtex/cache'
+default_max_size = 1 << 30
+
+schema = u"""
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE INDEX IF NOT EXISTS entries_sha256 ON entries (sha256);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+size_re = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*([KMG]?)B?\s*$', re.IGNORECASE)
+
+
+def parse_size(text):
+    """Parse a size such as 500M, 2G or 1048576 into bytes."""
+    match = size_re.match(str(text))
+    if match is None:
+        raise click.BadParameter("'{0}' is not a size (e.g. 500M, 2G)".format(
+            text))
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMG'.index(unit.upper() or ' '))
+
+
+def cache_key(kind, *parts):
+    """Return the key for an artifact of kind built from parts (strings,
+    usually hashes of the inputs)."""
+    sha = hashlib.sha256(kind.encode('utf-8'))
+    for part in parts:
+        sha.update(b'\0' + str(part).encode('utf-8'))
+    return sha.hexdigest()
+
+
+class ArtifactCache(object):
+    """The artifact cache at path, holding at most max_size bytes."""
+
+    def __init__(self, path=default_cache, max_size=default_max_size):
+        self.path = os.path.abspath(os.path.expanduser(str(path)))
+        self.objects_dir = os.path.join(self.path, 'objects')
+        self.index_file = os.path.join(self.path, 'index.sqlite')
+        self.max_size = max_size
+
+    def connect(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        connection = sqlite3.connect(self.index_file, timeout=30)
+        connection.executescript(schema)
+        return connection
+
+    def object_path(self, sha):
+        return os.path.join(self.objects_dir, sha[:2], sha)
+
+    def _count(self, connection, name):
+        connection.execute(
+            u"INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)",
+            [name])
+        connection.execute(
+            u"UPDATE counters SET value = value + 1 WHERE name = ?", [name])
+
+    def get(self, key, dst):
+        """Copy the artifact stored under key to dst, returning whether
+        there was one."""
+        connection = self.connect()
+        try:
+            row = connection.execute(
+                u"SELECT sha256 FROM entries WHERE key = ?", [key]).fetchone()
+            hit = row is not None
+            if hit:
+                # Another process may evict the object at any time
+                try:
+                    shutil.copyfile(self.object_path(row[0]), str(dst))
+                except OSError:
+                    hit = False
+            with connection:
+                if hit:
+                    connection.execute(
+                        u"UPDATE entries SET last_used = ? WHERE key = ?",
+                        [time.time(), key])
+                self._count(connection, 'hits' if hit else 'misses')
+        finally:
+            connection.close()
+        return hit
+
+    def put(self, key, kind, filename):
+        """Store the file filename under key, evicting the least recently
+        used entries if the cache grows past max_size. A file larger than
+        max_size isn't stored."""
+        if os.path.getsize(str(filename)) > self.max_size:
+            return
+        sha = file_hash(filename)
+        obj = self.object_path(sha)
+        if not os.path.exists(obj):
+            if not os.path.isdir(os.path.dirname(obj)):
+                os.makedirs(os.path.dirname(obj))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(obj),
+                                       prefix='.tmp')
+            os.close(fd)
+            shutil.copyfile(str(filename), tmp)
+            os.replace(tmp, obj)
+
+        now = time.time()
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute(
+                    u"INSERT OR REPLACE INTO entries (key, kind, sha256, size, "
+                    u"created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                    [key, kind, sha, os.path.getsize(obj), now, now])
+            if self._size(connection) > self.max_size:
+                self._evict(connection, self.max_size)
+        finally:
+            connection.close()
+
+    def _size(self, connection):
+        return connection.execute(
+            u"SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, "
+            u"size FROM entries)").fetchone()[0]
+
+    def _evict(self, connection, max_size, older_than=None):
+        """Remove entries, least recently used first, until the objects
+        take up at most max_size bytes, and entries last used before
+        older_than. Returns (entries, bytes) removed."""
+        removed = 0
+        freed = 0
+        size = self._size(connection)
+        rows = connection.execute(
+            u"SELECT key, sha256, size, last_used FROM entries "
+            u"ORDER BY last_used").fetchall()
+        for key, sha, entry_size, last_used in rows:
+            if size <= max_size and (older_than is None or
+                                     last_used >= older_than):
+                break
+            with connection:
+                connection.execute(u"DELETE FROM entries WHERE key = ?",
+                                   [key])
+                shared = connection.execute(
+                    u"SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1",
+                    [sha]).fetchone()
+            removed += 1
+            if not shared:
+                try:
+                    os.remove(self.object_path(sha))
+                except OSError:
+                    pass
+                size -= entry_size
+                freed += entry_size
+        return removed, freed
+
+    def prune(self, max_size=None, older_than=None):
+        """Evict least recently used entries until the cache is at most
+        max_size bytes (default: self.max_size), and entries not used
+        since older_than (a time.time() value). Returns (entries, bytes)
+        removed."""
+        connection = self.connect()
+        try:
+            return self._evict(connection, self.max_size if max_size is None
+                               else max_size, older_than)
+        finally:
+            connection.close()
+
+    def stats(self):
+        """Return a dictionary of the number of entries and objects, their
+        size, hits and misses, and entries and bytes by kind."""
+        connection = self.connect()
+        try:
+            stats = dict(connection.execute(
+                u"SELECT name, value FROM counters").fetchall())
+            stats.setdefault('hits', 0)
+            stats.setdefault('misses', 0)
+            stats['entries'] = connection.execute(
+                u"SELECT COUNT(*) FROM entries").fetchone()[0]
+            stats['objects'] = connection.execute(
+                u"SELECT COUNT(DISTINCT sha256) FROM entries").fetchone()[0]
+            stats['size'] = self._size(connection)
+            stats['kinds'] = dict(
+                (kind, (count, size)) for kind, count, size in
+                connection.execute(
+                    u"SELECT kind, COUNT(*), SUM(size) FROM entries "
+                    u"GROUP BY kind ORDER BY kind"))
+            return stats
+        finally:
+            connection.close()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path=default_cache):
+    """Return the ArtifactCache at path, shared by every caller in the
+    process."""
+    key = os.path.abspath(os.path.expanduser(str(path)))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ArtifactCache(key)
+        return _caches[key]
+
+
+cache_option = click.option(
+    '--cache-dir', default=default_cache, type=click.Path(file_okay=False),
+    help="Build artifact cache (default: {0})".format(default_cache))
+
+
+@click.group(help="Inspect and trim the build artifact cache")
+@cache_option
+@click.pass_context
+def cache(ctx, cache_dir):
+    ctx.obj = get_cache(cache_dir)
+
+
+@cache.command(help="Show the size and hit rate of the cache")
+@click.pass_obj
+def stats(artifacts):
+    stats = artifacts.stats()
+    lookups = stats['hits'] + stats['misses']
+    click.echo("{0}: {1} entries, {2} objects, {3}".format(
+        artifacts.path, stats['entries'], stats['objects'],
+        sizeof_fmt(stats['size'])))
+    for kind, (count, size) in sorted(stats['kinds'].items()):
+        click.echo("  {0:10s} {1:6d} entries  {2:>8s}".format(
+            kind, count, sizeof_fmt(size)))
+    click.echo("{0} hits, {1} misses ({2:.0f}% hit rate)".format(
+        stats['hits'], stats['misses'],
+        100 * stats['hits'] / lookups if lookups else 0))
+
+
+@cache.command(help="Evict least recently used artifacts")
+@click.option('--max-size', default='1G', show_default=True,
+              help="Evict until the cache is at most this size")
+@click.option('--older-than', default=None, type=click.IntRange(0),
+              help="Also evict artifacts not used for this many days")
+@click.pass_obj
+def prune(artifacts, max_size, older_than):
+    removed, freed = artifacts.prune(
+        parse_size(max_size),
+        None if older_than is None else time.time() - 86400 * older_than)
+    click.echo("Removed {0} entries ({1})".format(removed, sizeof_fmt(freed)))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Remove LaTeX intermediate files from a document.
+
+The patterns to remove are read from the document's .gitignore, between the
+'# BEGIN fab clean' and '# END fab clean' lines, so that what ``fab clean``
+removes and what git ignores come from the same list. All of the patterns
+are compiled into a single matcher, the document is walked once with
+os.scandir, and large numbers of files are deleted in parallel.
+"""
+from __future__ import print_function, division, absolute_import
+
+import io
+import os
+import re
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from newtex._git import glob_regex, parse_gitignore
+
+
+begin_marker = '# BEGIN fab clean'
+end_marker = '# END fab clean'
+
+# Used for documents whose .gitignore predates the BEGIN / END markers
+default_patterns = [
+    '*.aux', '*.bak', '*.bbl', '*.blg', '*.dvi', '*.fgx', '*.log', '*.out',
+    '/*.pdf', '*.synctex.gz', '*.sav', '*.spl', '*.tbx', '*.vdx',
+    '*.fdb_latexmk', '*.fls', '*.mp', '*.top', '*.tui', '*.pyc']
+
+# Below this many files, deleting in a thread pool isn't worth it
+parallel_threshold = 64
+
+
+def clean_patterns(doc_dir='.'):
+    """Return the clean patterns from doc_dir's .gitignore."""
+    gitignore = os.path.join(str(doc_dir), '.gitignore')
+    try:
+        with io.open(gitignore, encoding='utf-8') as f:
+            lines = [line.strip() for line in f]
+    except (IOError, OSError):
+        return list(default_patterns)
+
+    if begin_marker not in lines or end_marker not in lines:
+        return list(default_patterns)
+    return lines[lines.index(begin_marker) + 1:lines.index(end_marker)]
+
+
+class Matcher(object):
+    """Match file paths against a list of gitignore-style patterns using
+    two precompiled regular expressions: one for patterns anchored to the
+    document directory, matched against the relative path, and one for
+    the rest, matched against the file name."""
+
+    def __init__(self, patterns):
+        anchored = []
+        names = []
+        for pattern, negate, dir_only, is_anchored in parse_gitignore(patterns):
+            if negate or dir_only:
+                continue
+            (anchored if is_anchored else names).append(glob_regex(pattern))
+        self.anchored = self._compile(anchored)
+        self.names = self._compile(names)
+
+    @staticmethod
+    def _compile(regexes):
+        if not regexes:
+            return None
+        return re.compile('(?:' + '|'.join(regexes) + r')\Z')
+
+    def match(self, rel_path, name):
+        return bool((self.names is not None and self.names.match(name)) or
+                    (self.anchored is not None and
+                     self.anchored.match(rel_path)))
+
+
+def find_files(doc_dir, matcher, recursive=False):
+    """Return a list of (path, size) for files in doc_dir that match."""
+    found = []
+    stack = [(str(doc_dir), '')]
+    while stack:
+        directory, prefix = stack.pop()
+        for entry in os.scandir(directory):
+            if entry.is_dir(follow_symlinks=False):
+                if recursive and entry.name != '.git':
+                    stack.append((entry.path, prefix + entry.name + '/'))
+            elif matcher.match(prefix + entry.name, entry.name):
+                found.append((entry.path,
+                              entry.stat(follow_symlinks=False).st_size))
+    found.sort()
+    return found
+
+
+class CleanReport(object):
+    """The files removed (or that would be removed) by clean_dir, and those
+    that could not be removed, as (path, error)."""
+
+    def __init__(self, files, dry_run, failed=()):
+        self.files = files
+        self.dry_run = dry_run
+        self.failed = list(failed)
+
+    @property
+    def removed(self):
+        failed = set(path for path, error in self.failed)
+        return [(path, size) for path, size in self.files
+                if path not in failed]
+
+    @property
+    def size(self):
+        return sum(size for path, size in self.removed)
+
+    def summary(self):
+        removed = self.removed
+        lines = ["{0} {1}".format("would remove" if self.dry_run
+                                  else "removed", path)
+                 for path, size in removed]
+        lines.extend("could not remove {0}: {1}".format(path, error)
+                     for path, error in self.failed)
+        line = "{0} {1} aux / compiled files ({2:.1f} KB)".format(
+            "Would remove" if self.dry_run else "Removed", len(removed),
+            self.size / 1024)
+        if self.failed:
+            line += "; could not remove {0}".format(len(self.failed))
+        lines.append(line)
+        return "\n".join(lines)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        return path, e.strerror
+    return None
+
+
+def clean_dir(doc_dir='.', recursive=False, dry_run=False, jobs=None,
+              patterns=None):
+    """Remove the files in doc_dir matching patterns (by default, the clean
+    patterns in doc_dir's .gitignore) and return a CleanReport. With
+    recursive=True, subdirectories are cleaned too; with dry_run=True,
+    nothing is removed."""
+    if patterns is None:
+        patterns = clean_patterns(doc_dir)
+    files = find_files(doc_dir, Matcher(patterns), recursive)
+
+    failed = []
+    if not dry_run:
+        paths = [path for path, size in files]
+        if len(paths) < parallel_threshold or jobs == 1:
+            results = [_remove(path) for path in paths]
+        else:
+            workers = jobs or min(32, 4 * multiprocessing.cpu_count())
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_remove, paths))
+        failed = [result for result in results if result is not None]
+
+    return CleanReport(files, dry_run, failed)
+
+
+@click.command(help="Remove LaTeX intermediate files from a document")
+@click.argument('doc_dir', default='.', type=click.Path(file_okay=False,
+                                                        exists=True))
+@click.option('--recursive', '-r', is_flag=True,
+              help="Clean subdirectories too")
+@click.option('--dry-run', '-n', is_flag=True,
+              help="List the files without removing them")
+@click.option('--jobs', '-j', default=None, type=click.IntRange(1),
+              help="Number of files to remove in parallel")
+def clean(doc_dir, recursive, dry_run, jobs):
+    report = clean_dir(doc_dir, recursive, dry_run, jobs)
+    click.echo(report.summary())
+    if report.failed:
+        raise SystemExit(1)
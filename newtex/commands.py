@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+The newtex command line interface.
+
+Subcommands are registered in lazy_commands with their short help, and are
+only imported when they are run, so that newtex --help and shell completion
+don't pay for importing every subcommand's dependencies.
+"""
+from __future__ import print_function, division, absolute_import
+
+import importlib
+
+import click
+
+from newtex.scaffold import (doc_type_choices, default_config_dir,
+                             collision_modes)
+from newtex._tree import link_modes
+from newtex.timing import profile_formats
+
+
+link_mode_choices = click.Choice(link_modes)
+
+collision_option = click.option(
+    '--on-collision', default=None, type=click.Choice(collision_modes),
+    help="If the document name is taken: abort or add a suffix "
+         "(default: config file)")
+
+
+def profile_options(command):
+    """Add the --profile, --profile-output and --profile-format options."""
+    for option in reversed([
+            click.option('--profile', is_flag=True,
+                         help="Print the time taken by each phase"),
+            click.option('--profile-output', default=None,
+                         type=click.Path(dir_okay=False),
+                         help="Write the phase timings to this file"),
+            click.option('--profile-format', default='json',
+                         type=click.Choice(profile_formats),
+                         help="Format for --profile-output: json or chrome "
+                              "(trace event format)")]):
+        command = option(command)
+    return command
+
+
+class LazyGroup(click.Group):
+    """A click group whose subcommands are imported on first use.
+
+    lazy_commands maps each subcommand name to a tuple of
+    ('module:attribute', short help)."""
+
+    def __init__(self, *args, **kwargs):
+        self.lazy_commands = kwargs.pop('lazy_commands', {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(self.lazy_commands))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in self.lazy_commands:
+            module, attribute = self.lazy_commands[name][0].split(':')
+            command = getattr(importlib.import_module(module), attribute)
+            self.add_command(command, name)
+        return super(LazyGroup, self).get_command(ctx, name)
+
+    def command_help(self, name, limit=45):
+        if name in self.commands:
+            return self.commands[name].get_short_help_str(limit)
+        return self.lazy_commands[name][1]
+
+    def format_commands(self, ctx, formatter):
+        limit = formatter.width - 6 - max(len(name) for name in
+                                          self.list_commands(ctx))
+        rows = [(name, self.command_help(name, limit))
+                for name in self.list_commands(ctx)
+                if name not in self.commands or not self.commands[name].hidden]
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+    def shell_complete(self, ctx, incomplete):
+        from click.shell_completion import CompletionItem
+        results = [CompletionItem(name, help=self.command_help(name))
+                   for name in self.list_commands(ctx)
+                   if name.startswith(incomplete)]
+        results.extend(click.Command.shell_complete(self, ctx, incomplete))
+        return results
+
+
+lazy_commands = {
+    'batch': ('newtex.batch:batch',
+              "Create every document listed in a YAML manifest"),
+    'build': ('newtex.build:build',
+              "Build a document, running pdflatex and bibtex only as needed"),
+    'build-all': ('newtex.farm:build_all_command',
+                  "Build every document below ROOTS in parallel"),
+    'bib': ('newtex.bib:bib',
+            "Look up and extract entries from the master bib file"),
+    'cache': ('newtex.cache:cache',
+              "Inspect and trim the build artifact cache"),
+    'config': ('newtex.config:config', "Check the config file"),
+    'figs': ('newtex.figs:figs',
+             "Convert figures for pdflatex and make draft previews"),
+    'find': ('newtex.registry:find',
+             "Find documents whose title or name contains TEXT"),
+    'list': ('newtex.registry:list_documents',
+             "List documents in the registry"),
+    'reindex': ('newtex.registry:reindex_command',
+                "Rebuild the registry by scanning for documents"),
+    'clean': ('newtex.clean:clean',
+              "Remove LaTeX intermediate files from a document"),
+    'styles': ('newtex.styles:styles',
+               "Manage the shared bibliography style store"),
+    'template': ('newtex.pack:template', "Update and pack template directories"),
+    'watch': ('newtex.watch:watch',
+              "Rebuild a document whenever its sources change"),
+}
+
+
+def print_version(ctx, param, value):
+    """Print newtex version at command line.
+    See http://click.pocoo.org/3/options/#callbacks-and-eager-options"""
+    if not value or ctx.resilient_parsing:
+        return
+    from newtex import __version__
+    click.echo("newtex version {0}".format(__version__))
+    ctx.exit()
+
+
+def reconfigure(ctx, param, value):
+    if not value or ctx.resilient_parsing:
+        return
+    from newtex.scaffold import new_path
+    from newtex.manifest import update_template
+
+    config_dir = default_config_dir
+
+    # Configuration file setup
+    config_dir = new_path(config_dir)
+
+    click.confirm(
+        'Reconfigure config directory at {0}?'.format(str(config_dir)), abort=True)
+
+    click.echo(update_template(config_dir).summary())
+
+    ctx.exit()
+
+
+@click.group(help="Create a new LaTeX document with references, etc",
+             cls=LazyGroup, lazy_commands=lazy_commands,
+             invoke_without_command=True)
+@click.option('--doc-type', default=None,
+              help="Document type: FP GR GT etc",
+              type=doc_type_choices)
+@click.option('--destination', default='.', type=click.Path(file_okay=False))
+@click.option('--short-name', default=None, type=click.Path(file_okay=False),
+              help="Short name for document")
+@click.option('--title', default=None, help="Document title")
+@click.option('--config-dir', default=default_config_dir,
+              type=click.Path(),
+              help="Template directory or template pack")
+@click.option('--link-mode', default=None, type=link_mode_choices,
+              help="How to copy template files (default: config file)")
+@click.option('--version', is_flag=True, callback=print_version,
+              expose_value=False, is_eager=True, help="Print newtex version")
+@click.option('--reconfigure', is_flag=True, callback=reconfigure,
+              expose_value=False, is_eager=True,
+              help="Setup config folder again")
+@collision_option
+@profile_options
+@click.pass_context
+def cli(ctx, short_name, title, config_dir, doc_type, destination,
+        link_mode, on_collision, profile, profile_output, profile_format):
+    if ctx.invoked_subcommand is not None:
+        return
+
+    from newtex._git import check_git
+    from newtex.scaffold import load_config, create_document
+    from newtex.timing import Timer
+
+    timer = Timer()
+    try:
+        with timer.phase('load config'):
+            config = load_config(config_dir)
+
+        with timer.phase('check git'):
+            check_git()
+
+        # Handle unset command line arguments
+        if short_name is None:
+            short_name = click.prompt('Short name for document (2-3 words)?')
+
+        if title is None:
+            title = click.prompt("What is the document's title?")
+
+        if doc_type is None:
+            doc_type = click.prompt("""
+        FP: Flight Plan
+        MS: Manuscript
+        GT: Grant
+        GR: Grant Report
+        RP: Report
+
+    What type is the document? [FP, MS, GT, GR, RP]""", type=doc_type_choices)
+
+        # Actual copying, renaming, inserting into template
+        paths = create_document(config, config_dir, doc_type, short_name,
+                                title, destination, link_mode=link_mode,
+                                timer=timer, on_collision=on_collision)
+
+        bare_repo = str(paths['bare_repo'])
+
+        click.echo("""
+    To collaborate with others on this document, share the Dropbox folders,
+
+        {bare_repo}
+        {large_figs_dir}
+
+    To work on this document, go to:
+
+        {doc_dir}
+
+    You should be able to make changes and do:
+
+    git commit -a -m "Message"
+    git pull    [this will pull from the dropbox bare repository]
+    git push    [this will push to the dropbox bare repository]
+    """.format(
+            bare_repo=bare_repo,
+            large_figs_dir=str(paths['large_figs_dir']),
+            doc_dir=str(paths['doc_dir'])))
+
+        if profile:
+            click.echo(timer.report())
+        if profile_output is not None:
+            from newtex.timing import write_profile
+            write_profile(profile_output, [timer], profile_format)
+
+        click.launch(bare_repo, locate=True)
+    except Exception as e:
+        click.echo(e.__doc__)
+        click.echo(str(e))
+        raise e
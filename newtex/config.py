@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Load config.yaml through a compiled snapshot.
+
+Parsing YAML and validating the config on every run is wasted work when
+config.yaml hasn't changed, so once a config file has been parsed and
+validated it is saved as JSON to a snapshot next to it
+(.config.yaml.cache), together with the config file's size, modification
+time and hash; dates are stored as ISO 8601 strings. Later runs use the
+snapshot if the size and modification time match, or if the contents still
+hash the same, and only fall back to parsing (with the C LibYAML loader
+when it is available) and validating otherwise. A config that JSON can't
+hold exactly (non-string keys, binary values, ...) just isn't cached.
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import json
+import hashlib
+import datetime
+import tempfile
+
+import click
+
+from newtex.scaffold import default_config_dir
+
+
+cache_name = '.config.yaml.cache'
+
+# Bump when the snapshot format or the validation rules change
+cache_version = 2
+
+snapshot_keys = ('size', 'mtime', 'sha1', 'config')
+
+
+def cache_file(config_file):
+    return os.path.join(os.path.dirname(str(config_file)), cache_name)
+
+
+def parse_config(data):
+    """Parse YAML config data, using the C loader if available."""
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(data, Loader=loader)
+
+
+def _encode(value):
+    """Return value (parsed YAML) with dates and datetimes tagged as ISO
+    strings, raising TypeError for anything JSON can't round-trip."""
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError("Non-string key in config")
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    raise TypeError("Can't store {0} in a snapshot".format(
+        type(value).__name__))
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return datetime.date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def _read_snapshot(filename):
+    try:
+        with open(filename, 'rb') as f:
+            snapshot = json.loads(f.read().decode('utf-8'),
+                                  object_hook=_decode)
+    except Exception:
+        return None
+    if not isinstance(snapshot, dict) or \
+            snapshot.get('version') != cache_version or \
+            not all(key in snapshot for key in snapshot_keys):
+        return None
+    return snapshot
+
+
+def _write_snapshot(filename, snapshot):
+    try:
+        data = json.dumps(dict(snapshot, config=_encode(snapshot['config'])))
+    except (TypeError, ValueError):
+        return
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                   prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.encode('utf-8'))
+        os.replace(tmp, filename)
+    except (IOError, OSError):
+        # A read-only config directory just means no caching
+        pass
+
+
+def read_config(config_file, verify, use_cache=True):
+    """Return the parsed config in config_file, calling verify(config) on
+    newly parsed configs before they are cached.
+
+    Returns the cached config if config_file hasn't changed since it was
+    last parsed and verified."""
+    config_file = str(config_file)
+    snapshot_file = cache_file(config_file)
+    st = os.stat(config_file)
+
+    snapshot = _read_snapshot(snapshot_file) if use_cache else None
+    if snapshot is not None and snapshot['size'] == st.st_size and \
+            snapshot['mtime'] == st.st_mtime:
+        return snapshot['config']
+
+    with open(config_file, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+
+    if snapshot is not None and snapshot['sha1'] == digest:
+        config = snapshot['config']
+    else:
+        config = parse_config(data)
+        verify(config)
+
+    _write_snapshot(snapshot_file, {
+        'version': cache_version, 'size': st.st_size, 'mtime': st.st_mtime,
+        'sha1': digest, 'config': config})
+    return config
+
+
+@click.group(help="Check the config file")
+def config():
+    pass
+
+
+@config.command(help="Validate config.yaml and rebuild its cached snapshot")
+@click.option('--config-dir', default=default_config_dir, type=click.Path(),
+              help="Template directory or template pack")
+def check(config_dir):
+    from newtex.scaffold import (new_path, verify_config, template_pack,
+                                 load_config)
+
+    if template_pack(config_dir) is not None:
+        # Packs are read whole; there is no snapshot
+        config = load_config(config_dir)
+        click.echo("config.yaml in {0} is valid ({1} settings)".format(
+            config_dir, len(config)))
+        return
+
+    config_file = new_path(config_dir)/'config.yaml'
+    if not config_file.exists():
+        raise click.ClickException(
+            "{0} does not exist; run newtex to set it up".format(
+                str(config_file)))
+
+    snapshot = cache_file(config_file)
+    if os.path.exists(snapshot):
+        os.remove(snapshot)
+
+    config = read_config(config_file, verify_config)
+    click.echo("{0} is valid ({1} settings)".format(str(config_file),
+                                                    len(config)))
+    if os.path.exists(snapshot):
+        click.echo("Cached snapshot written to {0}".format(snapshot))
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Build every document below a directory, in parallel.
+
+    newtex build-all ~/Dropbox/grants --type GT --type GR --json builds.json
+
+Documents are found by their directory names (see
+newtex.scaffold.dir_doc_names), or taken from the registry with
+--from-registry. Each is built with the incremental build (newtex.build)
+on a pool of one worker per CPU. The documents expected to take longest,
+according to the pdflatex and bibtex timings their last builds recorded,
+start first, so that a slow document doesn't start last and hold up the
+whole run; documents never built before are treated as the slowest.
+As with newtex build, each document's figures are converted (newtex.figs)
+before it is built. Each build gets its own temporary directory (TMPDIR),
+removed afterwards.
+
+A summary table is printed and, with --json, the result of every build is
+written as JSON. The exit status is 1 if any document failed to build.
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import time
+import shutil
+import tempfile
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from newtex.scaffold import doc_types
+from newtex.registry import registry_option
+from newtex.cache import cache_option, get_cache
+from newtex.build import (BuildReport, build_document, find_main,
+                          default_engine, default_bibtex, _read_state)
+
+
+def discover(roots, doc_type=(), registry=None, jobs=None):
+    """Return the document directories below roots (or, if registry is
+    given, recorded in it), optionally only those of the types in
+    doc_type, sorted by path."""
+    if registry is not None:
+        from newtex.registry import Registry
+        rows = Registry(registry).find()
+        found = [(row['doc_dir'], row['doc_type']) for row in rows
+                 if row['doc_dir'] and os.path.isdir(row['doc_dir'])]
+    else:
+        from newtex.registry import scan
+        found = [(record['doc_dir'], record['doc_type'])
+                 for record in scan(roots, jobs)]
+    return sorted(set(path for path, kind in found
+                      if not doc_type or kind in doc_type))
+
+
+def estimate(doc_dir):
+    """Return the estimated time of a full build of doc_dir from its last
+    builds' timings, or None if it hasn't been built."""
+    state = _read_state(doc_dir)
+    return BuildReport(None, None, state.get('seconds_per_run')).full_cycle
+
+
+def schedule(documents):
+    """Return [(doc_dir, estimate)] longest first, unknown estimates first
+    of all."""
+    estimates = [(doc_dir, estimate(doc_dir)) for doc_dir in documents]
+    return sorted(estimates, key=lambda item: (
+        item[1] is not None, -(item[1] or 0), item[0]))
+
+
+class FarmResult(object):
+    """The outcome of building one document."""
+
+    def __init__(self, doc_dir, estimate=None, report=None, seconds=0.0,
+                 error=None, traceback=None):
+        self.doc_dir = doc_dir
+        self.estimate = estimate
+        self.report = report
+        self.seconds = seconds
+        self.error = error
+        self.traceback = traceback
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_dict(self):
+        data = {'doc_dir': self.doc_dir, 'ok': self.ok,
+                'seconds': round(self.seconds, 3), 'estimate': self.estimate,
+                'error': self.error}
+        if self.report is not None:
+            data.update({'tex_file': self.report.tex_file,
+                         'latex_runs': self.report.count('latex'),
+                         'bibtex_runs': self.report.count('bibtex'),
+                         'cached': self.report.cached,
+                         'up_to_date': self.report.up_to_date})
+        return data
+
+
+class FarmReport(object):
+    """Results for a whole build-all run, in the order builds started."""
+
+    def __init__(self, results, seconds, jobs):
+        self.results = results
+        self.seconds = seconds
+        self.jobs = jobs
+
+    @property
+    def failures(self):
+        return [result for result in self.results if not result.ok]
+
+    def summary(self):
+        lines = ["{0:6s} {1:>9s} {2:>9s}  {3}".format(
+            'status', 'seconds', 'estimate', 'document')]
+        for result in self.results:
+            lines.append("{0:6s} {1:9.2f} {2:>9s}  {3}".format(
+                'ok' if result.ok else 'FAIL', result.seconds,
+                '-' if result.estimate is None
+                else "{0:.2f}".format(result.estimate), result.doc_dir))
+            if not result.ok:
+                lines.extend("         " + line
+                             for line in result.error.splitlines())
+        lines.append("")
+        lines.append("Built {0} of {1} documents in {2:.2f} s with {3} "
+                     "workers".format(len(self.results) - len(self.failures),
+                                      len(self.results), self.seconds,
+                                      self.jobs))
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {'ok': not self.failures, 'seconds': round(self.seconds, 3),
+                'jobs': self.jobs, 'failures': len(self.failures),
+                'documents': [result.to_dict() for result in self.results]}
+
+
+def build_one(doc_dir, estimate=None, **kwargs):
+    """Convert doc_dir's figures (newtex.figs) and build it with its own
+    temporary directory, returning a FarmResult rather than raising. kwargs
+    are passed to newtex.build.build_document."""
+    from newtex.figs import update_figures
+
+    tmpdir = tempfile.mkdtemp(prefix='newtex-build-')
+    env = dict(os.environ, TMPDIR=tmpdir, TMP=tmpdir, TEMP=tmpdir)
+    start = time.time()
+    try:
+        tex_file = find_main(doc_dir)
+        update_figures(doc_dir, tex_file, kwargs.get('draft', False),
+                       kwargs.get('cache'))
+        report = build_document(doc_dir, tex_file, env=env, **kwargs)
+    except click.ClickException as e:
+        return FarmResult(doc_dir, estimate, seconds=time.time() - start,
+                          error=e.format_message())
+    except Exception as e:
+        return FarmResult(doc_dir, estimate, seconds=time.time() - start,
+                          error="{0}: {1}".format(type(e).__name__, e),
+                          traceback=traceback.format_exc())
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return FarmResult(doc_dir, estimate, report, time.time() - start)
+
+
+def build_all(documents, jobs=0, echo=None, **kwargs):
+    """Build every document directory in documents, longest first, jobs at
+    a time (jobs=0 uses one per CPU). echo, if given, is called with a
+    line as each build finishes. Returns a FarmReport."""
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+    planned = schedule(documents)
+    start = time.time()
+
+    def build(item):
+        result = build_one(item[0], item[1], **kwargs)
+        if echo is not None:
+            echo("{0:4s} {1:7.2f} s  {2}".format(
+                'ok' if result.ok else 'FAIL', result.seconds, result.doc_dir))
+        return result
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(build, planned))
+    return FarmReport(results, time.time() - start, jobs)
+
+
+@click.command('build-all', help="Build every document below ROOTS in "
+                                 "parallel")
+@click.argument('roots', nargs=-1, type=click.Path(exists=True,
+                                                    file_okay=False))
+@click.option('--type', 'doc_type', multiple=True,
+              type=click.Choice(doc_types),
+              help="Only build documents of this type (repeatable)")
+@click.option('--from-registry', is_flag=True,
+              help="Build the documents in the registry instead of "
+                   "scanning ROOTS")
+@registry_option
+@click.option('--jobs', '-j', default=0, type=click.IntRange(0),
+              help="Number of builds to run at once (0: one per CPU)")
+@click.option('--engine', default=default_engine, show_default=True,
+              help="LaTeX command")
+@click.option('--bibtex', default=default_bibtex, show_default=True,
+              help="BibTeX command")
+@click.option('--force', '-f', is_flag=True,
+              help="Rebuild every document, even if nothing changed")
+@cache_option
+@click.option('--no-cache', is_flag=True,
+              help="Don't use or fill the build artifact cache")
+@click.option('--json', 'json_file', default=None,
+              type=click.Path(dir_okay=False, allow_dash=True),
+              help="Write the results as JSON to this file ('-' for stdout)")
+def build_all_command(roots, doc_type, from_registry, registry, jobs,
+                      engine, bibtex, force, cache_dir, no_cache, json_file):
+    import json
+
+    documents = discover(roots or ['.'], doc_type,
+                         registry if from_registry else None)
+    if not documents:
+        raise click.ClickException("No documents found")
+    report = build_all(documents, jobs, echo=click.echo if json_file != '-'
+                       else None, engine=engine, bibtex=bibtex, force=force,
+                       cache=None if no_cache else get_cache(cache_dir))
+
+    if json_file is not None:
+        with click.open_file(json_file, 'w') as f:
+            json.dump(report.to_dict(), f, indent=1)
+            f.write('\n')
+    if json_file != '-':
+        click.echo("")
+        click.echo(report.summary())
+    if report.failures:
+        raise SystemExit(1)
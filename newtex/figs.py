@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+Convert figures into forms pdflatex can include, and make light previews
+for draft builds.
+
+pdflatex can't include SVG, EPS or TIFF files, and very large PNGs make
+every build slow. The figure sources in figs/ and in the directories of
+the document's \\graphicspath (the Dropbox figures folder, by default) are
+converted into .newtex_figs/ in the document:
+
+    .newtex_figs/final/   build-ready figures
+        .svg            -> .pdf  (inkscape)
+        .eps, .ps       -> .pdf  (epstopdf)
+        .tif, .bmp, ... -> .png  (ImageMagick)
+        .png, .jpg larger than --max-pixels -> downscaled copy
+    .newtex_figs/draft/   a small raster preview of every figure, with the
+                          same name as the figure LaTeX would include
+
+A figure keeps its path relative to its source directory, so
+\\includegraphics{figs/plot} or, through the \\graphicspath,
+\\includegraphics{plot} still finds it: newtex build puts the final or
+(with --draft) draft directory first on TEXINPUTS, ahead of the sources.
+
+Only figures whose source or conversion settings changed are converted,
+on a pool of one worker per CPU, and converted figures are kept in the
+artifact cache (newtex.cache) under the hash of the source and the
+settings, so the same figure in another document isn't converted again.
+
+    newtex figs
+    newtex figs --draft
+    newtex build --draft
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import json
+import time
+import shlex
+import struct
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from newtex.styles import file_hash
+from newtex.util import run
+from newtex.cache import cache_key, cache_option, get_cache
+
+
+figs_dir = '.newtex_figs'
+modes = ('final', 'draft')
+default_max_pixels = 3000
+default_preview_pixels = 600
+default_density = 72
+
+# Command lines for each kind of conversion, formatted with the source and
+# output file names and the size in pixels
+converters = {
+    'svg': "inkscape --export-type=pdf --export-filename={output} {source}",
+    'eps': "epstopdf --outfile={output} {source}",
+    'raster': "convert {source}[0] -resize {size}x{size}> {output}",
+    'preview': "convert -density {density} {source}[0] -background white "
+               "-flatten -resize {size}x{size}> {output}",
+}
+
+# Source extension: (final extension, converter), or None if pdflatex can
+# include the source as it is
+formats = {
+    '.svg': ('.pdf', 'svg'),
+    '.eps': ('.pdf', 'eps'),
+    '.ps': ('.pdf', 'eps'),
+    '.tif': ('.png', 'raster'),
+    '.tiff': ('.png', 'raster'),
+    '.bmp': ('.png', 'raster'),
+    '.gif': ('.png', 'raster'),
+    '.pdf': None,
+    '.png': None,
+    '.jpg': None,
+    '.jpeg': None,
+}
+
+
+def image_size(filename):
+    """Return the (width, height) in pixels of a PNG or JPEG file, or None
+    for other files."""
+    try:
+        with open(filename, 'rb') as f:
+            head = f.read(26)
+            if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+                return struct.unpack('>II', head[16:24])
+            if head[:2] != b'\xff\xd8':
+                return None
+            f.seek(2)
+            while True:
+                marker = f.read(4)
+                if len(marker) < 4 or marker[0:1] != b'\xff':
+                    return None
+                kind, length = marker[1], struct.unpack('>H', marker[2:])[0]
+                if 0xc0 <= kind <= 0xcf and kind not in (0xc4, 0xc8, 0xcc):
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    return width, height
+                f.seek(length - 2, 1)
+    except (IOError, OSError, struct.error):
+        return None
+
+
+def figure_roots(doc_dir, tex_file=None):
+    """Return [(directory, prefix)]: figs/ in doc_dir, whose figures are
+    included as figs/name, and the directories in tex_file's
+    \\graphicspath, whose figures are included by their name alone."""
+    from newtex.watch import graphics_paths
+    doc_dir = os.path.abspath(str(doc_dir))
+    roots = [(os.path.join(doc_dir, 'figs'), 'figs/')]
+    if tex_file is not None:
+        roots.extend((path, '') for path in graphics_paths(doc_dir, tex_file))
+    return [(path, prefix) for path, prefix in roots if os.path.isdir(path)]
+
+
+def find_sources(roots):
+    """Return {name: [source files]} for the figures in roots, where name
+    is the path LaTeX includes the figure by, without its extension."""
+    sources = {}
+    for root, prefix in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(filenames):
+                stem, ext = os.path.splitext(filename)
+                if filename.startswith('.') or ext.lower() not in formats:
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, stem), root)
+                sources.setdefault(prefix + rel.replace(os.sep, '/'),
+                                   []).append(os.path.join(dirpath, filename))
+    return sources
+
+
+class Figure(object):
+    """One output: source converted by converter (a key of converters) into
+    output (relative to the mode's directory), at most size pixels."""
+
+    def __init__(self, source, output, converter, size=None):
+        self.source = source
+        self.output = output
+        self.converter = converter
+        self.size = size
+
+
+def plan(sources, draft=False, max_pixels=default_max_pixels,
+         preview_pixels=default_preview_pixels):
+    """Return the Figures to make from sources (see find_sources). Raises
+    ClickException if two sources would make the same figure."""
+    figures = {}
+    for name, files in sorted(sources.items()):
+        for source in files:
+            ext = os.path.splitext(source)[1].lower()
+            if formats[ext] is None:
+                output, converter, size = name + ext, None, None
+                pixels = image_size(source)
+                if pixels is not None and max(pixels) > max_pixels:
+                    converter, size = 'raster', max_pixels
+            else:
+                output, converter = name + formats[ext][0], formats[ext][1]
+                size = max_pixels if converter == 'raster' else None
+            if draft:
+                converter, size = 'preview', preview_pixels
+            if converter is None:
+                continue
+            if output in figures:
+                raise click.ClickException(
+                    "Both {0} and {1} would make {2}".format(
+                        figures[output].source, source, output))
+            figures[output] = Figure(source, output, converter, size)
+    return [figures[output] for output in sorted(figures)]
+
+
+class FigureReport(object):
+    """What convert_figures did for each figure, and how long it took."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.converted = []
+        self.cached = []
+        self.unchanged = []
+        self.removed = []
+        self.failed = []
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def summary(self):
+        lines = ["{0}: {1}".format(output, error)
+                 for output, error in self.failed]
+        lines.append(
+            "{0} figures: {1} converted, {2} from the cache, {3} unchanged, "
+            "{4} removed in {5:.2f} s".format(
+                self.mode.capitalize(), len(self.converted), len(self.cached),
+                len(self.unchanged), len(self.removed), self.seconds))
+        return "\n".join(lines)
+
+
+def output_dir(doc_dir, draft=False):
+    return os.path.join(str(doc_dir), figs_dir, modes[bool(draft)])
+
+
+def texinputs(doc_dir, draft=False, env=None):
+    """Return a copy of env (default: os.environ) with the converted
+    figures for doc_dir first on TEXINPUTS, if there are any."""
+    env = dict(os.environ if env is None else env)
+    path = output_dir(doc_dir, draft)
+    if os.path.isdir(path):
+        env['TEXINPUTS'] = os.path.abspath(path) + '//' + os.pathsep + \
+            env.get('TEXINPUTS', '')
+    return env
+
+
+def _read_state(doc_dir):
+    try:
+        with open(os.path.join(str(doc_dir), figs_dir, 'state.json')) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_state(doc_dir, state):
+    with open(os.path.join(str(doc_dir), figs_dir, 'state.json'), 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+
+def _source_hash(source, previous):
+    """Return [size, mtime_ns, sha256] for source, reusing previous if the
+    size and modification time haven't changed."""
+    st = os.stat(source)
+    if previous is not None and previous[:2] == [st.st_size, st.st_mtime_ns]:
+        return previous
+    return [st.st_size, st.st_mtime_ns, file_hash(source)]
+
+
+def _convert(figure, filename, commands, density, log):
+    """Run figure's converter, writing filename. Returns an error message,
+    or None if it succeeded."""
+    stem, ext = os.path.splitext(filename)
+    tmp = os.path.join(os.path.dirname(filename),
+                       '.tmp-' + os.path.basename(stem) + ext)
+    args = [arg.format(source=figure.source, output=tmp, size=figure.size,
+                       density=density)
+            for arg in shlex.split(commands[figure.converter])]
+    try:
+        result = run(args, log=log, echo=log is not None)
+    except OSError:
+        return "{0} not found".format(args[0])
+    if not result.ok or not os.path.exists(tmp):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return "{0} failed: {1}".format(
+            args[0], " ".join(result.output[-3:]) or
+            "exit status {0}".format(result.returncode))
+    os.replace(tmp, filename)
+    return None
+
+
+def convert_figures(doc_dir='.', tex_file=None, draft=False, jobs=0,
+                    cache=None, commands=None, max_pixels=default_max_pixels,
+                    preview_pixels=default_preview_pixels,
+                    density=default_density, log=None):
+    """Make the final (or, with draft=True, draft) figures for the document
+    in doc_dir from the sources in figs/ and tex_file's \\graphicspath,
+    converting jobs at a time (jobs=0: one per CPU). Figures whose source
+    and settings are unchanged are left alone, and figures in cache (a
+    newtex.cache.ArtifactCache) are copied from it. commands overrides
+    entries of converters. Returns a FigureReport."""
+    start = time.time()
+    mode = modes[bool(draft)]
+    report = FigureReport(mode)
+    commands = dict(converters, **(commands or {}))
+    figures = plan(find_sources(figure_roots(doc_dir, tex_file)), draft,
+                   max_pixels, preview_pixels)
+    target = output_dir(doc_dir, draft)
+
+    state = _read_state(doc_dir)
+    previous = state.get(mode, {})
+    current = {}
+    pending = []
+    for figure in figures:
+        old = previous.get(figure.output, {})
+        source_hash = _source_hash(figure.source, old.get('hash'))
+        key = cache_key('fig', mode, commands[figure.converter], figure.size,
+                        density, source_hash[2])
+        current[figure.output] = {'source': figure.source,
+                                  'hash': source_hash, 'key': key}
+        filename = os.path.join(target, *figure.output.split('/'))
+        if old.get('key') == key and os.path.exists(filename):
+            report.unchanged.append(figure.output)
+        else:
+            pending.append((figure, filename, key))
+
+    def convert(item):
+        figure, filename, key = item
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        if cache is not None and cache.get(key, filename):
+            report.cached.append(figure.output)
+            return
+        error = _convert(figure, filename, commands, density, log)
+        if error is not None:
+            report.failed.append((figure.output, error))
+            # Keep the figure from before, if there is one, and retry next
+            # time
+            if figure.output in previous:
+                current[figure.output] = previous[figure.output]
+            else:
+                del current[figure.output]
+        else:
+            report.converted.append(figure.output)
+            if cache is not None:
+                cache.put(key, 'fig', filename)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=jobs or
+                                multiprocessing.cpu_count()) as executor:
+            list(executor.map(convert, pending))
+
+    for output in sorted(set(previous) - set(current)):
+        filename = os.path.join(target, *output.split('/'))
+        if os.path.exists(filename):
+            os.remove(filename)
+            report.removed.append(output)
+
+    if figures or previous:
+        os.makedirs(os.path.join(str(doc_dir), figs_dir), exist_ok=True)
+        state[mode] = current
+        _write_state(doc_dir, state)
+    for outputs in (report.converted, report.cached, report.failed):
+        outputs.sort()
+    report.seconds = time.time() - start
+    return report
+
+
+def update_figures(doc_dir, tex_file, draft=False, cache=None, echo=None):
+    """Convert the figures that changed before a build, with the default
+    settings, sending the summary to echo if anything was converted or
+    failed. Failures don't stop the build; LaTeX reports any figure that
+    is missing."""
+    report = convert_figures(doc_dir, tex_file, draft, cache=cache)
+    if echo is not None and (report.converted or report.cached or
+                             report.removed or report.failed):
+        echo(report.summary())
+    return report
+
+
+def parse_converters(ctx, param, value):
+    """Parse --converter KIND=COMMAND options into a dictionary."""
+    commands = {}
+    for item in value:
+        kind, _, command = item.partition('=')
+        if kind not in converters or not command:
+            raise click.BadParameter(
+                "expected KIND=COMMAND with KIND one of {0}".format(
+                    ", ".join(sorted(converters))))
+        commands[kind] = command
+    return commands
+
+
+@click.command(help="Convert figures for pdflatex and make draft previews")
+@click.argument('doc_dir', default='.', type=click.Path(file_okay=False,
+                                                        exists=True))
+@click.option('--tex', default=None,
+              help="Main .tex file (default: the one with a \\documentclass)")
+@click.option('--draft', is_flag=True,
+              help="Make the draft previews instead of the final figures")
+@click.option('--jobs', '-j', default=0, type=click.IntRange(0),
+              help="Number of conversions to run at once (0: one per CPU)")
+@click.option('--converter', 'commands', multiple=True,
+              callback=parse_converters, metavar='KIND=COMMAND',
+              help="Command for one kind of conversion (svg, eps, raster or "
+                   "preview), with {source}, {output} and {size}")
+@click.option('--max-pixels', default=default_max_pixels,
+              type=click.IntRange(1), show_default=True,
+              help="Downscale larger images for the final build")
+@click.option('--preview-pixels', default=default_preview_pixels,
+              type=click.IntRange(1), show_default=True,
+              help="Size of draft previews")
+@click.option('--verbose', '-v', is_flag=True,
+              help="Show the output of the conversion commands")
+@cache_option
+@click.option('--no-cache', is_flag=True,
+              help="Don't use or fill the build artifact cache")
+def figs(doc_dir, tex, draft, jobs, commands, max_pixels, preview_pixels,
+         verbose, cache_dir, no_cache):
+    from newtex.build import find_main
+
+    report = convert_figures(
+        doc_dir, tex or find_main(doc_dir), draft, jobs,
+        None if no_cache else get_cache(cache_dir), commands, max_pixels,
+        preview_pixels, log=click.echo if verbose else None)
+    click.echo(report.summary())
+    if not report.ok:
+        raise SystemExit(1)
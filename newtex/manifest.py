@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Update a config directory from the package's template without clobbering
+the user's edits.
+
+newtexrc_manifest.json, shipped next to newtexrc, lists the path, size and
+sha256 hash of every template file. When the template is installed into a
+config directory, the manifest of what was installed is saved there as
+.newtex_manifest.json. On update, a file is only considered if its upstream
+hash differs from the installed one, so an update with no upstream changes
+reads no template files at all. A changed file is rewritten only if the
+user hasn't modified it since it was installed (or force is given).
+
+Config directories set up by releases before the manifest existed have no
+.newtex_manifest.json, so the package manifest also lists, under
+'previous', the hashes of earlier releases' versions of each file; a file
+matching one of them is unmodified and is updated. Regenerating the
+manifest adds the hashes it replaces to 'previous'.
+
+After changing anything in newtexrc, regenerate the package manifest with
+
+    python -m newtex.manifest
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import json
+import shutil
+import tempfile
+
+import click
+
+from newtex.styles import file_hash
+
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+template_dir = os.path.join(package_dir, 'newtexrc')
+package_manifest = os.path.join(package_dir, 'newtexrc_manifest.json')
+
+installed_name = '.newtex_manifest.json'
+
+
+def build_manifest(src_dir=template_dir):
+    """Return {path: {'size', 'sha256'}} for every file in src_dir, with
+    '/'-separated paths relative to src_dir."""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(str(src_dir)):
+        dirnames[:] = [d for d in dirnames if d != '__pycache__']
+        rel_dir = os.path.relpath(dirpath, str(src_dir)).replace(os.sep, '/')
+        prefix = '' if rel_dir == '.' else rel_dir + '/'
+        for filename in filenames:
+            full = os.path.join(dirpath, filename)
+            files[prefix + filename] = {'size': os.path.getsize(full),
+                                        'sha256': file_hash(full)}
+    return files
+
+
+def _read(filename, key='files'):
+    try:
+        with open(filename) as f:
+            return json.load(f)[key]
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def _write(filename, files, previous=None):
+    data = {'files': files}
+    if previous is not None:
+        data['previous'] = previous
+    with open(filename, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def read_package_manifest():
+    files = _read(package_manifest)
+    if files is None:
+        raise click.ClickException(
+            "The package manifest {0} is missing; run "
+            "python -m newtex.manifest".format(package_manifest))
+    return files
+
+
+def read_previous():
+    """Return {path: [{'size', 'sha256'}]} for the earlier releases'
+    versions of the template files."""
+    return _read(package_manifest, 'previous') or {}
+
+
+def merge_previous(previous, old, new):
+    """Return previous with the entries of manifest old that manifest new
+    replaces added."""
+    merged = dict((path, list(entries)) for path, entries in previous.items())
+    for path, entry in sorted(old.items()):
+        if new.get(path) != entry and entry not in merged.get(path, []):
+            merged.setdefault(path, []).append(entry)
+    return merged
+
+
+class UpdateReport(object):
+    """The files written, left alone because the user modified them, and
+    unchanged, by update_template."""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.written = []
+        self.modified = []
+        self.unchanged = 0
+
+    def summary(self):
+        lines = ["{0} {1}".format("would update" if self.dry_run
+                                  else "updated", path)
+                 for path in self.written]
+        lines.extend("skipped {0} (modified; overwrite with newtex template "
+                     "update --force)".format(path) for path in self.modified)
+        lines.append("{0} {1} files, skipped {2} modified files, {3} "
+                     "unchanged".format("Would update" if self.dry_run
+                                        else "Updated", len(self.written),
+                                        len(self.modified), self.unchanged))
+        return "\n".join(lines)
+
+
+def _user_state(full, installed, upstream, previous=()):
+    """Return 'missing', 'upstream' (already the upstream content),
+    'installed' (unmodified since it was installed, or an earlier release's
+    version, in previous) or 'modified'."""
+    try:
+        size = os.path.getsize(full)
+    except OSError:
+        return 'missing'
+    known = [e for e in [installed] + list(previous) if e is not None]
+    if size not in [e['size'] for e in known + [upstream]]:
+        return 'modified'
+    sha = file_hash(full)
+    if sha == upstream['sha256']:
+        return 'upstream'
+    if any(sha == e['sha256'] for e in known):
+        return 'installed'
+    return 'modified'
+
+
+def _replace(src, dst):
+    """Copy src over dst by renaming a new file into place, so that
+    documents hard-linked to dst (see newtex._tree) keep their copy."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copy(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def update_template(config_dir, force=False, dry_run=False,
+                    src_dir=template_dir, manifest=None, previous=None):
+    """Bring the template files in config_dir up to date with src_dir (by
+    default, the package's template), described by manifest (by default,
+    the package manifest, with its previous hashes). Returns an
+    UpdateReport."""
+    config_dir = os.path.expanduser(str(config_dir))
+    if manifest is None:
+        manifest = read_package_manifest()
+        if previous is None:
+            previous = read_previous()
+    previous = previous or {}
+    installed_file = os.path.join(config_dir, installed_name)
+    installed = _read(installed_file) or {}
+    report = UpdateReport(dry_run)
+
+    new_installed = {}
+    for path in sorted(manifest):
+        upstream = manifest[path]
+        entry = installed.get(path)
+        if entry is not None and entry['sha256'] == upstream['sha256']:
+            new_installed[path] = entry
+            report.unchanged += 1
+            continue
+
+        full = os.path.join(config_dir, *path.split('/'))
+        state = _user_state(full, entry, upstream,
+                            previous.get(path, ()))
+        if state == 'upstream':
+            new_installed[path] = upstream
+            report.unchanged += 1
+        elif state == 'modified' and not force:
+            if entry is not None:
+                new_installed[path] = entry
+            report.modified.append(path)
+        else:
+            report.written.append(path)
+            new_installed[path] = upstream
+            if not dry_run:
+                parent = os.path.dirname(full)
+                if not os.path.isdir(parent):
+                    os.makedirs(parent)
+                _replace(os.path.join(str(src_dir), *path.split('/')), full)
+
+    if not dry_run and new_installed != installed:
+        if not os.path.isdir(config_dir):
+            os.makedirs(config_dir)
+        _write(installed_file, new_installed)
+    return report
+
+
+if __name__ == '__main__':
+    files = build_manifest()
+    _write(package_manifest, files, merge_previous(
+        read_previous(), _read(package_manifest) or {}, files))
+    print("Wrote {0}".format(package_manifest))
@@ -1,16 +1,28 @@
 # -*- coding: utf-8 -*-
+from __future__ import print_function
 import glob
 import os
 import shutil
-from fabric.api import task
+import subprocess
+from fabric.api import task, abort
+
+
+master_bib = "$master_bib"
+dest = "bib/$master_bib_name"
+tex_file = "$doc_name"
 
 
 @task(default=True)
-def copy():
-    master_bib = "$master_bib"
-    dest = "bib/$master_bib_name"
-    shutil.copyfile(master_bib, dest)
-    print("Copied {0}".format(master_bib))
+def copy(mode="$bib_mode"):
+    """Update the bib file from the master bib file; mode=cited copies only
+    the entries cited in the .tex files"""
+    try:
+        from newtex.bib import sync_bib
+    except ImportError:
+        shutil.copyfile(master_bib, dest)
+        print("Copied {0}".format(master_bib))
+    else:
+        print(sync_bib(master_bib, dest, mode))
 
 
 @task
@@ -18,12 +30,55 @@ def help():
     print("""\
 Commands:
 
-    copy            copy bib file to refs [default]
-    clean           remove latex intermediate files""")
+    copy            update bib file from the master bib file [default]
+    copy:cited      only copy the entries cited in the .tex files
+    build           run pdflatex and bibtex, only as often as needed
+    build:force=y   ... even if nothing changed
+    build:draft=y   ... with small previews of the figures
+    clean           remove latex intermediate files
+    clean:recursive=y,dry_run=y
+                    ... in subdirectories too, without removing anything""")
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'y')
 
 
 @task
-def clean():
+def build(force=False, draft=False):
+    """Build the document, rerunning pdflatex and bibtex only when their
+    inputs changed; use build:force=y to rerun everything, build:draft=y to
+    use previews of the figures"""
+    try:
+        from newtex.build import build_document
+        from newtex.cache import get_cache
+        from newtex.figs import update_figures
+    except ImportError:
+        job = os.path.splitext(tex_file)[0]
+        for args in (['pdflatex', tex_file], ['bibtex', job],
+                     ['pdflatex', tex_file], ['pdflatex', tex_file]):
+            subprocess.check_call(args)
+    else:
+        update_figures('.', tex_file, _flag(draft), get_cache(), echo=print)
+        print(build_document('.', tex_file, force=_flag(force),
+                             cache=get_cache(), draft=_flag(draft)).summary())
+
+
+@task
+def clean(recursive=False, dry_run=False):
+    """Remove latex intermediate files; use clean:recursive=y,dry_run=y to
+    clean subdirectories or list files without removing them"""
+    try:
+        from newtex.clean import clean_dir
+    except ImportError:
+        pass
+    else:
+        report = clean_dir('.', _flag(recursive), _flag(dry_run))
+        print(report.summary())
+        if report.failed:
+            abort("Could not remove {0} files".format(len(report.failed)))
+        return
+
     globs = [
             '*.aux',
             '*.bak',
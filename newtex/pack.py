@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Pack a template directory into a single archive.
+
+Copying the template directory into a new document opens and stats every
+file in it, which is slow when the template lives on NFS or in a synced
+folder. A template pack holds the whole template (including config.yaml) in
+one file, so that a new document can be extracted from a single read.
+
+A pack is an uncompressed zip file, so it can be inspected with any zip
+tool. Its last member, MANIFEST.json, lists every file with the offset of
+its data in the pack, its size, mode and sha256 hash. Packs are memory
+mapped, and files are written straight from the mapped pack in offset
+order, without going through zipfile.
+
+    newtex template pack ~/newtex_template -o ~/newtex_template.ntpack
+    newtex --config-dir ~/newtex_template.ntpack
+
+The template group also has ``newtex template update``, which updates a
+template directory from the package (see newtex.manifest).
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import json
+import mmap
+import stat
+import struct
+import hashlib
+import zipfile
+import tempfile
+import threading
+
+import click
+
+
+manifest_name = 'MANIFEST.json'
+pack_format = 1
+pack_suffix = '.ntpack'
+
+# Files in a template directory that are never packed
+skip_files = ('.config.yaml.cache', '.newtex_manifest.json')
+
+
+def _template_files(src_dir):
+    """Yield (rel, full) for every file in src_dir, in sorted order."""
+    src_dir = str(src_dir)
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames.sort()
+        rel_dir = os.path.relpath(dirpath, src_dir).replace(os.sep, '/')
+        prefix = '' if rel_dir == '.' else rel_dir + '/'
+        for filename in sorted(filenames):
+            if prefix + filename not in skip_files:
+                yield prefix + filename, os.path.join(dirpath, filename)
+
+
+def write_pack(src_dir, filename):
+    """Pack the template directory src_dir into filename, returning the
+    manifest."""
+    from newtex import __version__
+
+    filename = str(filename)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                               prefix='.tmp')
+    os.close(fd)
+    try:
+        files = []
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED) as zf:
+            for rel, full in _template_files(src_dir):
+                with open(full, 'rb') as f:
+                    data = f.read()
+                info = zipfile.ZipInfo.from_file(full, rel)
+                info.compress_type = zipfile.ZIP_STORED
+                zf.writestr(info, data)
+                files.append({'path': rel, 'size': len(data),
+                              'mode': stat.S_IMODE(os.stat(full).st_mode),
+                              'sha256': hashlib.sha256(data).hexdigest(),
+                              'offset': info.header_offset})
+
+        # Find where each file's data starts, after its local header
+        with open(tmp, 'rb') as f:
+            for entry in files:
+                f.seek(entry['offset'] + 26)
+                name_length, extra_length = struct.unpack('<HH', f.read(4))
+                entry['offset'] += 30 + name_length + extra_length
+
+        manifest = {'format': pack_format, 'newtex_version': __version__,
+                    'files': files}
+        with zipfile.ZipFile(tmp, 'a', zipfile.ZIP_STORED) as zf:
+            zf.writestr(manifest_name, json.dumps(manifest, indent=1))
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return manifest
+
+
+def _excluded(path, exclude):
+    parts = path.split('/')
+    return any('/'.join(parts[:i]) in exclude
+               for i in range(1, len(parts) + 1))
+
+
+class TemplatePack(object):
+    """A memory mapped template pack."""
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        with open(self.filename, 'rb') as f:
+            try:
+                with zipfile.ZipFile(f) as zf:
+                    manifest = json.loads(
+                        zf.read(manifest_name).decode('utf-8'))
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, KeyError, zipfile.BadZipfile):
+                raise click.ClickException(
+                    "{0} is not a newtex template pack".format(self.filename))
+        if manifest.get('format') != pack_format:
+            raise click.ClickException(
+                "{0} has unsupported pack format {1}".format(
+                    self.filename, manifest.get('format')))
+        self.manifest = manifest
+        self.files = dict((entry['path'], entry)
+                          for entry in manifest['files'])
+        self._view = memoryview(self._map)
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def read(self, path):
+        """Return the contents of the file at path in the pack."""
+        entry = self.files[path]
+        return self._view[entry['offset']:entry['offset'] + entry['size']]
+
+    def read_text(self, path):
+        return bytes(self.read(path)).decode('utf-8')
+
+    def verify(self):
+        """Return the paths of files whose contents don't match their
+        hashes."""
+        return [entry['path'] for entry in self.manifest['files']
+                if hashlib.sha256(self.read(entry['path'])).hexdigest() !=
+                entry['sha256']]
+
+    def extract(self, dst, exclude=(), only=None):
+        """Write the pack's files into dst, skipping paths in exclude (and
+        everything below them). If only is given, only those paths are
+        written. Returns the number of files written."""
+        exclude = set(exclude)
+        dst = str(dst)
+        made = set()
+        count = 0
+        for entry in sorted(self.manifest['files'],
+                            key=lambda entry: entry['offset']):
+            path = entry['path']
+            if (only is not None and path not in only) or \
+                    _excluded(path, exclude):
+                continue
+            full = os.path.join(dst, *path.split('/'))
+            parent = os.path.dirname(full)
+            if parent not in made:
+                if not os.path.isdir(parent):
+                    os.makedirs(parent)
+                made.add(parent)
+            with open(full, 'wb') as f:
+                f.write(self.read(path))
+            if entry['mode'] & 0o111:
+                os.chmod(full, entry['mode'])
+            count += 1
+        return count
+
+
+_packs = {}
+_packs_lock = threading.Lock()
+
+
+def open_pack(filename):
+    """Return the TemplatePack for filename, shared by every caller in the
+    process until the file changes."""
+    filename = os.path.abspath(os.path.expanduser(str(filename)))
+    st = os.stat(filename)
+    key = (filename, st.st_size, st.st_mtime)
+    with _packs_lock:
+        if key not in _packs:
+            _packs[key] = TemplatePack(filename)
+        return _packs[key]
+
+
+@click.group(help="Update and pack template directories")
+def template():
+    pass
+
+
+@template.command(help="Pack a template directory into a single archive")
+@click.argument('config_dir', default='~/newtex_template',
+                type=click.Path(file_okay=False))
+@click.option('--output', '-o', default=None, type=click.Path(dir_okay=False),
+              help="Pack file to write (default: CONFIG_DIR{0})".format(
+                  pack_suffix))
+def pack(config_dir, output):
+    config_dir = os.path.expanduser(config_dir)
+    if not os.path.isdir(config_dir):
+        raise click.ClickException(
+            "{0} is not a directory".format(config_dir))
+    if output is None:
+        output = config_dir.rstrip('/\\') + pack_suffix
+    manifest = write_pack(config_dir, output)
+    click.echo("Packed {0} files ({1:.1f} KB) into {2}".format(
+        len(manifest['files']),
+        sum(entry['size'] for entry in manifest['files']) / 1024, output))
+
+
+@template.command(help="Update a template directory from the newtex "
+                       "package, keeping files you have modified")
+@click.argument('config_dir', default='~/newtex_template',
+                type=click.Path(file_okay=False))
+@click.option('--force', is_flag=True,
+              help="Overwrite files you have modified too")
+@click.option('--dry-run', '-n', is_flag=True,
+              help="List the files that would be updated")
+def update(config_dir, force, dry_run):
+    from newtex.manifest import update_template
+    click.echo(update_template(config_dir, force, dry_run).summary())
+
+
+@template.command(help="Check every file in a pack against its hash")
+@click.argument('pack_file', type=click.Path(exists=True, dir_okay=False))
+def verify(pack_file):
+    bad = TemplatePack(pack_file).verify()
+    for path in bad:
+        click.echo("corrupt: {0}".format(path))
+    if bad:
+        raise click.ClickException(
+            "{0} files in {1} are corrupt".format(len(bad), pack_file))
+    click.echo("{0} is intact".format(pack_file))
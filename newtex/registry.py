@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+A registry of every document newtex has created.
+
+Each new document is recorded (type, author, date, title, directory, bare
+repository and large figures directory) in an SQLite database,
+``~/.newtex/registry.sqlite`` by default (``registry`` in config.yaml), with
+indexes on the columns that are queried, so that
+
+    newtex list --type MS --author Dwyer --since 2015-01
+    newtex find cantilever
+
+answer without searching the filesystem. ``newtex reindex`` rebuilds the
+registry by scanning directories (in parallel) for document folders, and
+the Dropbox folder for their bare repositories and figures directories.
+"""
+from __future__ import print_function, division, absolute_import
+
+import io
+import os
+import re
+import sqlite3
+import datetime
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import click
+
+from newtex.scaffold import doc_type_choices, config_default
+
+
+default_registry = '~/.newtex/registry.sqlite'
+
+schema = u"""
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    dir_name TEXT NOT NULL,
+    doc_type TEXT NOT NULL,
+    author TEXT NOT NULL,
+    main_author TEXT,
+    date TEXT NOT NULL,
+    short_name TEXT NOT NULL,
+    title TEXT,
+    doc_dir TEXT UNIQUE,
+    bare_repo TEXT,
+    large_figs_dir TEXT,
+    created TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_dir_name ON documents (dir_name);
+CREATE INDEX IF NOT EXISTS documents_type_date ON documents (doc_type, date);
+CREATE INDEX IF NOT EXISTS documents_author
+    ON documents (author COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS documents_date ON documents (date);
+"""
+
+columns = ('dir_name', 'doc_type', 'author', 'main_author', 'date',
+           'short_name', 'title', 'doc_dir', 'bare_repo', 'large_figs_dir',
+           'created')
+path_columns = ('doc_dir', 'bare_repo', 'large_figs_dir')
+
+# Matches the directory names made by newtex.scaffold.dir_doc_names
+dir_name_re = re.compile(
+    r'^_JAM_(?P<doc_type>[A-Z]{2})__(?P<author>.+?)(?P<year>\d{4})'
+    r'(?P<month>\d{2})__(?P<short_name>.+)$')
+
+title_re = re.compile(r'\\title\{([^}]*)\}')
+
+
+def normpath(path):
+    """Return path (a string or pathlib.Path) as stored in the registry:
+    absolute, with '~' expanded and '..' collapsed."""
+    return os.path.abspath(os.path.expanduser(str(path)))
+
+
+def parse_dir_name(name):
+    """Return the record fields encoded in a document directory name, or
+    None if name isn't one."""
+    match = dir_name_re.match(name)
+    if match is None or name.endswith('.git') or name.endswith('__figs'):
+        return None
+    return {'dir_name': name, 'doc_type': match.group('doc_type'),
+            'author': match.group('author'),
+            'date': u"{0}-{1}-01".format(match.group('year'),
+                                        match.group('month')),
+            'short_name': match.group('short_name')}
+
+
+def read_title(doc_dir, record, max_bytes=1 << 16):
+    """Return the title of the document in doc_dir, read from the start of
+    its .tex file, or None."""
+    tex_file = os.path.join(doc_dir, "{0}{1}__{2}.tex".format(
+        record['author'], record['date'][:7].replace('-', ''),
+        record['short_name']))
+    try:
+        with io.open(tex_file, encoding='utf-8', errors='replace') as f:
+            match = title_re.search(f.read(max_bytes))
+    except (IOError, OSError):
+        return None
+    return match.group(1).strip() if match else None
+
+
+def _date_bound(text, upper=False):
+    """Expand YYYY, YYYY-MM or YYYY-MM-DD to a full date string, at the
+    start or (if upper) the end of the period."""
+    parts = text.split('-')
+    if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+        raise click.BadParameter(
+            "'{0}' is not a date (YYYY, YYYY-MM or YYYY-MM-DD)".format(text))
+    defaults = ['12', '31'] if upper else ['01', '01']
+    parts += defaults[len(parts) - 1:]
+    return u"{0}-{1:0>2}-{2:0>2}".format(*parts)
+
+
+def _like(text):
+    """Return a LIKE pattern (with ESCAPE '\\') matching text anywhere."""
+    for special in ('\\', '%', '_'):
+        text = text.replace(special, '\\' + special)
+    return u"%{0}%".format(text)
+
+
+def _values(record):
+    """Return the values of record for columns, with paths normalized."""
+    return [normpath(record[column])
+            if column in path_columns and record.get(column)
+            else record.get(column) for column in columns]
+
+
+class Registry(object):
+    """The document registry database at path."""
+
+    def __init__(self, path=default_registry):
+        self.path = os.path.abspath(os.path.expanduser(str(path)))
+
+    def connect(self):
+        parent = os.path.dirname(self.path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.executescript(schema)
+        return connection
+
+    def add(self, record):
+        """Record a document; record is a dictionary with keys from
+        columns. A document already recorded at the same doc_dir is
+        replaced."""
+        values = _values(record)
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute(
+                    u"INSERT OR REPLACE INTO documents ({0}) VALUES ({1})"
+                    .format(', '.join(columns), ', '.join('?' * len(columns))),
+                    values)
+        finally:
+            connection.close()
+
+    def remove(self, doc_dir):
+        """Remove the document recorded at doc_dir, if there is one."""
+        if not os.path.exists(self.path):
+            return
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute(u"DELETE FROM documents WHERE doc_dir = ?",
+                                   [normpath(doc_dir)])
+        finally:
+            connection.close()
+
+    def find(self, doc_type=None, author=None, since=None, until=None,
+             title=None, text=None, limit=None):
+        """Return the documents (as sqlite3.Row objects) matching every
+        given condition, newest first. since and until are YYYY, YYYY-MM or
+        YYYY-MM-DD; title matches a substring of the title; text matches a
+        substring of the title, short name or directory name."""
+        where = []
+        args = []
+        if doc_type is not None:
+            where.append(u"doc_type = ?")
+            args.append(doc_type)
+        if author is not None:
+            where.append(u"author = ? COLLATE NOCASE")
+            args.append(author)
+        if since is not None:
+            where.append(u"date >= ?")
+            args.append(_date_bound(since))
+        if until is not None:
+            where.append(u"date <= ?")
+            args.append(_date_bound(until, upper=True))
+        if title is not None:
+            where.append(u"title LIKE ? ESCAPE '\\'")
+            args.append(_like(title))
+        if text is not None:
+            where.append(u"(title LIKE ? ESCAPE '\\' OR "
+                         u"short_name LIKE ? ESCAPE '\\' OR "
+                         u"dir_name LIKE ? ESCAPE '\\')")
+            args.extend([_like(text)] * 3)
+
+        query = u"SELECT * FROM documents"
+        if where:
+            query += u" WHERE " + u" AND ".join(where)
+        query += u" ORDER BY date DESC, dir_name"
+        if limit is not None:
+            query += u" LIMIT {0:d}".format(limit)
+
+        connection = self.connect()
+        try:
+            return connection.execute(query, args).fetchall()
+        finally:
+            connection.close()
+
+    def replace_all(self, records):
+        """Replace every record in the registry with records."""
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute(u"DELETE FROM documents")
+                connection.executemany(
+                    u"INSERT OR REPLACE INTO documents ({0}) VALUES ({1})"
+                    .format(', '.join(columns), ', '.join('?' * len(columns))),
+                    [_values(record) for record in records])
+        finally:
+            connection.close()
+
+
+def document_record(config, paths, doc_type, short_name, title, date):
+    """Return the registry record for a document just created by
+    newtex.scaffold.create_document."""
+    dir_name = paths['doc_dir'].name
+    record = parse_dir_name(dir_name) or {}
+    record.update({
+        'dir_name': dir_name, 'doc_type': doc_type,
+        'main_author': config['authors'][0], 'date': date.isoformat(),
+        'title': title, 'doc_dir': normpath(paths['doc_dir']),
+        'bare_repo': normpath(paths['bare_repo']),
+        'large_figs_dir': normpath(paths['large_figs_dir']),
+        'created': datetime.datetime.now().isoformat()})
+    record.setdefault('author', config['authors'][0].split(' ')[-1])
+    record.setdefault('short_name', short_name)
+    return record
+
+
+def _scan_dir(directory):
+    """Return (records, subdirectories) for one directory."""
+    records = []
+    subdirectories = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return records, subdirectories
+    for entry in entries:
+        if entry.name.startswith('.') or \
+                not entry.is_dir(follow_symlinks=False):
+            continue
+        record = parse_dir_name(entry.name)
+        if record is None:
+            subdirectories.append(entry.path)
+        else:
+            record['doc_dir'] = os.path.abspath(entry.path)
+            record['title'] = read_title(entry.path, record)
+            records.append(record)
+    return records, subdirectories
+
+
+def scan(roots, jobs=None):
+    """Find every document directory below roots, scanning directories
+    with a pool of jobs threads. Document directories aren't searched."""
+    jobs = jobs or min(32, 4 * multiprocessing.cpu_count())
+    records = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = set(executor.submit(_scan_dir, str(root)) for root in roots)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                found, subdirectories = future.result()
+                records.extend(found)
+                pending.update(executor.submit(_scan_dir, subdirectory)
+                               for subdirectory in subdirectories)
+    return records
+
+
+def reindex(registry, roots, dropbox, jobs=None):
+    """Rebuild registry from the document directories below roots and the
+    bare repositories and figures directories in dropbox. Returns the new
+    records."""
+    records = scan(roots, jobs)
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record['dir_name'], []).append(record)
+
+    dropbox = normpath(dropbox)
+    try:
+        names = os.listdir(dropbox)
+    except OSError:
+        names = []
+    names = set(names)
+    for name in sorted(names):
+        if not name.endswith('.git'):
+            continue
+        record = parse_dir_name(name[:-len('.git')])
+        if record is not None and record['dir_name'] not in by_name:
+            by_name[record['dir_name']] = [record]
+            records.append(record)
+
+    for name, matches in by_name.items():
+        for record in matches:
+            if name + '.git' in names:
+                record['bare_repo'] = os.path.join(dropbox, name + '.git')
+            if name + '__figs' in names:
+                record['large_figs_dir'] = os.path.join(dropbox,
+                                                        name + '__figs')
+
+    registry.replace_all(records)
+    return records
+
+
+class NameIndex(object):
+    """The names in use by existing documents, for checking a new
+    document's name before anything is written.
+
+    A name is taken if the destination already contains it, if Dropbox
+    already contains its bare repository or figures directory, if the
+    registry has a document or bare repository at those paths, or if it
+    was claimed earlier through this index. Each directory is listed, and
+    the registry read, once; after that every check is a set lookup."""
+
+    def __init__(self, registry=None):
+        self.registry = registry
+        self._listings = {}
+        self._registered = None
+        self._claimed = set()
+        self._lock = threading.Lock()
+
+    def _names_in(self, directory):
+        if directory not in self._listings:
+            try:
+                self._listings[directory] = set(os.listdir(directory))
+            except OSError:
+                self._listings[directory] = set()
+        return self._listings[directory]
+
+    def _registered_paths(self):
+        if self._registered is None:
+            self._registered = set()
+            if self.registry is not None and \
+                    os.path.exists(self.registry.path):
+                connection = self.registry.connect()
+                try:
+                    for doc_dir, bare_repo in connection.execute(
+                            u"SELECT doc_dir, bare_repo FROM documents"):
+                        self._registered.update([doc_dir, bare_repo])
+                finally:
+                    connection.close()
+        return self._registered
+
+    def _paths(self, dir_name, destination, dropbox):
+        destination = normpath(destination)
+        dropbox = normpath(dropbox)
+        return [(destination, dir_name), (dropbox, dir_name + '.git'),
+                (dropbox, dir_name + '__figs')]
+
+    def taken(self, dir_name, destination, dropbox):
+        """Whether dir_name can't be used in destination and dropbox."""
+        with self._lock:
+            return self._taken(self._paths(dir_name, destination, dropbox))
+
+    def _taken(self, paths):
+        registered = self._registered_paths()
+        return any(path in self._claimed or
+                   path[1] in self._names_in(path[0]) or
+                   os.path.join(*path) in registered for path in paths)
+
+    def claimed(self, dir_name, destination, dropbox):
+        """Whether dir_name was claimed through this index."""
+        with self._lock:
+            return all(path in self._claimed for path in
+                       self._paths(dir_name, destination, dropbox))
+
+    def claim(self, dir_name, destination, dropbox):
+        """Claim dir_name for a new document, returning False if it is
+        already taken."""
+        with self._lock:
+            paths = self._paths(dir_name, destination, dropbox)
+            if self._taken(paths):
+                return False
+            self._claimed.update(paths)
+            return True
+
+
+registry_option = click.option(
+    '--registry', default=config_default('registry', default_registry),
+    type=click.Path(dir_okay=False),
+    help="Registry database (default: the registry in config.yaml, or "
+         "{0})".format(default_registry))
+
+
+def echo_documents(rows, paths):
+    for row in rows:
+        click.echo(u"{0}  {1}  {2:20s}  {3}".format(
+            row['date'][:7], row['doc_type'], row['author'],
+            row['title'] or row['short_name']))
+        if paths:
+            for column in path_columns:
+                if row[column]:
+                    click.echo(u"    {0}".format(row[column]))
+    click.echo(u"{0} documents".format(len(rows)))
+
+
+@click.command('list', help="List documents in the registry")
+@click.option('--type', 'doc_type', default=None, type=doc_type_choices,
+              help="Document type")
+@click.option('--author', default=None, help="Author's last name")
+@click.option('--since', default=None, help="YYYY, YYYY-MM or YYYY-MM-DD")
+@click.option('--until', default=None, help="YYYY, YYYY-MM or YYYY-MM-DD")
+@click.option('--title', default=None, help="Part of the title")
+@click.option('--limit', '-n', default=None, type=click.IntRange(1))
+@click.option('--paths', is_flag=True,
+              help="Show the document, bare repository and figures paths")
+@registry_option
+def list_documents(doc_type, author, since, until, title, limit, paths,
+                   registry):
+    echo_documents(Registry(registry).find(
+        doc_type=doc_type, author=author, since=since, until=until,
+        title=title, limit=limit), paths)
+
+
+@click.command(help="Find documents whose title or name contains TEXT")
+@click.argument('text')
+@click.option('--paths/--no-paths', default=True,
+              help="Show the document, bare repository and figures paths")
+@registry_option
+def find(text, paths, registry):
+    echo_documents(Registry(registry).find(text=text), paths)
+
+
+@click.command('reindex',
+               help="Rebuild the registry by scanning for documents")
+@click.argument('roots', nargs=-1, type=click.Path(exists=True,
+                                                    file_okay=False))
+@click.option('--dropbox', default=config_default('dropbox', '~/Dropbox'),
+              type=click.Path(file_okay=False),
+              help="Folder containing the bare repositories (default: the "
+                   "dropbox in config.yaml, or ~/Dropbox)")
+@click.option('--jobs', '-j', default=None, type=click.IntRange(1),
+              help="Number of directories to scan in parallel")
+@registry_option
+def reindex_command(roots, dropbox, jobs, registry):
+    records = reindex(Registry(registry), roots or ['.'], dropbox, jobs)
+    click.echo("Indexed {0} documents".format(len(records)))
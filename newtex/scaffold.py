@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+"""
+Create new documents from the template in the config directory.
+
+Modules that are only needed to create a document (yaml, git, the style
+store, the bib index) are imported by the functions that use them, so that
+importing this module, and running newtex --help, stays fast.
+"""
+from __future__ import print_function, division, absolute_import
+
+import io
+import os
+import datetime
+import shutil
+import pathlib
+
+import click
+
+from newtex import _tree
+
+
+def new_path(path_string):
+    """Return pathlib.Path, expanding '~' to a user's HOME directory"""
+    return pathlib.Path(os.path.expanduser(path_string))
+
+
+def copy(src_path, dst_path):
+    shutil.copy(str(src_path), str(dst_path))
+
+
+def copy_tree(src_path, dst_path, link_mode='copy', exclude=()):
+    """Recursively copy all files and folders from src_path to dst_path.
+    See newtex._tree for the available link modes."""
+    return _tree.copy_tree(src_path, dst_path, link_mode=link_mode,
+                           exclude=exclude)
+
+
+def mkdir(path):
+    os.mkdir(str(path))
+
+
+def remove(path):
+    """Remove the specified path"""
+    os.remove(str(path))
+
+
+def read_file(filename):
+    return io.open(str(filename)).read()
+
+
+def write_file(filename, string):
+    io.open(str(filename), 'w', encoding="utf-8").write(string)
+
+
+pkg_dir = new_path(os.path.dirname(__file__))
+
+pkg_config_dir = pkg_dir/'newtexrc'
+
+default_config = u"""---
+# newtex config file
+
+created: {date}
+
+# Uncomment and replace with the path to your default bib file
+# Make sure to put the path in single quotes on windows
+
+#master_bib_file: 'path/to/master_bib.bib'
+
+# Copy the whole master bib file into new documents (full), or only the
+# entries cited in the document (cited); update it with fab copy
+
+#bib_mode: cited
+
+# Default bibliography style
+# See contents of styles folder for available options
+
+default_style: naturemag_jm.bst
+
+# Uncomment and correct the authors and affiliations list
+# Please include an affiliation for each author
+authors:
+#    - Your Name
+#    - John A. Marohn
+affiliations:
+#    - Department of Chemistry and Chemical Biology, Ithaca, New York 14853
+#    - Department of Chemistry and Chemical Biology, Ithaca, New York 14853
+
+# How to copy the template into new documents: copy, hardlink, reflink or auto
+# hardlink and auto share unmodified files (bst/, figs/) with the template
+
+#link_mode: auto
+
+# Bibliography styles to put in new documents: all, or only the selected
+# default_style, which is linked from a shared style store (see newtex styles)
+
+#bst_mode: selected
+#style_store: '~/.newtex/styles'
+
+# Dropbox path
+# Only necessary if your Dropbox is in a non-standard location
+
+#dropbox: 'path/to/dropbox'
+
+# How to create the git repositories
+# native (default) writes the initial commit directly; subprocess runs
+# git init, git commit, git clone --bare, etc.
+
+#git_engine: subprocess
+
+# How many times to retry a failed git setup (e.g. a full Dropbox), reusing
+# the files already copied into the new document
+
+#git_retries: 2
+
+# Where to record new documents, for newtex list / find (false to disable)
+
+#registry: '~/.newtex/registry.sqlite'
+
+# If a new document's name is already taken (in the destination, Dropbox or
+# the registry): abort, or add a suffix (_2, _3, ...) to the short name
+
+#on_collision: suffix
+"""
+
+
+def no_config_dir(config_dir, config_file):
+    """Create the config path if it doesn't exist."""
+
+    click.confirm(
+        'Setup config directory at {0}?'.format(str(config_dir)), abort=True)
+
+    if not config_dir.exists():
+        from newtex.manifest import update_template
+        update_template(config_dir)
+
+    today = datetime.date.today().isoformat()
+
+    write_file(str(config_file), default_config.format(date=today))
+
+    click.echo('Please setup your config file\n{0}'.format(str(config_file)))
+    click.launch(str(config_file))
+    raise click.Abort()
+
+
+def verify_config(config):
+    expected_keys = {'master_bib_file', 'authors', 'affiliations',
+                     'default_style'}
+    for key, val in config.items():
+        if val is None:
+            raise click.ClickException(
+                "The config parameter '{key}' must be specified.".format(
+                    key=key))
+
+    keys_okay = True
+    for key in expected_keys:
+        if key not in config:
+            click.echo('{key} must be specified.'.format(key=key))
+            keys_okay = False
+
+    if not keys_okay:
+        click.echo(
+            "Please fix your config file before proceding")
+        raise click.Abort()
+
+
+def dir_doc_names(doc_type, last_name, date, short_name):
+    """Return properly formatted directory and document names"""
+    yrmonth = date.strftime("%Y%m")
+    dir_name = (
+        "_JAM_{doc_type}__{last_name}{yrmonth}__{short_name}".format(
+            doc_type=doc_type,
+            last_name=last_name,
+            yrmonth=yrmonth,
+            short_name=short_name))
+
+    doc_name = "{last_name}{yrmonth}__{short_name}.tex".format(
+        last_name=last_name,
+        yrmonth=yrmonth,
+        short_name=short_name)
+
+    return dir_name, doc_name
+
+
+# What to do when a new document's name is taken
+collision_modes = ('abort', 'suffix')
+
+
+def claim_names(names, config, doc_type, short_name, date, destination,
+                dropbox, on_collision='abort', claimed=False):
+    """Claim the directory name for a new document in names (a
+    newtex.registry.NameIndex), returning (short_name, dir_name, doc_name).
+
+    If the name is taken, raises click.ClickException if on_collision is
+    'abort', or adds the first free suffix (_2, _3, ...) to short_name if
+    it is 'suffix'. With claimed=True, a name already claimed through names
+    (as by newtex.batch.check_names) is accepted as it is."""
+    if on_collision not in collision_modes:
+        raise click.ClickException(
+            "Unknown on_collision '{0}'; use 'abort' or 'suffix'".format(
+                on_collision))
+    last_name = config['authors'][0].split(' ')[-1]
+    short_name = short_name.replace(' ', '_').replace('-', '_')
+    base_name = short_name
+    suffix = 1
+    while True:
+        dir_name, doc_name = dir_doc_names(doc_type, last_name, date,
+                                           short_name)
+        if ' ' in dir_name:
+            raise click.ClickException("Name the folder without spaces")
+        if claimed and names.claimed(dir_name, destination, dropbox) or \
+                names.claim(dir_name, destination, dropbox):
+            return short_name, dir_name, doc_name
+        if on_collision == 'abort':
+            raise click.ClickException(
+                "A document named {0} already exists in {1} or {2}".format(
+                    dir_name, str(destination), str(dropbox)))
+        suffix += 1
+        short_name = "{0}_{1}".format(base_name, suffix)
+
+
+doc_types = ('FP', 'GR', 'GT', 'RP', 'MS')
+
+doc_type_choices = click.Choice(doc_types)
+
+default_config_dir = '~/newtex_template'
+
+# Files in the config directory that aren't part of the template
+config_files = ['config.yaml', '.config.yaml.cache',
+                '.newtex_manifest.json']
+
+
+def template_pack(config_dir):
+    """Return the TemplatePack if config_dir is a template pack file rather
+    than a directory (see newtex.pack), otherwise None."""
+    if not os.path.isfile(os.path.expanduser(str(config_dir))):
+        return None
+    from newtex.pack import open_pack
+    return open_pack(config_dir)
+
+
+def load_config(config_dir):
+    """Load and verify config.yaml from config_dir, setting up the config
+    directory first if it doesn't exist. Unchanged config files are loaded
+    from a cached snapshot (see newtex.config). config_dir can also be a
+    template pack containing config.yaml."""
+    pack = template_pack(config_dir)
+    if pack is not None:
+        from newtex.config import parse_config
+        if 'config.yaml' not in pack:
+            raise click.ClickException(
+                "{0} has no config.yaml; pack a configured template "
+                "directory".format(pack.filename))
+        config = parse_config(bytes(pack.read('config.yaml')))
+        verify_config(config)
+        return config
+
+    config_dir = new_path(config_dir)
+    config_file = config_dir/'config.yaml'
+
+    if not config_dir.exists() or not config_file.exists():
+        no_config_dir(config_dir, config_file)
+
+    from newtex.config import read_config
+
+    return read_config(config_file, verify_config)
+
+
+def config_default(key, default, config_dir=None):
+    """Return a function giving the value of key in config.yaml in
+    config_dir (default: default_config_dir), or default if it isn't set
+    or there is no config file yet, for use as a click option's default,
+    so that commands use the same settings as create_document."""
+    def value():
+        directory = default_config_dir if config_dir is None else config_dir
+        if template_pack(directory) is None and \
+                not (new_path(directory)/'config.yaml').exists():
+            return default
+        return load_config(directory).get(key) or default
+    return value
+
+
+# The placeholders that can be used in template.tex and fabfile.py
+tex_placeholders = ('title', 'main_author', 'date', 'author_affiliation_block',
+                    'default_style', 'default_bib', 'large_figs_dir')
+fabfile_placeholders = ('master_bib', 'master_bib_name', 'bib_mode', 'doc_name')
+
+
+def load_templates(config_dir):
+    """Compile the template.tex and fabfile.py templates in config_dir once,
+    so that they can be reused for many documents. Raises
+    click.ClickException if either uses an unknown placeholder."""
+    from newtex.template import load_template
+
+    pack = template_pack(config_dir)
+    config_dir = new_path(config_dir)
+    templates = {}
+    for key, name, names in (('tex', 'template.tex', tex_placeholders),
+                             ('fabfile', 'fabfile.py', fabfile_placeholders)):
+        if pack is not None:
+            templates[key] = load_template(config_dir/name, names,
+                                           text=pack.read_text(name))
+        else:
+            templates[key] = load_template(config_dir/name, names)
+    return templates
+
+
+def add_selected_style(config, config_dir, doc_dir, link_mode='copy'):
+    """Add the template's styles to the style store, then place only the
+    default style in doc_dir/bst, linked from the store."""
+    from newtex import __version__
+    from newtex.styles import get_store, default_style_store
+
+    store = get_store(config.get('style_store', default_style_store))
+    store.add_dir(new_path(config_dir)/'bst', version=__version__)
+    mkdir(doc_dir/'bst')
+    style = new_path(config['default_style']).name
+    store.materialize(style, doc_dir/'bst'/style, link_mode)
+
+
+def create_document(config, config_dir, doc_type, short_name, title,
+                    destination='.', date=None, templates=None, out=None,
+                    link_mode=None, timer=None, names=None,
+                    on_collision=None, claimed=False):
+    """Create a new document in destination from the template in config_dir.
+    Progress is printed to out (stdout by default). link_mode overrides the
+    config file's link_mode (see newtex._tree); it doesn't apply when
+    config_dir is a template pack, whose files are always written out. If
+    timer (a newtex.timing.Timer) is given, the time taken by each phase is
+    recorded in it.
+
+    The document's name is checked against names (a
+    newtex.registry.NameIndex; by default, a new one for the registry)
+    before anything is written. If it is taken, on_collision (default: the
+    config file's on_collision, or 'abort') either raises
+    click.ClickException ('abort') or adds a numeric suffix to short_name
+    ('suffix'). With claimed=True, a name already claimed in names is used
+    without checking it again.
+
+    The document is built in a staging directory and moved into place
+    once everything has succeeded; on failure, it is removed along with the
+    bare repository, large figures directory and registry entry (see
+    newtex.transaction). Failed git setups are retried the config file's
+    git_retries times (default 0).
+
+    Returns a dictionary containing the paths of the new document directory
+    ('doc_dir'), the Dropbox bare repository ('bare_repo') and the large
+    figures directory ('large_figs_dir')."""
+    from newtex._git import setup_repositories
+    from newtex.bib import sync_bib, bib_modes
+    from newtex.timing import Timer
+    from newtex.registry import (Registry, NameIndex, document_record,
+                                 default_registry)
+    from newtex.transaction import Transaction
+
+    if timer is None:
+        timer = Timer()
+    config_dir = new_path(config_dir)
+    if date is None:
+        date = datetime.date.today()
+    if templates is None:
+        with timer.phase('load templates'):
+            templates = load_templates(config_dir)
+
+    registry = config.get('registry', default_registry)
+    dropbox = new_path(config.get('dropbox', '~/Dropbox'))
+    if names is None:
+        names = NameIndex(Registry(registry) if registry else None)
+    if on_collision is None:
+        on_collision = config.get('on_collision', 'abort')
+
+    short_name, dir_name, doc_name = claim_names(
+        names, config, doc_type, short_name, date, destination, dropbox,
+        on_collision, claimed)
+
+    # Where to put the new document
+    destination_dir = new_path(destination)
+    doc_dir = destination_dir/dir_name
+
+    if link_mode is None:
+        link_mode = config.get('link_mode', 'copy')
+
+    bst_mode = config.get('bst_mode', 'all')
+    if bst_mode not in ('all', 'selected'):
+        raise click.ClickException(
+            "Unknown bst_mode '{0}'; use 'all' or 'selected'".format(bst_mode))
+    exclude = config_files + (['bst'] if bst_mode == 'selected' else [])
+
+    master_bib = new_path(config['master_bib_file'])
+    bib_mode = config.get('bib_mode', 'full')
+    if bib_mode not in bib_modes:
+        raise click.ClickException(
+            "Unknown bib_mode '{0}'; use 'full' or 'cited'".format(bib_mode))
+
+    large_figs_dir = new_path(os.path.abspath(
+        str(dropbox/(dir_name+'__figs'))))
+    paths = {'doc_dir': doc_dir,
+             'bare_repo': dropbox/(dir_name+'.git'),
+             'large_figs_dir': large_figs_dir}
+
+    # Everything is built in a staging directory and renamed into place at
+    # the end, so a failure leaves nothing behind (see newtex.transaction)
+    with Transaction(destination_dir, dir_name) as transaction:
+        staged = new_path(transaction.staged)
+        pack = template_pack(config_dir)
+        with timer.phase('copy_tree'):
+            if pack is not None:
+                pack.extract(staged, exclude=exclude)
+            else:
+                copy_tree(config_dir, staged, link_mode=link_mode,
+                          exclude=exclude)
+
+        if bst_mode == 'selected':
+            with timer.phase('styles'):
+                if pack is not None:
+                    # A pack is already a single shared copy of the styles
+                    style = new_path(config['default_style']).name
+                    pack.extract(staged, only=['bst/' + style])
+                else:
+                    add_selected_style(config, config_dir, staged, link_mode)
+
+        (staged/'gitignore').rename(staged/'.gitignore')
+
+        # Copy master bib file, or only the cited entries (there are none yet)
+        with timer.phase('bib'):
+            sync_bib(master_bib, staged/'bib'/master_bib.name, bib_mode,
+                     staged)
+
+        with timer.phase('render fabfile'):
+            write_file(staged/'fabfile.py', templates['fabfile'].substitute(
+                master_bib=str(master_bib.absolute()),
+                master_bib_name=master_bib.name,
+                bib_mode=bib_mode, doc_name=doc_name))
+
+        tex_file = staged/'template.tex'
+        with timer.phase('render tex'):
+            replaced_tex = tex_contents(templates['tex'], title=title,
+                                        date=date, authors=config['authors'],
+                                        affiliations=config['affiliations'],
+                                        default_style=new_path(config['default_style']).stem,
+                                        default_bib=master_bib.stem,
+                                        large_figs_dir=str(large_figs_dir))
+
+            write_file(tex_file, replaced_tex)
+
+            tex_file.rename(staged/doc_name)
+
+        # Failed git setups are retried without copying the template again
+        retries = config.get('git_retries', 0)
+        with timer.phase('git'):
+            for attempt in range(retries + 1):
+                transaction.created(paths['bare_repo'])
+                transaction.created(large_figs_dir)
+                try:
+                    setup_repositories(staged, dropbox,
+                                       engine=config.get('git_engine',
+                                                         'native'),
+                                       out=out, large_figs_dir=large_figs_dir,
+                                       timer=timer)
+                    break
+                except Exception:
+                    if attempt == retries:
+                        raise
+                    transaction.undo()
+                    shutil.rmtree(str(staged/'.git'), ignore_errors=True)
+
+        if registry:
+            with timer.phase('registry'):
+                registry = Registry(registry)
+                transaction.registered(registry, doc_dir)
+                registry.add(document_record(
+                    config, paths, doc_type, short_name, title, date))
+
+        with timer.phase('publish'):
+            transaction.publish()
+
+    return paths
+
+
+author_affil_template = r"""
+    \author{$author}
+    \affiliation{$affiliation}"""
+
+
+def tex_contents(tex_template, title, date, authors, affiliations,
+                 default_style, default_bib, large_figs_dir):
+    from newtex.template import compile_template
+
+    main_author = authors[0]
+    date_str = "{month} {d.day}, {d.year}".format(month=date.strftime("%B"),
+                                                  d=date)
+
+    author_affil = compile_template(author_affil_template)
+    author_affiliation_list = [
+        author_affil.render({'author': author, 'affiliation': affiliation})
+        for author, affiliation in zip(authors, affiliations)]
+
+    author_affiliation_block = "\n".join(author_affiliation_list)
+
+    return tex_template.substitute(
+        title=title,
+        main_author=main_author,
+        date=date_str,
+        author_affiliation_block=author_affiliation_block,
+        default_style=default_style,
+        default_bib=default_bib,
+        large_figs_dir=large_figs_dir+'/')
+
+
+def test_tex_contents():
+    title = "Example"
+    date = datetime.date.today()
+    authors = ["Ryan Dwyer", "John A. Marohn"]
+    affiliations = [
+        "Department of Chemistry and Chemical Biology, Ithaca NY 14853",
+        "Department of Chemistry and Chemical Biology, Ithaca NY 14853"]
+
+    default_style = "naturemag_jm.bst"
+    default_bib = "jam99_2012-03-29_Ryan.bib"
+
+    open('ex.tex', 'wb').write(
+        tex_contents(title, date, authors, affiliations,
+                     default_style, default_bib))
+
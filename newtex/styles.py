@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+A content-addressed store for bibliography styles.
+
+By default every new document gets its own copy of every .bst file in the
+template's bst/ folder, although template.tex only uses one. With
+``bst_mode: selected`` in config.yaml, the template's styles are added to a
+shared store (``style_store``, ``~/.newtex/styles`` by default) and only
+default_style is placed in the new document's bst/ folder, linked from the
+store according to link_mode.
+
+The store looks like::
+
+    objects/<sha256>.bst    read-only style files, named by their hash
+    index.json              style name -> current hash, plus every hash
+                            each style has had and the newtex version that
+                            added it
+
+Store objects are never modified, so documents can safely hard link to them;
+``newtex styles gc`` only removes objects that are no longer current and that
+no document links to.
+"""
+from __future__ import print_function, division, absolute_import
+
+import io
+import os
+import json
+import stat
+import hashlib
+import tempfile
+import threading
+
+import click
+
+from newtex._tree import TreeCopier
+from newtex.scaffold import config_default
+
+
+default_style_store = '~/.newtex/styles'
+
+bst_modes = ('all', 'selected')
+
+
+def file_hash(filename, block_size=1 << 16):
+    """Return the sha256 hex digest of a file's contents."""
+    sha = hashlib.sha256()
+    with open(str(filename), 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _write_atomic(filename, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmp, filename)
+
+
+class StyleStore(object):
+    """A content-addressed store of .bst files rooted at path."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(str(path)))
+        self.objects_dir = os.path.join(self.path, 'objects')
+        self.index_file = os.path.join(self.path, 'index.json')
+        self.lock = threading.Lock()
+        self.index = self._read_index()
+
+    def _read_index(self):
+        try:
+            with io.open(self.index_file, encoding='utf-8') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {'styles': {}, 'sources': {}}
+
+    def _save_index(self):
+        data = json.dumps(self.index, indent=1, sort_keys=True)
+        _write_atomic(self.index_file, data.encode('utf-8'))
+
+    def object_path(self, sha):
+        return os.path.join(self.objects_dir, sha + '.bst')
+
+    def add_file(self, filename, version=None):
+        """Add a style file to the store, returning its hash."""
+        filename = str(filename)
+        name = os.path.basename(filename)
+        sha = file_hash(filename)
+        obj = self.object_path(sha)
+        if not os.path.exists(obj):
+            with open(filename, 'rb') as f:
+                _write_atomic(obj, f.read())
+            os.chmod(obj, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+        entry = self.index['styles'].setdefault(name, {'history': []})
+        entry['sha256'] = sha
+        if sha not in [h['sha256'] for h in entry['history']]:
+            entry['history'].append({'sha256': sha, 'version': version})
+        return sha
+
+    def add_dir(self, bst_dir, version=None):
+        """Add every .bst file in bst_dir, skipping files whose size and
+        modification time haven't changed since they were last added."""
+        with self.lock:
+            if not os.path.isdir(self.objects_dir):
+                os.makedirs(self.objects_dir)
+
+            changed = False
+            for entry in sorted(os.listdir(str(bst_dir))):
+                if not entry.endswith('.bst'):
+                    continue
+                filename = os.path.join(str(bst_dir), entry)
+                st = os.stat(filename)
+                key = os.path.abspath(filename)
+                source = [st.st_size, st.st_mtime]
+                known = self.index['sources'].get(key)
+                if (known is not None and known[:2] == source and
+                        os.path.exists(self.object_path(known[2]))):
+                    continue
+                sha = self.add_file(filename, version)
+                self.index['sources'][key] = source + [sha]
+                changed = True
+
+            if changed:
+                self._save_index()
+
+    def lookup(self, name):
+        """Return the store path of the current version of style name."""
+        try:
+            return self.object_path(self.index['styles'][name]['sha256'])
+        except KeyError:
+            raise click.ClickException(
+                "The style {0} is not in the style store {1}".format(
+                    name, self.path))
+
+    def materialize(self, name, dst, link_mode='copy'):
+        """Place the current version of style name at dst. A copied (or
+        reflinked) style is made writable, like the rest of the document;
+        a hard link stays read-only, to protect the store."""
+        obj = self.lookup(name)
+        TreeCopier(link_mode, copy_only=()).place(obj, str(dst), name)
+        if not os.path.samefile(obj, str(dst)):
+            os.chmod(str(dst), os.stat(str(dst)).st_mode | stat.S_IWUSR)
+
+    def objects(self):
+        """Return a list of the hashes of every object in the store."""
+        if not os.path.isdir(self.objects_dir):
+            return []
+        return sorted(f[:-4] for f in os.listdir(self.objects_dir)
+                      if f.endswith('.bst'))
+
+    def verify(self):
+        """Return a list of (sha, problem) for corrupt or missing objects."""
+        problems = []
+        for sha in self.objects():
+            if file_hash(self.object_path(sha)) != sha:
+                problems.append((sha, 'contents do not match hash'))
+        present = set(self.objects())
+        for name, entry in sorted(self.index['styles'].items()):
+            if entry['sha256'] not in present:
+                problems.append((entry['sha256'], 'missing (' + name + ')'))
+        return problems
+
+    def garbage(self):
+        """Return the hashes of objects that are not the current version of
+        any style and that aren't hard linked from any document."""
+        current = set(entry['sha256']
+                      for entry in self.index['styles'].values())
+        return [sha for sha in self.objects() if sha not in current and
+                os.stat(self.object_path(sha)).st_nlink == 1]
+
+    def gc(self):
+        """Remove garbage objects, returning their hashes."""
+        with self.lock:
+            removed = self.garbage()
+            for sha in removed:
+                os.remove(self.object_path(sha))
+            return removed
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path=default_style_store):
+    """Return the StyleStore at path, shared by every caller in the
+    process."""
+    key = os.path.abspath(os.path.expanduser(str(path)))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = StyleStore(key)
+        return _stores[key]
+
+
+def sizeof_fmt(num):
+    for unit in ('B', 'KB', 'MB'):
+        if num < 1024:
+            return "{0:.0f} {1}".format(num, unit)
+        num /= 1024
+    return "{0:.1f} GB".format(num)
+
+
+@click.group(help="Manage the shared bibliography style store")
+@click.option('--store',
+              default=config_default('style_store', default_style_store),
+              type=click.Path(file_okay=False),
+              help="Style store location (default: the style_store in "
+                   "config.yaml, or {0})".format(default_style_store))
+@click.pass_context
+def styles(ctx, store):
+    ctx.obj = get_store(store)
+
+
+@styles.command('list', help="List the styles in the store")
+@click.pass_obj
+def list_styles(store):
+    for name, entry in sorted(store.index['styles'].items()):
+        obj = store.object_path(entry['sha256'])
+        st = os.stat(obj) if os.path.exists(obj) else None
+        click.echo("{0:45s} {1}  {2:>7s}  {3} links  ({4} versions)".format(
+            name, entry['sha256'][:12],
+            sizeof_fmt(st.st_size) if st else 'missing',
+            st.st_nlink - 1 if st else 0, len(entry['history'])))
+
+
+@styles.command(help="Check every object in the store against its hash")
+@click.pass_obj
+def verify(store):
+    problems = store.verify()
+    for sha, problem in problems:
+        click.echo("{0}: {1}".format(sha, problem))
+    if problems:
+        raise click.ClickException(
+            "{0} problems found in {1}".format(len(problems), store.path))
+    click.echo("{0} objects ok".format(len(store.objects())))
+
+
+@styles.command(help="Remove old styles that no document links to")
+@click.option('--dry-run', is_flag=True, help="List objects without removing")
+@click.pass_obj
+def gc(store, dry_run):
+    removed = store.garbage() if dry_run else store.gc()
+    for sha in removed:
+        click.echo(("would remove " if dry_run else "removed ") + sha)
+    click.echo("{0} objects {1}".format(
+        len(removed), "to remove" if dry_run else "removed"))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled templates for template.tex and fabfile.py.
+
+Templates use the string.Template syntax ($name, ${name} and $$), but are
+parsed once into alternating literal chunks and placeholder names, so that
+rendering a template is a single join, and every placeholder can be checked
+against the values newtex provides before any documents are created.
+Compiled templates are cached by the hash of their text.
+"""
+from __future__ import print_function, division, absolute_import
+
+import io
+import string
+import hashlib
+import threading
+
+import click
+
+
+class CompiledTemplate(object):
+    """A template parsed into literal chunks and placeholder names.
+
+    Rendering with a mapping m gives
+    literals[0] + m[names[0]] + literals[1] + ... + literals[-1]."""
+
+    pattern = string.Template.pattern
+    delimiter = string.Template.delimiter
+
+    def __init__(self, template):
+        self.template = template
+        self.literals = []
+        self.names = []
+
+        literal = []
+        start = 0
+        for match in self.pattern.finditer(template):
+            literal.append(template[start:match.start()])
+            start = match.end()
+            if match.group('escaped') is not None:
+                literal.append(self.delimiter)
+            elif match.group('named') or match.group('braced'):
+                self.literals.append(''.join(literal))
+                self.names.append(match.group('named') or
+                                  match.group('braced'))
+                literal = []
+            else:
+                lines = template[:match.start('invalid')].splitlines(True)
+                raise ValueError(
+                    'Invalid placeholder in string: line {0}, col {1}'.format(
+                        len(lines), len(lines[-1]) + 1 if lines else 1))
+        literal.append(template[start:])
+        self.literals.append(''.join(literal))
+
+        self.placeholders = frozenset(self.names)
+        self._parts = [None] * (2 * len(self.names) + 1)
+        self._parts[::2] = self.literals
+
+    def check(self, names):
+        """Raise click.ClickException if the template uses placeholders
+        that are not in names."""
+        unknown = self.placeholders - set(names)
+        if unknown:
+            raise click.ClickException(
+                "Unknown placeholders in template: {0}\n"
+                "Available placeholders: {1}".format(
+                    ", ".join('$' + name for name in sorted(unknown)),
+                    ", ".join('$' + name for name in sorted(names))))
+
+    def render(self, mapping):
+        """Render the template; like string.Template.substitute, raises
+        KeyError if a placeholder is missing from mapping."""
+        parts = list(self._parts)
+        parts[1::2] = ['%s' % (mapping[name],) for name in self.names]
+        return ''.join(parts)
+
+    def substitute(self, *args, **kwargs):
+        """Render the template, with the same arguments as
+        string.Template.substitute."""
+        if args:
+            mapping = dict(args[0], **kwargs)
+        else:
+            mapping = kwargs
+        return self.render(mapping)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def compile_template(template):
+    """Return the CompiledTemplate for template (a string), reusing a
+    previously compiled template with the same text."""
+    key = hashlib.sha1(template.encode('utf-8')).digest()
+    with _cache_lock:
+        compiled = _cache.get(key)
+        if compiled is None:
+            compiled = _cache[key] = CompiledTemplate(template)
+    return compiled
+
+
+def load_template(filename, names=None, text=None):
+    """Read and compile the template in filename (or compile text, if
+    given, naming it filename in errors). If names is given, check that
+    every placeholder in the template is one of names."""
+    if text is None:
+        with io.open(str(filename), encoding='utf-8') as f:
+            text = f.read()
+    compiled = compile_template(text)
+    if names is not None:
+        try:
+            compiled.check(names)
+        except click.ClickException as e:
+            e.message = "{0}: {1}".format(str(filename), e.message)
+            raise
+    return compiled
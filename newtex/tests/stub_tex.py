@@ -0,0 +1,104 @@
+"""
+A stand-in for pdflatex and bibtex, for testing newtex.build.
+
+    python stub_tex.py latex [flags] doc.tex
+    python stub_tex.py bibtex doc
+
+The latex mode reads doc.tex, the files it \\inputs and the figures it
+\\includegraphics (found in the \\graphicspath directories), and writes
+doc.aux (\\citation, \\bibdata, \\bibstyle and, from doc.bbl, \\bibcite lines),
+doc.fls, doc.log (noting $TMPDIR) and doc.pdf; a \\fail in the document
+makes it fail. The bibtex mode writes doc.bbl from doc.aux. Every run is
+appended to the file named by $STUB_TEX_CALLS, if set.
+"""
+import io
+import os
+import re
+import sys
+
+
+def record(mode):
+    calls = os.environ.get('STUB_TEX_CALLS')
+    if calls:
+        with io.open(calls, 'a') as f:
+            f.write(u"{0}\n".format(mode))
+
+
+def read_tex(filename, inputs):
+    inputs.append(filename)
+    with io.open(filename, encoding='utf-8') as f:
+        text = f.read()
+    for name in re.findall(r'\\input\{([^}]*)\}', text):
+        text += read_tex(name if name.endswith('.tex') else name + '.tex',
+                         inputs)
+    return text
+
+
+def latex(tex_file):
+    job = os.path.splitext(tex_file)[0]
+    inputs = []
+    text = read_tex(tex_file, inputs)
+    graphics = ['']
+    for dirs in re.findall(r'\\graphicspath\{((?:\{[^}]*\})*)\}', text):
+        graphics.extend(re.findall(r'\{([^}]*)\}', dirs))
+    for name in re.findall(r'\\includegraphics(?:\[[^]]*\])?\{([^}]*)\}',
+                           text):
+        for directory in graphics:
+            if os.path.exists(os.path.join(directory, name)):
+                inputs.append(os.path.join(directory, name))
+                with io.open(inputs[-1], encoding='utf-8') as f:
+                    text += f.read()
+                break
+    if '\\fail' in text:
+        print("{0}:1: Undefined control sequence \\fail".format(tex_file))
+        sys.exit(1)
+
+    aux = [u"\\relax"]
+    for keys in re.findall(r'\\cite\{([^}]*)\}', text):
+        aux.extend(u"\\citation{{{0}}}".format(key.strip())
+                   for key in keys.split(','))
+    for command in ('bibliographystyle', 'bibliography'):
+        for argument in re.findall(r'\\' + command + r'\{([^}]*)\}', text):
+            aux.append(u"\\{0}{{{1}}}".format(
+                'bibstyle' if command == 'bibliographystyle' else 'bibdata',
+                argument))
+    if os.path.exists(job + '.bbl'):
+        inputs.append(job + '.bbl')
+        with io.open(job + '.bbl', encoding='utf-8') as f:
+            for i, key in enumerate(re.findall(r'\\bibitem\{([^}]*)\}',
+                                               f.read())):
+                aux.append(u"\\bibcite{{{0}}}{{{1}}}".format(key, i + 1))
+    if os.path.exists(job + '.aux'):
+        inputs.append(job + '.aux')
+
+    with io.open(job + '.aux', 'w', encoding='utf-8') as f:
+        f.write(u"\n".join(aux) + u"\n")
+    with io.open(job + '.fls', 'w', encoding='utf-8') as f:
+        f.write(u"PWD {0}\n".format(os.getcwd()))
+        f.write(u"INPUT /usr/share/texmf/tex/latex/base/article.cls\n")
+        for name in inputs:
+            f.write(u"INPUT {0}\n".format(name))
+        for ext in ('.aux', '.log', '.pdf'):
+            f.write(u"OUTPUT {0}{1}\n".format(job, ext))
+    with io.open(job + '.log', 'w', encoding='utf-8') as f:
+        f.write(u"This is stub_tex\nTMPDIR={0}\n".format(
+            os.environ.get('TMPDIR')))
+    with io.open(job + '.pdf', 'w', encoding='utf-8') as f:
+        f.write(text + u"\n".join(aux))
+    print("Output written on {0}.pdf".format(job))
+
+
+def bibtex(job):
+    with io.open(job + '.aux', encoding='utf-8') as f:
+        keys = re.findall(r'\\citation\{([^}]*)\}', f.read())
+    with io.open(job + '.bbl', 'w', encoding='utf-8') as f:
+        f.write(u"".join(u"\\bibitem{{{0}}}\n".format(key) for key in keys))
+
+
+if __name__ == '__main__':
+    mode = sys.argv[1]
+    record(mode)
+    if mode == 'latex':
+        latex(sys.argv[-1])
+    else:
+        bibtex(sys.argv[-1])
@@ -0,0 +1,200 @@
+import io
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+import click
+import yaml
+
+from newtex import pkg_config_dir, new_path
+from newtex.batch import load_manifest, run_batch
+
+
+def make_config(tmpdir):
+    """Set up a config directory, master bib file and Dropbox folder in
+    tmpdir, returning (config_dir, config)."""
+    config_dir = tmpdir/'newtex_template'
+    shutil.copytree(str(pkg_config_dir), str(config_dir))
+    master_bib = tmpdir/'master.bib'
+    io.open(str(master_bib), 'w').write(u"@article{a, title={A}}\n")
+    dropbox = tmpdir/'Dropbox'
+    os.mkdir(str(dropbox))
+    config = {'master_bib_file': str(master_bib),
+              'authors': ['Ryan Dwyer', 'John A. Marohn'],
+              'affiliations': ['Cornell', 'Cornell'],
+              'default_style': 'naturemag_jm.bst',
+              'dropbox': str(dropbox),
+              'registry': str(tmpdir/'registry.sqlite')}
+    with open(str(config_dir/'config.yaml'), 'w') as f:
+        yaml.safe_dump(config, f)
+    return config_dir, config
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+            os.environ.setdefault(var, 'newtex')
+        for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+            os.environ.setdefault(var, 'newtex@example.com')
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def write_manifest(self, text):
+        manifest = self.tmpdir/'manifest.yaml'
+        io.open(str(manifest), 'w').write(text)
+        return manifest
+
+    def test_load_manifest_defaults(self):
+        manifest = self.write_manifest(u"""
+doc_type: RP
+documents:
+    - short_name: a
+      title: A
+    - short_name: b
+      title: B
+      doc_type: MS
+""")
+        entries = load_manifest(manifest, destination='out')
+        self.assertEqual(['RP', 'MS'], [e['doc_type'] for e in entries])
+        self.assertEqual(['out', 'out'], [e['destination'] for e in entries])
+
+    def test_load_manifest_invalid(self):
+        manifest = self.write_manifest(u"""
+documents:
+    - short_name: a
+      doc_type: XX
+""")
+        with self.assertRaises(click.ClickException) as cm:
+            load_manifest(manifest)
+        self.assertIn("'title' must be specified", cm.exception.message)
+        self.assertIn("'doc_type' must be one of", cm.exception.message)
+
+    def test_load_manifest_types(self):
+        for text, error in [
+                (u"documents: foo\n", "must contain a list of documents"),
+                (u"documents:\n    - foo\n",
+                 "Document 0: must be a mapping"),
+                (u"documents:\n    - {doc_type: MS, title: T, "
+                 u"short_name: 123}\n",
+                 "Document 0: 'short_name' must be a string, not 123"),
+                (u"documents:\n    - {doc_type: [MS], title: T, "
+                 u"short_name: a, 1: b}\n",
+                 "'doc_type' must be a string")]:
+            manifest = self.write_manifest(text)
+            with self.assertRaises(click.ClickException) as cm:
+                load_manifest(manifest)
+            self.assertIn(error, cm.exception.message)
+
+        config_dir, config = make_config(self.tmpdir)
+        report = run_batch([{'doc_type': 'MS', 'short_name': 123,
+                             'title': 'T', 'destination': str(self.tmpdir)}],
+                           config, config_dir)
+        self.assertIn("'short_name' must be a string",
+                      report.failures[0].error)
+
+    def test_run_batch(self):
+        config_dir, config = make_config(self.tmpdir)
+        destination = self.tmpdir/'docs'
+        os.mkdir(str(destination))
+        entries = [{'doc_type': 'RP', 'short_name': name, 'title': name,
+                    'destination': str(destination),
+                    'date': datetime.date(2015, 9, 1)}
+                   for name in ('first', 'second', 'first')]
+
+        report = run_batch(entries, config, config_dir)
+
+        self.assertEqual(3, len(report.results))
+        self.assertEqual(1, len(report.failures))
+        doc_dir = destination/'_JAM_RP__Dwyer201509__second'
+        self.assertTrue((doc_dir/'Dwyer201509__second.tex').exists())
+        self.assertTrue((doc_dir/'bib'/'master.bib').exists())
+        self.assertIn('Created 2 of 3 documents', report.summary())
+        phases = [name for name, seconds in report.results[0].timer.totals()]
+        for phase in ('copy_tree', 'bib', 'render tex', 'git',
+                      'git/write repositories'):
+            self.assertIn(phase, phases)
+        self.assertIn('git/create large figures directory', report.profile())
+
+    def test_run_batch_parallel(self):
+        config_dir, config = make_config(self.tmpdir)
+        entries = [{'doc_type': 'GR', 'short_name': 'doc{0}'.format(i),
+                    'title': 'Doc', 'destination': str(self.tmpdir)}
+                   for i in range(6)]
+        not_a_dir = self.tmpdir/'not_a_dir'
+        io.open(str(not_a_dir), 'w').write(u'')
+        entries[2]['destination'] = str(not_a_dir)
+        outputs = []
+
+        report = run_batch(entries, config, config_dir, jobs=3,
+                           echo=outputs.append)
+
+        self.assertEqual(6, len(outputs))
+        self.assertEqual([r.entry['short_name'] for r in report.results],
+                         [e['short_name'] for e in entries])
+        self.assertEqual([entries[2]], [r.entry for r in report.failures])
+        self.assertIn('doc3', outputs[3])
+
+    def test_names_listed_once(self):
+        from newtex.registry import NameIndex
+        config_dir, config = make_config(self.tmpdir)
+        entries = [{'doc_type': 'GR', 'short_name': 'doc{0}'.format(i),
+                    'title': 'Doc', 'destination': str(self.tmpdir)}
+                   for i in range(4)]
+        listed = []
+        names_in = NameIndex._names_in
+
+        def counting_names_in(index, directory):
+            if directory not in index._listings:
+                listed.append(directory)
+            return names_in(index, directory)
+
+        NameIndex._names_in = counting_names_in
+        try:
+            report = run_batch(entries, config, config_dir, jobs=2)
+        finally:
+            NameIndex._names_in = names_in
+        self.assertEqual([], report.failures)
+        # The destination and Dropbox, once for the whole batch
+        self.assertEqual(2, len(listed))
+
+    def test_selected_style(self):
+        config_dir, config = make_config(self.tmpdir)
+        config.update(bst_mode='selected', link_mode='hardlink',
+                      style_store=str(self.tmpdir/'styles'))
+        entry = {'doc_type': 'MS', 'short_name': 'styled', 'title': 'T',
+                 'destination': str(self.tmpdir)}
+
+        report = run_batch([entry], config, config_dir)
+
+        self.assertEqual([], report.failures)
+        bst_dir = report.results[0].paths['doc_dir']/'bst'
+        self.assertEqual(['naturemag_jm.bst'], os.listdir(str(bst_dir)))
+
+    def test_name_collisions(self):
+        config_dir, config = make_config(self.tmpdir)
+        date = datetime.date(2015, 9, 1)
+        entries = [{'doc_type': 'RP', 'short_name': name, 'title': name,
+                    'destination': str(self.tmpdir), 'date': date}
+                   for name in ('first', 'first', 'second')]
+        os.mkdir(str(new_path(config['dropbox']) /
+                     '_JAM_RP__Dwyer201509__second.git'))
+
+        report = run_batch(entries, config, config_dir, keep_going=False)
+        self.assertEqual(2, len(report.failures))
+        self.assertIn('already exists', report.failures[0].error)
+        self.assertFalse((self.tmpdir/'_JAM_RP__Dwyer201509__first').exists())
+
+        report = run_batch(entries, config, config_dir)
+        self.assertEqual([entries[1], entries[2]],
+                         [r.entry for r in report.failures])
+        self.assertFalse((self.tmpdir/'_JAM_RP__Dwyer201509__second').exists())
+
+        report = run_batch(entries, config, config_dir, on_collision='suffix')
+        self.assertEqual([], report.failures)
+        self.assertEqual(['first_2', 'first_3', 'second_2'],
+                         [r.paths['doc_dir'].name.split('__')[-1]
+                          for r in report.results])
@@ -0,0 +1,125 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from newtex import new_path
+from newtex.bib import (iter_entries, cited_keys, extract_entries, sync_file,
+                        sync_bib, BibIndex)
+
+
+master = u"""% Master bibliography
+@string{prl = {Phys. Rev. Lett.}}
+
+@article{Dwyer2015,
+  title = {Noise {in} cantilevers},
+  journal = prl,
+  year = {2015}
+}
+
+@inproceedings{Marohn2014,
+  title = {Force microscopy},
+  crossref = {Proc2014}
+}
+
+@book(Unused2000,
+  title = {Never cited}
+)
+
+@proceedings{Proc2014,
+  title = {Proceedings},
+  year = {2014}
+}
+"""
+
+
+class TestBib(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.master = self.tmpdir/'master.bib'
+        self.index_dir = self.tmpdir/'index'
+        io.open(str(self.master), 'w').write(master)
+        io.open(str(self.tmpdir/'doc.tex'), 'w').write(
+            u"As shown~\\cite{Dwyer2015}, and \\citet[p.~2]{Marohn2014}.\n"
+            u"% \\cite{Unused2000}\n")
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def test_iter_entries(self):
+        entries = list(iter_entries(self.master))
+        self.assertEqual(['prl', 'Dwyer2015', 'Marohn2014', 'Unused2000',
+                          'Proc2014'], [e[1] for e in entries])
+        raw = open(str(self.master), 'rb').read()
+        for entry_type, key, offset, text in entries:
+            self.assertEqual(raw[offset:offset+len(text)], text)
+
+    def test_entries_on_one_line(self):
+        io.open(str(self.master), 'w').write(
+            u"@misc{A, title={a}} @misc{B,\n title={b \\} }\n}"
+            u"@misc{A, title={second}}\n")
+        entries = list(iter_entries(self.master))
+        self.assertEqual(['A', 'B', 'A'], [e[1] for e in entries])
+        self.assertEqual(b"@misc{A, title={a}}", entries[0][3])
+        self.assertEqual(b"@misc{B,\n title={b \\} }\n}", entries[1][3])
+
+        index = BibIndex(self.master, self.index_dir)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            index.load()
+        self.assertIn('Duplicate key A', str(caught[0].message))
+        self.assertEqual(b"@misc{A, title={a}}", index.lookup(['A'])['A'])
+
+    def test_cited_keys(self):
+        self.assertEqual({'Dwyer2015', 'Marohn2014'},
+                         cited_keys([self.tmpdir/'doc.tex']))
+
+    def test_extract_entries(self):
+        data, missing = extract_entries(self.master,
+                                        ['Dwyer2015', 'Marohn2014', 'Nope'],
+                                        self.index_dir)
+        self.assertEqual({'Nope'}, missing)
+        self.assertIn(b'@string{prl', data)
+        self.assertIn(b'@proceedings{Proc2014', data)
+        self.assertNotIn(b'Unused2000', data)
+        # @string first, crossref'd entries last
+        self.assertTrue(data.index(b'@string') < data.index(b'Dwyer2015') <
+                        data.index(b'Marohn2014') < data.index(b'Proc2014'))
+
+    def test_sync_file(self):
+        dst = self.tmpdir/'copy.bib'
+        self.assertTrue(sync_file(self.master, dst))
+        self.assertFalse(sync_file(self.master, dst))
+        os.utime(str(dst), (0, 0))
+        self.assertFalse(sync_file(self.master, dst))
+        io.open(str(self.master), 'a').write(u"\n")
+        self.assertTrue(sync_file(self.master, dst))
+
+    def test_sync_bib_cited(self):
+        dst = self.tmpdir/'doc.bib'
+        message = sync_bib(self.master, dst, 'cited', self.tmpdir,
+                           self.index_dir)
+        self.assertTrue(message.startswith('Extracted 2 of 2'))
+        mtime = os.stat(str(dst)).st_mtime
+        message = sync_bib(self.master, dst, 'cited', self.tmpdir,
+                           self.index_dir)
+        self.assertTrue(message.startswith('Kept 2 of 2'))
+        self.assertEqual(mtime, os.stat(str(dst)).st_mtime)
+
+    def test_index(self):
+        index = BibIndex(self.master, self.index_dir)
+        self.assertTrue(index.load())
+        self.assertFalse(index.load())
+        self.assertEqual(4, len(index))
+        self.assertIn(b'Never cited', index.lookup(['Unused2000'])['Unused2000'])
+
+        # A new index object reuses the saved index
+        index = BibIndex(self.master, self.index_dir)
+        self.assertFalse(index.load())
+        self.assertIn('Proc2014', index)
+
+        # Changing the bib file rebuilds the index
+        io.open(str(self.master), 'a').write(u"@misc{New, title={New}}\n")
+        self.assertEqual({'New'}, set(index.lookup(['New', 'Old'])))
@@ -0,0 +1,185 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+import click
+
+from newtex import new_path
+from newtex.build import (build_document, find_main, parse_fls,
+                          BuildCancelled)
+from newtex.cache import ArtifactCache
+
+
+stub = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    'stub_tex.py')
+engine = '"{0}" "{1}" latex'.format(sys.executable, stub)
+bibtex = '"{0}" "{1}" bibtex'.format(sys.executable, stub)
+
+
+class TestBuild(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.doc_dir = self.tmpdir/'doc'
+        os.makedirs(str(self.doc_dir/'bib'))
+        os.makedirs(str(self.doc_dir/'bst'))
+        self.calls = str(self.tmpdir/'calls')
+        os.environ['STUB_TEX_CALLS'] = self.calls
+        self.write('doc.tex', u"\\documentclass{article}\n\\input{intro}\n"
+                              u"\\bibliographystyle{bst/style}\n"
+                              u"\\bibliography{bib/master}\n")
+        self.write('intro.tex', u"Text \\cite{a,b}.\n")
+        self.write('bib/master.bib', u"@article{a}\n@article{b}\n")
+        self.write('bst/style.bst', u"ENTRY\n")
+
+    def tearDown(self):
+        del os.environ['STUB_TEX_CALLS']
+        shutil.rmtree(str(self.tmpdir))
+
+    def write(self, name, text):
+        io.open(str(self.doc_dir/name), 'w', encoding='utf-8').write(text)
+
+    def build(self, **kwargs):
+        """Build the document, returning the report and the tools run."""
+        if os.path.exists(self.calls):
+            os.remove(self.calls)
+        report = build_document(self.doc_dir, engine=engine, bibtex=bibtex,
+                                **kwargs)
+        calls = []
+        if os.path.exists(self.calls):
+            calls = io.open(self.calls).read().split()
+        return report, calls
+
+    def test_incremental(self):
+        report, calls = self.build()
+        self.assertEqual(['latex', 'bibtex', 'latex', 'latex'], calls)
+        self.assertEqual('doc.tex', report.tex_file)
+
+        report, calls = self.build()
+        self.assertEqual([], calls)
+        self.assertTrue(report.up_to_date)
+        self.assertIn('up to date (saved', report.summary())
+
+        # Text changes, but the citations don't: no bibtex, one pdflatex
+        self.write('intro.tex', u"New text \\cite{a,b}.\n")
+        self.assertEqual(['latex'], self.build()[1])
+
+        # A new citation
+        self.write('intro.tex', u"New text \\cite{a,b,c}.\n")
+        self.assertEqual(['latex', 'bibtex', 'latex', 'latex'],
+                         self.build()[1])
+
+        # The bib file or style changes
+        self.write('bib/master.bib', u"@article{a}\n@article{c}\n")
+        self.assertEqual(['latex', 'bibtex', 'latex'], self.build()[1])
+        self.write('bst/style.bst', u"ENTRY FUNCTION\n")
+        self.assertEqual(['latex', 'bibtex', 'latex'], self.build()[1])
+
+        self.assertEqual(['latex', 'bibtex', 'latex'],
+                         self.build(force=True)[1])
+
+    def test_cache(self):
+        cache = ArtifactCache(self.tmpdir/'cache')
+        self.assertEqual(['latex', 'bibtex', 'latex', 'latex'],
+                         self.build(cache=cache)[1])
+
+        # Another document with the same citations, bib and style
+        shutil.copytree(str(self.doc_dir), str(self.tmpdir/'copy'))
+        os.remove(str(self.tmpdir/'copy'/'doc.bbl'))
+        os.remove(str(self.tmpdir/'copy'/'.newtex_build.json'))
+        self.doc_dir = self.tmpdir/'copy'
+        report, calls = self.build(cache=cache)
+        self.assertEqual(['latex', 'latex', 'latex'], calls)
+        self.assertEqual(['doc.bbl'], report.cached)
+
+        # Reverting an edit restores the PDF built before
+        self.write('intro.tex', u"Edited \\cite{a,b}.\n")
+        self.assertEqual(['latex'], self.build(cache=cache)[1])
+        self.write('intro.tex', u"Text \\cite{a,b}.\n")
+        report, calls = self.build(cache=cache)
+        self.assertEqual([], calls)
+        self.assertEqual(['doc.pdf', 'doc.aux'], report.cached)
+        self.assertIn('Text', io.open(str(self.doc_dir/'doc.pdf')).read())
+        self.assertTrue(self.build(cache=cache)[0].up_to_date)
+
+    def test_cache_outside_input(self):
+        cache = ArtifactCache(self.tmpdir/'cache')
+        shared = self.tmpdir/'shared'
+        os.makedirs(str(shared))
+        note = str(shared/'note.tex')
+        io.open(note, 'w').write(u"First note.\n")
+        self.write('intro.tex', u"Text.\n\\input{../shared/note}\n")
+        self.build(cache=cache)
+
+        # The PDF built from the old note isn't restored for the new one
+        io.open(note, 'w').write(u"Second note.\n")
+        report, calls = self.build(cache=cache)
+        self.assertEqual(['latex'], calls)
+        self.assertEqual([], report.cached)
+        self.assertIn('Second note',
+                      io.open(str(self.doc_dir/'doc.pdf')).read())
+
+        # But it is once the note is changed back
+        io.open(note, 'w').write(u"First note.\n")
+        report, calls = self.build(cache=cache)
+        self.assertEqual([], calls)
+        self.assertEqual(['doc.pdf', 'doc.aux'], report.cached)
+        self.assertIn('First note',
+                      io.open(str(self.doc_dir/'doc.pdf')).read())
+
+    def test_draft(self):
+        self.build()
+        # Switching between draft and final figures rebuilds
+        self.assertEqual('latex', self.build(draft=True)[1][0])
+        self.assertTrue(self.build(draft=True)[0].up_to_date)
+        self.assertEqual('latex', self.build()[1][0])
+
+    def test_failure(self):
+        self.write('intro.tex', u"\\fail\n")
+        with self.assertRaises(click.ClickException) as cm:
+            self.build()
+        self.assertIn('Undefined control sequence', cm.exception.message)
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        cancel.set()
+        with self.assertRaises(BuildCancelled):
+            self.build(cancel=cancel)
+        self.assertEqual(['latex', 'bibtex', 'latex', 'latex'],
+                         self.build()[1])
+
+    def test_find_main(self):
+        self.assertEqual('doc.tex', find_main(self.doc_dir))
+        self.write('other.tex', u"\\documentclass{article}\n")
+        with self.assertRaises(click.ClickException):
+            find_main(self.doc_dir)
+
+    def test_outside_input(self):
+        shared = self.tmpdir/'shared'
+        os.makedirs(str(shared))
+        io.open(str(shared/'note.tex'), 'w').write(u"Shared note.\n")
+        self.write('intro.tex',
+                   u"Text \\cite{a,b}.\n\\input{../shared/note}\n")
+        self.build()
+        self.assertTrue(self.build()[0].up_to_date)
+
+        # A file outside the document directory changes
+        io.open(str(shared/'note.tex'), 'w').write(u"Edited note.\n")
+        self.assertEqual(['latex'], self.build()[1])
+        self.assertIn('Edited note',
+                      io.open(str(self.doc_dir/'doc.pdf')).read())
+
+    def test_parse_fls(self):
+        self.build()
+        inputs, outputs = parse_fls(self.doc_dir/'doc.fls', self.doc_dir,
+                                    ignore=['/usr/share/texmf'])
+        self.assertEqual(set(['doc.tex', 'intro.tex', 'doc.bbl', 'doc.aux']),
+                         inputs)
+        self.assertIn('doc.pdf', outputs)
+        # Without ignore, files outside doc_dir are kept, as absolute paths
+        inputs, outputs = parse_fls(self.doc_dir/'doc.fls', self.doc_dir)
+        self.assertIn(os.path.normpath(
+            '/usr/share/texmf/tex/latex/base/article.cls'), inputs)
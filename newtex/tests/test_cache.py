@@ -0,0 +1,83 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import click
+
+from newtex import new_path
+from newtex.cache import ArtifactCache, cache_key, parse_size
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.cache = ArtifactCache(self.tmpdir/'cache', max_size=100)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def write(self, name, text):
+        io.open(str(self.tmpdir/name), 'w').write(text)
+        return str(self.tmpdir/name)
+
+    def test_get_put(self):
+        key = cache_key('bbl', 'citations', 'bib')
+        self.assertNotEqual(key, cache_key('bbl', 'citations', 'bib2'))
+        dst = str(self.tmpdir/'out.bbl')
+        self.assertFalse(self.cache.get(key, dst))
+
+        self.cache.put(key, 'bbl', self.write('doc.bbl', u"\\bibitem{a}\n"))
+        self.cache.put(cache_key('bbl', 'other'), 'bbl',
+                       self.write('other.bbl', u"\\bibitem{a}\n"))
+        self.assertTrue(self.cache.get(key, dst))
+        self.assertEqual(u"\\bibitem{a}\n", io.open(dst).read())
+
+        stats = self.cache.stats()
+        self.assertEqual((2, 1), (stats['entries'], stats['objects']))
+        self.assertEqual((1, 1), (stats['hits'], stats['misses']))
+        self.assertEqual({'bbl': (2, 24)}, stats['kinds'])
+
+    def test_lru_eviction(self):
+        for name in 'ab':
+            self.cache.put(name, 'pdf', self.write(name, name * 40))
+        # Using a makes b the least recently used
+        self.assertTrue(self.cache.get('a', str(self.tmpdir/'out')))
+        self.cache.put('c', 'pdf', self.write('c', 'c' * 40))
+
+        present = [name for name in 'abc'
+                   if self.cache.get(name, str(self.tmpdir/'out'))]
+        self.assertEqual(['a', 'c'], present)
+        self.assertEqual(80, self.cache.stats()['size'])
+        objects = [name for dirpath, dirnames, filenames
+                   in os.walk(str(self.tmpdir/'cache'/'objects'))
+                   for name in filenames]
+        self.assertEqual(2, len(objects))
+
+        self.assertEqual((2, 80), self.cache.prune(max_size=0))
+        self.assertEqual(0, self.cache.stats()['entries'])
+
+    def test_object_removed(self):
+        # As by another process evicting it between lookup and copy
+        self.cache.put('a', 'pdf', self.write('a', 'a' * 40))
+        for dirpath, dirnames, filenames in os.walk(
+                str(self.tmpdir/'cache'/'objects')):
+            for name in filenames:
+                os.remove(os.path.join(dirpath, name))
+        self.assertFalse(self.cache.get('a', str(self.tmpdir/'out')))
+        self.assertEqual(1, self.cache.stats()['misses'])
+
+    def test_too_large(self):
+        self.cache.put('a', 'pdf', self.write('a', 'a' * 40))
+        self.cache.put('big', 'pdf', self.write('big', 'b' * 101))
+        self.assertFalse(self.cache.get('big', str(self.tmpdir/'out')))
+        self.assertTrue(self.cache.get('a', str(self.tmpdir/'out')))
+        self.assertEqual(40, self.cache.stats()['size'])
+
+    def test_parse_size(self):
+        self.assertEqual(500 * 2**20, parse_size('500M'))
+        self.assertEqual(2**30, parse_size('1GB'))
+        self.assertEqual(1024, parse_size('1024'))
+        with self.assertRaises(click.BadParameter):
+            parse_size('lots')
@@ -0,0 +1,99 @@
+import io
+import os
+import errno
+import shutil
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+
+from newtex import pkg_config_dir, new_path
+from newtex.clean import (clean_dir, clean_patterns, default_patterns,
+                          Matcher, clean)
+
+
+class TestClean(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        shutil.copy(str(pkg_config_dir/'gitignore'),
+                    str(self.tmpdir/'.gitignore'))
+        self.files = ['doc.tex', 'doc.aux', 'doc.pdf', 'doc.synctex.gz',
+                      'notes.docx', 'figs/ex.pdf', 'chapters/ch1.aux',
+                      'chapters/ch1.tex', '.git/index.log']
+        for name in self.files:
+            path = self.tmpdir/name
+            if not path.parent.exists():
+                os.makedirs(str(path.parent))
+            io.open(str(path), 'w').write(u'x')
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def remaining(self):
+        return sorted(name for name in self.files
+                      if (self.tmpdir/name).exists())
+
+    def test_patterns_from_gitignore(self):
+        patterns = clean_patterns(self.tmpdir)
+        self.assertIn('/*.pdf', patterns)
+        self.assertIn('*.toc', patterns)
+        self.assertNotIn('**.docx', patterns)
+        self.assertEqual(default_patterns, clean_patterns(self.tmpdir/'figs'))
+
+    def test_matcher(self):
+        matcher = Matcher(['*.aux', '/*.pdf', '**.pyc'])
+        self.assertTrue(matcher.match('a/b.aux', 'b.aux'))
+        self.assertTrue(matcher.match('doc.pdf', 'doc.pdf'))
+        self.assertFalse(matcher.match('figs/ex.pdf', 'ex.pdf'))
+        self.assertTrue(matcher.match('x/y.pyc', 'y.pyc'))
+
+    def test_clean(self):
+        report = clean_dir(self.tmpdir, dry_run=True)
+        self.assertEqual(3, len(report.files))
+        self.assertEqual(len(self.files), len(self.remaining()))
+
+        clean_dir(self.tmpdir)
+        self.assertEqual(['.git/index.log', 'chapters/ch1.aux',
+                          'chapters/ch1.tex', 'doc.tex', 'figs/ex.pdf',
+                          'notes.docx'], self.remaining())
+
+    def test_clean_recursive(self):
+        report = clean_dir(self.tmpdir, recursive=True, jobs=2)
+        self.assertEqual(4, len(report.files))
+        self.assertNotIn('chapters/ch1.aux', self.remaining())
+        self.assertIn('figs/ex.pdf', self.remaining())
+        self.assertIn('.git/index.log', self.remaining())
+        self.assertIn('Removed 4', report.summary())
+
+    def test_clean_parallel(self):
+        for i in range(100):
+            io.open(str(self.tmpdir/'chapters'/'ch{0}.log'.format(i)),
+                    'w').write(u'x')
+        report = clean_dir(self.tmpdir, recursive=True, jobs=4)
+        self.assertEqual(104, len(report.files))
+        self.assertEqual(['ch1.tex'], os.listdir(str(self.tmpdir/'chapters')))
+
+    def test_clean_failures(self):
+        remove = os.remove
+        locked = str(self.tmpdir/'doc.aux')
+
+        def fail_locked(path):
+            if path == locked:
+                raise OSError(errno.EACCES, os.strerror(errno.EACCES), path)
+            remove(path)
+
+        os.remove = fail_locked
+        try:
+            report = clean_dir(self.tmpdir)
+            result = CliRunner().invoke(clean, [str(self.tmpdir)])
+        finally:
+            os.remove = remove
+        self.assertEqual([locked], [path for path, error in report.failed])
+        self.assertEqual(2, len(report.removed))
+        summary = report.summary()
+        self.assertNotIn('removed ' + locked, summary)
+        self.assertIn('could not remove ' + locked, summary)
+        self.assertIn('Removed 2 aux / compiled files', summary)
+        self.assertIn('could not remove 1', summary)
+        # The command fails while anything is left
+        self.assertEqual(1, result.exit_code, result.output)
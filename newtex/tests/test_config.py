@@ -0,0 +1,107 @@
+import io
+import os
+import json
+import pickle
+import datetime
+import shutil
+import tempfile
+import unittest
+
+import click
+from click.testing import CliRunner
+
+from newtex import new_path, verify_config, pkg_config_dir
+from newtex.config import read_config, cache_file, config
+
+
+class TestReadConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.config_file = self.tmpdir/'config.yaml'
+        self.write(u"""---
+created: 2015-09-01
+master_bib_file: 'master.bib'
+default_style: naturemag_jm.bst
+authors:
+    - Ryan Dwyer
+affiliations:
+    - Cornell
+""")
+        self.verified = []
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def write(self, text):
+        io.open(str(self.config_file), 'w').write(text)
+
+    def verify(self, config):
+        self.verified.append(config)
+        verify_config(config)
+
+    def test_cache(self):
+        config = read_config(self.config_file, self.verify)
+        self.assertEqual(['Ryan Dwyer'], config['authors'])
+        self.assertTrue(os.path.exists(cache_file(self.config_file)))
+
+        self.assertEqual(config, read_config(self.config_file, self.verify))
+        self.assertEqual(1, len(self.verified))
+
+        # Same contents, new modification time: still cached
+        os.utime(str(self.config_file), (0, 0))
+        self.assertEqual(config, read_config(self.config_file, self.verify))
+        self.assertEqual(1, len(self.verified))
+
+    def test_snapshot_json(self):
+        config = read_config(self.config_file, self.verify)
+        with io.open(cache_file(self.config_file), encoding='utf-8') as f:
+            snapshot = json.load(f)
+        self.assertEqual({'__date__': '2015-09-01'},
+                         snapshot['config']['created'])
+        self.assertEqual(datetime.date(2015, 9, 1),
+                         read_config(self.config_file, self.verify)['created'])
+        self.assertEqual(1, len(self.verified))
+
+    def test_pickle_snapshot_ignored(self):
+        with open(cache_file(self.config_file), 'wb') as f:
+            pickle.dump({'config': {}}, f)
+        config = read_config(self.config_file, self.verify)
+        self.assertEqual(['Ryan Dwyer'], config['authors'])
+        self.assertEqual(1, len(self.verified))
+
+    def test_not_json_not_cached(self):
+        self.write(io.open(str(self.config_file)).read() + u"1: one\n")
+        config = read_config(self.config_file, self.verify)
+        self.assertEqual('one', config[1])
+        self.assertFalse(os.path.exists(cache_file(self.config_file)))
+
+    def test_changed(self):
+        read_config(self.config_file, self.verify)
+        self.write(io.open(str(self.config_file)).read().replace(
+            'Ryan Dwyer', 'John A. Marohn'))
+        config = read_config(self.config_file, self.verify)
+        self.assertEqual(['John A. Marohn'], config['authors'])
+        self.assertEqual(2, len(self.verified))
+
+    def test_invalid_not_cached(self):
+        self.write(u"authors:\n")
+        for i in range(2):
+            with self.assertRaises(click.ClickException):
+                read_config(self.config_file, self.verify)
+        self.assertEqual(2, len(self.verified))
+
+    def test_check_command(self):
+        result = CliRunner().invoke(
+            config, ['check', '--config-dir', str(self.tmpdir)])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn('is valid', result.output)
+
+    def test_check_pack(self):
+        from newtex.pack import write_pack
+        shutil.copytree(str(pkg_config_dir), str(self.tmpdir/'template'))
+        shutil.copy(str(self.config_file), str(self.tmpdir/'template'))
+        pack = str(self.tmpdir/'template.ntpack')
+        write_pack(str(self.tmpdir/'template'), pack)
+        result = CliRunner().invoke(config, ['check', '--config-dir', pack])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn('is valid', result.output)
@@ -0,0 +1,113 @@
+import io
+import os
+import re
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+
+from newtex import new_path
+from newtex.build import _read_state, _write_state
+from newtex.farm import build_all, build_all_command, discover, schedule
+from newtex.figs import converters
+
+
+stub = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    'stub_tex.py')
+engine = '"{0}" "{1}" latex'.format(sys.executable, stub)
+bibtex = '"{0}" "{1}" bibtex'.format(sys.executable, stub)
+
+names = ['_JAM_GT__Dwyer201509__grant',
+         '_JAM_MS__Dwyer201510__paper',
+         '_JAM_RP__Dwyer201511__broken']
+
+
+class TestFarm(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.root = self.tmpdir/'docs'
+        for name in names:
+            doc_dir = self.root/'2015'/name
+            os.makedirs(str(doc_dir))
+            text = u"\\documentclass{article}\nText.\n"
+            if 'broken' in name:
+                text += u"\\fail\n"
+            io.open(str(doc_dir/(name + '.tex')), 'w').write(text)
+        os.makedirs(str(self.root/'2015'/'notes'))
+        self.docs = [str((self.root/'2015'/name).absolute())
+                     for name in names]
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def test_discover(self):
+        self.assertEqual(self.docs, discover([self.root]))
+        self.assertEqual(self.docs[:2],
+                         discover([self.root], doc_type=('GT', 'MS')))
+
+    def test_schedule(self):
+        for doc_dir, latex in zip(self.docs[1:], [1.0, 3.0]):
+            _write_state(doc_dir, {'seconds_per_run': {'latex': latex}})
+        # Never built first, then longest first
+        self.assertEqual([self.docs[0], self.docs[2], self.docs[1]],
+                         [doc_dir for doc_dir, seconds
+                          in schedule(self.docs)])
+
+    def test_build_all(self):
+        report = build_all(self.docs, jobs=2, engine=engine, bibtex=bibtex)
+        self.assertEqual(2, report.jobs)
+        self.assertEqual([self.docs[2]],
+                         [result.doc_dir for result in report.failures])
+        self.assertIn("Undefined control sequence",
+                      report.failures[0].error)
+        self.assertIn("Built 2 of 3 documents", report.summary())
+
+        tmpdirs = set()
+        for doc_dir in self.docs[:2]:
+            log = io.open(os.path.join(doc_dir, os.path.basename(doc_dir) +
+                                       '.log')).read()
+            tmpdir = re.search(r'TMPDIR=(.*)', log).group(1)
+            self.assertFalse(os.path.exists(tmpdir))
+            tmpdirs.add(tmpdir)
+        self.assertEqual(2, len(tmpdirs))
+        self.assertIn('latex', _read_state(self.docs[0])['seconds_per_run'])
+
+    def test_figures(self):
+        copy = '"{0}" -c "import shutil, sys; shutil.copyfile(sys.argv[1], ' \
+               'sys.argv[2])" {{source}} {{output}}'.format(sys.executable)
+        os.makedirs(os.path.join(self.docs[0], 'figs'))
+        io.open(os.path.join(self.docs[0], 'figs', 'plot.svg'),
+                'w').write(u"<svg/>")
+        svg = converters['svg']
+        converters['svg'] = copy
+        try:
+            report = build_all(self.docs[:1], engine=engine, bibtex=bibtex)
+        finally:
+            converters['svg'] = svg
+        self.assertEqual([], report.failures)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.docs[0], '.newtex_figs', 'final', 'figs', 'plot.pdf')))
+
+    def test_command(self):
+        output = str(self.tmpdir/'builds.json')
+        result = CliRunner().invoke(build_all_command, [
+            str(self.root), '--engine', engine, '--bibtex', bibtex,
+            '--no-cache', '--json', output])
+        self.assertEqual(1, result.exit_code, result.output)
+        self.assertIn("FAIL", result.output)
+        with open(output) as f:
+            data = json.load(f)
+        self.assertFalse(data['ok'])
+        self.assertEqual(1, data['failures'])
+        self.assertEqual(set(self.docs),
+                         set(doc['doc_dir'] for doc in data['documents']))
+
+        result = CliRunner().invoke(build_all_command, [
+            str(self.root), '--type', 'GT', '--engine', engine, '--bibtex',
+            bibtex, '--no-cache', '--json', '-'])
+        self.assertEqual(0, result.exit_code, result.output)
+        data = json.loads(result.output)
+        self.assertTrue(data['documents'][0]['up_to_date'])
@@ -0,0 +1,137 @@
+import io
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+
+import click
+
+from newtex import new_path
+from newtex.cache import ArtifactCache
+from newtex.figs import (convert_figures, find_sources, figure_roots, plan,
+                         image_size, texinputs)
+
+
+copy = '"{0}" -c "import shutil, sys; shutil.copyfile(sys.argv[1], ' \
+       'sys.argv[2])" {{source}} {{output}}'.format(sys.executable)
+fail = '"{0}" -c "import sys; sys.exit(\'cannot read\')" {{source}} ' \
+       '{{output}}'.format(sys.executable)
+commands = dict((kind, copy) for kind in ('svg', 'eps', 'raster', 'preview'))
+
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + \
+        struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00'
+
+
+class TestFigs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.doc_dir = self.tmpdir/'doc'
+        self.large_figs = self.tmpdir/'Dropbox'/'doc__figs'
+        os.makedirs(str(self.doc_dir/'figs'/'sub'))
+        os.makedirs(str(self.large_figs))
+        self.write(self.doc_dir/'doc.tex',
+                   u"\\graphicspath{{%s/}}\n" % self.large_figs)
+        self.write(self.doc_dir/'figs'/'ex.pdf', u"pdf")
+        self.write(self.doc_dir/'figs'/'sub'/'plot.svg', u"<svg/>")
+        self.write(self.large_figs/'scan.tif', u"tiff")
+        self.write(self.large_figs/'small.png', png(100, 50))
+        self.write(self.large_figs/'huge.png', png(8000, 6000))
+        self.cache = ArtifactCache(str(self.tmpdir/'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def write(self, path, data):
+        mode = 'wb' if isinstance(data, bytes) else 'w'
+        with io.open(str(path), mode) as f:
+            f.write(data)
+
+    def convert(self, **kwargs):
+        kwargs.setdefault('commands', commands)
+        return convert_figures(self.doc_dir, 'doc.tex', jobs=2, **kwargs)
+
+    def test_image_size(self):
+        self.assertEqual((8000, 6000),
+                         image_size(str(self.large_figs/'huge.png')))
+        jpeg = self.tmpdir/'photo.jpg'
+        self.write(jpeg, b'\xff\xd8\xff\xe0\x00\x04ab\xff\xc0\x00\x11\x08'
+                         b'\x01\x2c\x02\x58\x03')
+        self.assertEqual((600, 300), image_size(str(jpeg)))
+        self.assertIsNone(image_size(str(self.doc_dir/'figs'/'ex.pdf')))
+
+    def test_plan(self):
+        sources = find_sources(figure_roots(self.doc_dir, 'doc.tex'))
+        self.assertEqual(['figs/ex', 'figs/sub/plot', 'huge', 'scan',
+                          'small'], sorted(sources))
+        final = dict((figure.output, figure.converter)
+                     for figure in plan(sources))
+        self.assertEqual({'figs/sub/plot.pdf': 'svg', 'scan.png': 'raster',
+                          'huge.png': 'raster'}, final)
+        draft = plan(sources, draft=True, preview_pixels=200)
+        self.assertEqual(['figs/ex.pdf', 'figs/sub/plot.pdf', 'huge.png',
+                          'scan.png', 'small.png'],
+                         [figure.output for figure in draft])
+        self.assertEqual(set([200]), set(figure.size for figure in draft))
+
+        self.write(self.large_figs/'scan.gif', u"gif")
+        sources = find_sources(figure_roots(self.doc_dir, 'doc.tex'))
+        with self.assertRaises(click.ClickException):
+            plan(sources)
+
+    def test_incremental(self):
+        report = self.convert(cache=self.cache)
+        self.assertTrue(report.ok)
+        self.assertEqual(['figs/sub/plot.pdf', 'huge.png', 'scan.png'],
+                         report.converted)
+        final = self.doc_dir/'.newtex_figs'/'final'
+        self.assertEqual(u"<svg/>", io.open(
+            str(final/'figs'/'sub'/'plot.pdf')).read())
+
+        report = self.convert(cache=self.cache)
+        self.assertEqual([], report.converted)
+        self.assertEqual(3, len(report.unchanged))
+
+        # A changed source is converted again; a removed one is cleaned up
+        self.write(self.doc_dir/'figs'/'sub'/'plot.svg', u"<svg></svg>")
+        os.remove(str(self.large_figs/'scan.tif'))
+        report = self.convert(cache=self.cache)
+        self.assertEqual(['figs/sub/plot.pdf'], report.converted)
+        self.assertEqual(['scan.png'], report.removed)
+        self.assertFalse(os.path.exists(str(final/'scan.png')))
+
+        # Other settings make other figures
+        report = self.convert(cache=self.cache, max_pixels=10000)
+        self.assertEqual(['huge.png'], report.removed)
+
+    def test_cache(self):
+        self.convert(cache=self.cache, draft=True)
+        shutil.rmtree(str(self.doc_dir/'.newtex_figs'))
+        report = self.convert(cache=self.cache, draft=True)
+        self.assertEqual([], report.converted)
+        self.assertEqual(5, len(report.cached))
+        self.assertEqual(5, self.cache.stats()['kinds']['fig'][0])
+
+    def test_failure(self):
+        report = self.convert(commands=dict(commands, svg=fail))
+        self.assertFalse(report.ok)
+        self.assertEqual('figs/sub/plot.pdf', report.failed[0][0])
+        self.assertIn("cannot read", report.summary())
+        report = self.convert()
+        self.assertEqual(['figs/sub/plot.pdf'], report.converted)
+
+        self.write(self.doc_dir/'figs'/'sub'/'plot.svg', u"<svg></svg>")
+        report = self.convert(commands=dict(commands, svg='no-such-inkscape'))
+        self.assertIn("no-such-inkscape not found", report.summary())
+
+    def test_texinputs(self):
+        self.assertNotIn('newtex_figs',
+                         texinputs(self.doc_dir, env={}).get('TEXINPUTS', ''))
+        self.convert(draft=True)
+        env = texinputs(self.doc_dir, draft=True, env={'TEXINPUTS': 'x:'})
+        self.assertEqual(os.path.abspath(
+            str(self.doc_dir/'.newtex_figs'/'draft')) + '//:x:',
+            env['TEXINPUTS'])
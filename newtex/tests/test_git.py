@@ -1,6 +1,137 @@
+import io
+import os
+import shutil
+import tempfile
 import unittest
+import subprocess
+
+from newtex import pkg_config_dir, new_path
+from newtex._git import setup_repositories, setup_many
 
 
 class TestExample(unittest.TestCase):
     def test_example(self):
         self.assertEquals(0, 0)
+
+
+def git(path, *args):
+    return subprocess.check_output(('git',) + args, cwd=str(path),
+                                   stderr=subprocess.STDOUT).decode('utf-8')
+
+
+class TestSetupRepositories(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+            os.environ.setdefault(var, 'newtex')
+        for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+            os.environ.setdefault(var, 'newtex@example.com')
+        self.doc_dir = self.tmpdir/'_JAM_RP__Dwyer201509__doc'
+        shutil.copytree(str(pkg_config_dir), str(self.doc_dir))
+        (self.doc_dir/'gitignore').rename(self.doc_dir/'.gitignore')
+        open(str(self.doc_dir/'doc.aux'), 'w').write('ignored')
+        self.dropbox = self.tmpdir/'Dropbox'
+        os.mkdir(str(self.dropbox))
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def check_repositories(self):
+        bare_repo = self.dropbox/(self.doc_dir.name+'.git')
+        git(self.doc_dir, 'fsck', '--strict')
+        git(bare_repo, 'fsck', '--strict')
+        self.assertEqual('', git(self.doc_dir, 'status', '--porcelain'))
+        self.assertEqual(git(self.doc_dir, 'rev-parse', 'HEAD'),
+                         git(bare_repo, 'rev-parse', 'master'))
+        self.assertEqual('origin/master\n', git(
+            self.doc_dir, 'rev-parse', '--abbrev-ref', 'master@{upstream}'))
+        files = git(self.doc_dir, 'ls-files').splitlines()
+        self.assertIn('figs/ex.pdf', files)
+        self.assertIn('bst/naturemag_jm.bst', files)
+        self.assertNotIn('doc.aux', files)
+        return files
+
+    def test_native(self):
+        setup_repositories(self.doc_dir, self.dropbox, engine='native',
+                           out=open(os.devnull, 'w'))
+        files = self.check_repositories()
+        self.assertEqual('Initial automatic commit by newtex\n',
+                         git(self.doc_dir, 'log', '--format=%B', '-1')[:-1])
+        git(self.doc_dir, 'push', '--dry-run')
+        subprocess_doc = self.tmpdir/'compare'
+        shutil.copytree(str(pkg_config_dir), str(subprocess_doc))
+        (subprocess_doc/'gitignore').rename(subprocess_doc/'.gitignore')
+        git(subprocess_doc, 'init')
+        git(subprocess_doc, 'add', '-A')
+        self.assertEqual(git(subprocess_doc, 'write-tree'),
+                         git(self.doc_dir, 'rev-parse', 'HEAD^{tree}'))
+
+    def test_native_ignores(self):
+        def write(name, text=u"x"):
+            path = self.doc_dir/name
+            if not path.parent.exists():
+                os.makedirs(str(path.parent))
+            io.open(str(path), 'w').write(text)
+
+        excludes = self.tmpdir/'excludes'
+        io.open(str(excludes), 'w').write(u"*.secret\n")
+        with io.open(str(self.doc_dir/'.gitignore'), 'a') as f:
+            f.write(u"build/**\n**/cache/*.log\n\\#notes\n")
+        for name in ('build/a/b.txt', 'cache/a.log', 'x/cache/a.log',
+                     '#notes', 'keys.secret', 'sub/local.txt',
+                     'sub/kept.txt', 'x/cache/a.txt'):
+            write(name)
+        write('sub/.gitignore', u"local.txt\n")
+        compare = self.tmpdir/'compare'
+        shutil.copytree(str(self.doc_dir), str(compare))
+
+        os.environ['GIT_CONFIG_PARAMETERS'] = \
+            "'core.excludesfile={0}'".format(excludes)
+        try:
+            setup_repositories(self.doc_dir, self.dropbox, engine='native',
+                               out=open(os.devnull, 'w'))
+            git(compare, 'init')
+            git(compare, 'add', '-A')
+            expected = git(compare, 'ls-files').splitlines()
+        finally:
+            del os.environ['GIT_CONFIG_PARAMETERS']
+        files = git(self.doc_dir, 'ls-files').splitlines()
+        self.assertEqual(expected, files)
+        self.assertIn('sub/kept.txt', files)
+        self.assertIn('x/cache/a.txt', files)
+        for name in ('build/a/b.txt', 'cache/a.log', 'x/cache/a.log',
+                     '#notes', 'keys.secret', 'sub/local.txt'):
+            self.assertNotIn(name, files)
+
+    def test_subprocess(self):
+        os.environ['GIT_CONFIG_PARAMETERS'] = "'init.defaultbranch=master'"
+        try:
+            setup_repositories(self.doc_dir, self.dropbox, engine='subprocess',
+                               out=open(os.devnull, 'w'))
+        finally:
+            del os.environ['GIT_CONFIG_PARAMETERS']
+        self.check_repositories()
+        self.assertTrue(git(self.dropbox/(self.doc_dir.name+'.git'),
+                            'symbolic-ref', 'HEAD').startswith('refs/heads/master'))
+
+    def test_setup_many(self):
+        docs = [self.doc_dir]
+        for name in ('second', 'third'):
+            docs.append(self.tmpdir/name)
+            shutil.copytree(str(self.doc_dir), str(docs[-1]))
+        os.mkdir(str(self.dropbox/'third.git'))
+        results = setup_many([
+            {'path': doc, 'bare_path': self.dropbox,
+             'large_figs_dir': self.dropbox/(doc.name+'__figs')}
+            for doc in docs], jobs=2)
+
+        self.assertEqual(docs, [result.path for result in results])
+        self.assertEqual([True, True, False],
+                         [result.ok for result in results])
+        self.assertIn('already exists', str(results[2].error))
+        self.check_repositories()
+        for doc in docs:
+            self.assertTrue((self.dropbox/(doc.name+'__figs')).is_dir())
+        self.assertEqual(
+            ['create large figures directory', 'write repositories'],
+            sorted(step.name for step in results[0].steps))
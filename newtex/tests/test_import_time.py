@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+import subprocess
+
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def imported_modules(code):
+    """Return the modules imported after running code in a fresh
+    interpreter."""
+    code += "; import sys; print(' '.join(sys.modules))"
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+    return set(out.decode('utf-8').splitlines()[-1].split())
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_import_newtex(self):
+        modules = imported_modules('import newtex')
+        for module in ('click', 'yaml', 'newtex._version', 'newtex.scaffold'):
+            self.assertNotIn(module, modules)
+
+    def test_version(self):
+        modules = imported_modules(
+            'from newtex.__main__ import main; main(["--version"])')
+        self.assertNotIn('click', modules)
+
+    def test_help(self):
+        modules = imported_modules(
+            'from newtex.commands import cli; '
+            'cli.main(["--help"], standalone_mode=False)')
+        for module in ('yaml', 'newtex._git', 'newtex.bib', 'newtex.batch',
+                       'newtex.styles', 'newtex.clean'):
+            self.assertNotIn(module, modules)
+
+    def test_lazy_attributes(self):
+        import newtex
+        self.assertEqual('cli', newtex.cli.name)
+        self.assertTrue(newtex.pkg_config_dir.exists())
+        with self.assertRaises(AttributeError):
+            newtex.does_not_exist
@@ -0,0 +1,102 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from newtex import new_path, pkg_config_dir
+from newtex._tree import copy_tree
+from newtex.manifest import (build_manifest, read_package_manifest,
+                             update_template, installed_name,
+                             merge_previous)
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.src = self.tmpdir/'newtexrc'
+        shutil.copytree(str(pkg_config_dir), str(self.src))
+        self.config_dir = self.tmpdir/'newtex_template'
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def update(self, **kwargs):
+        return update_template(self.config_dir, src_dir=self.src,
+                               manifest=build_manifest(self.src), **kwargs)
+
+    def write(self, path, text):
+        io.open(str(path), 'w').write(text)
+
+    def test_package_manifest_current(self):
+        self.assertEqual(build_manifest(), read_package_manifest(),
+                         "Run python -m newtex.manifest")
+
+    def test_install(self):
+        report = self.update()
+        self.assertIn('bst/naturemag_jm.bst', report.written)
+        self.assertTrue((self.config_dir/installed_name).exists())
+        self.assertTrue((self.config_dir/'figs'/'ex.pdf').exists())
+
+        report = self.update()
+        self.assertEqual([], report.written)
+        self.assertEqual(len(build_manifest(self.src)), report.unchanged)
+
+    def test_update_keeps_modified(self):
+        self.update()
+        self.write(self.config_dir/'fabfile.py', u"# my fabfile\n")
+        self.write(self.src/'fabfile.py', u"# new upstream fabfile\n")
+        self.write(self.src/'template.tex', u"% new upstream template\n")
+        self.write(self.src/'new.txt', u"new\n")
+
+        report = self.update(dry_run=True)
+        self.assertEqual(['new.txt', 'template.tex'], report.written)
+        self.assertFalse((self.config_dir/'new.txt').exists())
+
+        report = self.update()
+        self.assertEqual(['new.txt', 'template.tex'], report.written)
+        self.assertEqual(['fabfile.py'], report.modified)
+        self.assertEqual(u"% new upstream template\n", io.open(
+            str(self.config_dir/'template.tex')).read())
+        self.assertEqual(u"# my fabfile\n", io.open(
+            str(self.config_dir/'fabfile.py')).read())
+
+        report = self.update(force=True)
+        self.assertEqual(['fabfile.py'], report.written)
+        self.assertEqual(u"# new upstream fabfile\n", io.open(
+            str(self.config_dir/'fabfile.py')).read())
+
+    def test_update_without_installed_manifest(self):
+        # Set up by a release that copied the template without a manifest
+        shutil.copytree(str(self.src), str(self.config_dir))
+        old = build_manifest(self.src)
+        self.write(self.config_dir/'template.tex', u"% my template\n")
+        self.write(self.src/'fabfile.py', u"# new upstream fabfile\n")
+        self.write(self.src/'template.tex', u"% new upstream template\n")
+        new = build_manifest(self.src)
+        previous = merge_previous({}, old, new)
+        self.assertEqual(['fabfile.py', 'template.tex'], sorted(previous))
+
+        report = update_template(self.config_dir, src_dir=self.src,
+                                 manifest=new, previous=previous)
+        self.assertEqual(['fabfile.py'], report.written)
+        self.assertEqual(['template.tex'], report.modified)
+        self.assertIn('newtex template update --force', report.summary())
+        self.assertEqual(u"# new upstream fabfile\n", io.open(
+            str(self.config_dir/'fabfile.py')).read())
+
+        # Merging again adds nothing new
+        self.assertEqual(previous, merge_previous(previous, old, new))
+
+    def test_update_keeps_linked_documents(self):
+        self.update()
+        doc = self.tmpdir/'doc'
+        copy_tree(self.config_dir, doc, link_mode='hardlink')
+        bst = 'bst/naturemag_jm.bst'
+        before = io.open(str(doc/bst)).read()
+        self.write(self.src/bst, u"% new upstream style\n")
+
+        self.assertEqual([bst], self.update().written)
+        self.assertEqual(u"% new upstream style\n",
+                         io.open(str(self.config_dir/bst)).read())
+        self.assertEqual(before, io.open(str(doc/bst)).read())
@@ -0,0 +1,77 @@
+import os
+import shutil
+import filecmp
+import zipfile
+import datetime
+import tempfile
+import unittest
+
+import click
+
+from newtex import new_path, load_config, load_templates
+from newtex.batch import run_batch
+from newtex.pack import write_pack, TemplatePack
+from newtex.tests.test_batch import make_config
+
+
+class TestTemplatePack(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.config_dir, self.config = make_config(self.tmpdir)
+        open(str(self.config_dir/'.config.yaml.cache'), 'w').write('cache')
+        self.pack_file = self.tmpdir/'template.ntpack'
+        write_pack(self.config_dir, self.pack_file)
+        for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+            os.environ.setdefault(var, 'newtex')
+        for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+            os.environ.setdefault(var, 'newtex@example.com')
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def test_pack(self):
+        with zipfile.ZipFile(str(self.pack_file)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertIn('bst/naturemag_jm.bst', zf.namelist())
+            self.assertNotIn('.config.yaml.cache', zf.namelist())
+        pack = TemplatePack(self.pack_file)
+        self.assertEqual([], pack.verify())
+
+        dst = self.tmpdir/'extracted'
+        pack.extract(dst, exclude=['config.yaml', 'bst'])
+        self.assertFalse((dst/'bst').exists())
+        self.assertFalse((dst/'config.yaml').exists())
+        self.assertTrue(filecmp.cmp(str(self.config_dir/'figs'/'ex.pdf'),
+                                    str(dst/'figs'/'ex.pdf'), shallow=False))
+        self.assertTrue(filecmp.cmp(str(self.config_dir/'template.tex'),
+                                    str(dst/'template.tex'), shallow=False))
+
+    def test_corrupt(self):
+        pack = TemplatePack(self.pack_file)
+        entry = pack.files['template.tex']
+        with open(str(self.pack_file), 'r+b') as f:
+            f.seek(entry['offset'])
+            f.write(b'X')
+        self.assertEqual(['template.tex'],
+                         TemplatePack(self.pack_file).verify())
+
+        open(str(self.tmpdir/'not_a_pack'), 'w').write('text')
+        self.assertRaises(click.ClickException, TemplatePack,
+                          self.tmpdir/'not_a_pack')
+
+    def test_create_from_pack(self):
+        self.assertEqual(self.config, load_config(self.pack_file))
+        self.assertEqual(load_templates(self.config_dir)['tex'].template,
+                         load_templates(self.pack_file)['tex'].template)
+
+        entry = {'doc_type': 'RP', 'short_name': 'packed', 'title': 'Packed',
+                 'destination': str(self.tmpdir),
+                 'date': datetime.date(2015, 9, 1)}
+        config = dict(self.config, bst_mode='selected')
+        report = run_batch([entry], config, self.pack_file)
+        self.assertEqual([], report.failures)
+        doc_dir = report.results[0].paths['doc_dir']
+        self.assertEqual(['naturemag_jm.bst'], os.listdir(str(doc_dir/'bst')))
+        self.assertTrue((doc_dir/'Dwyer201509__packed.tex').exists())
+        self.assertTrue((doc_dir/'.gitignore').exists())
+        self.assertFalse((doc_dir/'config.yaml').exists())
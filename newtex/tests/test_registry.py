@@ -0,0 +1,122 @@
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+
+from newtex import new_path
+from newtex.batch import run_batch
+from newtex import scaffold
+from newtex.registry import (Registry, reindex, parse_dir_name, find,
+                             list_documents, reindex_command)
+from newtex.tests.test_batch import make_config
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+            os.environ.setdefault(var, 'newtex')
+        for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+            os.environ.setdefault(var, 'newtex@example.com')
+        self.config_dir, self.config = make_config(self.tmpdir)
+        self.docs = self.tmpdir/'docs'
+        os.mkdir(str(self.docs))
+        entries = [
+            {'doc_type': doc_type, 'short_name': short_name, 'title': title,
+             'destination': str(self.docs/sub), 'date': date}
+            for doc_type, short_name, title, sub, date in [
+                ('MS', 'noise', 'Cantilever noise', 'a',
+                 datetime.date(2015, 9, 1)),
+                ('RP', 'trEFM', 'Time-resolved EFM', 'a/b',
+                 datetime.date(2016, 2, 1)),
+                ('MS', 'pkEFM', 'Phase kick EFM', 'c',
+                 datetime.date(2016, 7, 1))]]
+        report = run_batch(entries, self.config, self.config_dir)
+        self.assertEqual([], report.failures)
+        self.registry = Registry(self.config['registry'])
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def short_names(self, rows):
+        return [row['short_name'] for row in rows]
+
+    def test_find(self):
+        self.assertEqual(['pkEFM', 'trEFM', 'noise'],
+                         self.short_names(self.registry.find()))
+        self.assertEqual(['pkEFM', 'noise'],
+                         self.short_names(self.registry.find(doc_type='MS')))
+        self.assertEqual(['trEFM', 'noise'], self.short_names(
+            self.registry.find(until='2016-02')))
+        self.assertEqual(['pkEFM', 'trEFM'], self.short_names(
+            self.registry.find(author='dwyer', since='2016')))
+        self.assertEqual(['pkEFM', 'trEFM'], self.short_names(
+            self.registry.find(title='efm')))
+        row = self.registry.find(text='noise')[0]
+        self.assertEqual('Cantilever noise', row['title'])
+        self.assertTrue(os.path.isdir(row['bare_repo']))
+        self.assertTrue(os.path.isdir(row['large_figs_dir']))
+
+        result = CliRunner().invoke(find, ['kick', '--registry',
+                                           self.config['registry']])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn('Phase kick EFM', result.output)
+        self.assertIn('1 documents', result.output)
+
+    def test_find_special_characters(self):
+        # % and _ are matched literally, not as LIKE wildcards
+        self.assertEqual([], self.registry.find(title='%'))
+        self.assertEqual([], self.registry.find(text='n_ise'))
+        self.assertEqual(['noise'], self.short_names(
+            self.registry.find(text='201509__noise')))
+
+        result = CliRunner().invoke(list_documents, [
+            '--type', 'XX', '--registry', self.config['registry']])
+        self.assertEqual(2, result.exit_code)
+        self.assertIn("'XX' is not one of", result.output)
+
+    def test_reindex(self):
+        before = [dict(row) for row in self.registry.find()]
+        shutil.rmtree(str(self.docs/'c'))
+        os.remove(self.config['registry'])
+
+        records = reindex(self.registry, [self.docs], self.config['dropbox'],
+                          jobs=2)
+        self.assertEqual(3, len(records))
+        after = self.registry.find()
+        self.assertEqual(['pkEFM', 'trEFM', 'noise'], self.short_names(after))
+        self.assertIsNone(after[0]['doc_dir'])
+        self.assertEqual(before[0]['bare_repo'], after[0]['bare_repo'])
+        for old, new in zip(before[1:], after[1:]):
+            for column in ('doc_dir', 'title', 'bare_repo', 'large_figs_dir'):
+                self.assertEqual(old[column], new[column])
+
+    def test_config_defaults(self):
+        # Without --registry and --dropbox, the config file's are used
+        old = scaffold.default_config_dir
+        scaffold.default_config_dir = str(self.config_dir)
+        try:
+            result = CliRunner().invoke(find, ['kick'])
+            self.assertEqual(0, result.exit_code, result.output)
+            self.assertIn('Phase kick EFM', result.output)
+
+            os.remove(self.config['registry'])
+            result = CliRunner().invoke(reindex_command, [str(self.docs)])
+            self.assertEqual(0, result.exit_code, result.output)
+        finally:
+            scaffold.default_config_dir = old
+        row = self.registry.find(text='noise')[0]
+        self.assertEqual(os.path.join(self.config['dropbox'],
+                                      row['dir_name'] + '.git'),
+                         row['bare_repo'])
+
+    def test_parse_dir_name(self):
+        self.assertEqual(
+            {'dir_name': '_JAM_MS__Dwyer201509__a_b', 'doc_type': 'MS',
+             'author': 'Dwyer', 'date': '2015-09-01', 'short_name': 'a_b'},
+            parse_dir_name('_JAM_MS__Dwyer201509__a_b'))
+        self.assertIsNone(parse_dir_name('_JAM_MS__Dwyer201509__a.git'))
+        self.assertIsNone(parse_dir_name('figs'))
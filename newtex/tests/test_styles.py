@@ -0,0 +1,83 @@
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+import yaml
+from click.testing import CliRunner
+
+from newtex import pkg_config_dir, new_path, scaffold
+from newtex.styles import StyleStore, styles
+
+
+class TestStyleStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.bst_dir = self.tmpdir/'bst'
+        shutil.copytree(str(pkg_config_dir/'bst'), str(self.bst_dir))
+        self.store = StyleStore(self.tmpdir/'store')
+        self.store.add_dir(self.bst_dir, version='test')
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def test_add_dir(self):
+        n_styles = len(os.listdir(str(self.bst_dir)))
+        self.assertEqual(n_styles, len(self.store.index['styles']))
+        # Identical styles are only stored once
+        self.assertLess(len(self.store.objects()), n_styles)
+        self.assertEqual([], self.store.verify())
+        # Reloading the index finds the same styles
+        store = StyleStore(self.store.path)
+        self.assertEqual(self.store.index, store.index)
+
+    def test_materialize_hardlink(self):
+        dst = self.tmpdir/'naturemag_jm.bst'
+        self.store.materialize('naturemag_jm.bst', dst, 'hardlink')
+        self.assertTrue(os.path.samefile(
+            self.store.lookup('naturemag_jm.bst'), str(dst)))
+
+    def test_materialize_copy(self):
+        dst = self.tmpdir/'naturemag_jm.bst'
+        self.store.materialize('naturemag_jm.bst', dst, 'copy')
+        self.assertFalse(os.path.samefile(
+            self.store.lookup('naturemag_jm.bst'), str(dst)))
+        # A copy can be edited, unlike the store's object
+        self.assertTrue(os.stat(str(dst)).st_mode & stat.S_IWUSR)
+        with open(str(dst), 'a') as f:
+            f.write('% edited\n')
+
+    def test_config_store(self):
+        config_dir = self.tmpdir/'newtex_template'
+        os.mkdir(str(config_dir))
+        with open(str(config_dir/'config.yaml'), 'w') as f:
+            yaml.safe_dump({'master_bib_file': 'master.bib',
+                            'authors': ['Ryan Dwyer'],
+                            'affiliations': ['Cornell'],
+                            'default_style': 'naturemag_jm.bst',
+                            'style_store': str(self.store.path)}, f)
+        old = scaffold.default_config_dir
+        scaffold.default_config_dir = str(config_dir)
+        try:
+            result = CliRunner().invoke(styles, ['list'])
+        finally:
+            scaffold.default_config_dir = old
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn('naturemag_jm.bst', result.output)
+
+    def test_gc(self):
+        style = self.bst_dir/'naturemag.bst'
+        old = self.store.lookup('naturemag.bst')
+        self.store.materialize('naturemag.bst', self.tmpdir/'doc.bst',
+                               'hardlink')
+        with open(str(style), 'a') as f:
+            f.write('% edited\n')
+        self.store.add_dir(self.bst_dir)
+
+        self.assertNotEqual(old, self.store.lookup('naturemag.bst'))
+        # The old version is still linked from a document
+        self.assertEqual([], self.store.gc())
+        os.remove(str(self.tmpdir/'doc.bst'))
+        self.assertEqual(1, len(self.store.gc()))
+        self.assertEqual([], self.store.verify())
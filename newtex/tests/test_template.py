@@ -0,0 +1,58 @@
+import io
+import os
+import shutil
+import string
+import tempfile
+import unittest
+
+import click
+
+from newtex import new_path, pkg_config_dir, load_templates
+from newtex.template import CompiledTemplate, compile_template, load_template
+
+
+class TestCompiledTemplate(unittest.TestCase):
+    def test_matches_string_template(self):
+        text = io.open(str(pkg_config_dir/'template.tex'),
+                       encoding='utf-8').read()
+        values = dict(title='A $5 title', main_author='Ryan Dwyer',
+                      date='September 1, 2015',
+                      author_affiliation_block='\\author{Ryan Dwyer}',
+                      default_style='naturemag_jm', default_bib='master',
+                      large_figs_dir='/tmp/figs/')
+        self.assertEqual(string.Template(text).substitute(values),
+                         CompiledTemplate(text).substitute(values))
+
+    def test_syntax(self):
+        template = CompiledTemplate(u"$$a ${b}c $d$$")
+        self.assertEqual(['b', 'd'], template.names)
+        self.assertEqual(u"$a 1c 2$", template.render({'b': 1, 'd': 2}))
+        self.assertRaises(KeyError, template.render, {'b': 1})
+        self.assertRaises(ValueError, CompiledTemplate, u"price: $ 5")
+
+    def test_cache(self):
+        self.assertIs(compile_template(u"$x and $y"),
+                      compile_template(u"$x and $y"))
+
+    def test_unknown_placeholder(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'template.tex')
+            io.open(filename, 'w').write(u"$title $subtitle")
+            self.assertEqual(frozenset(['title', 'subtitle']),
+                             load_template(filename).placeholders)
+            with self.assertRaises(click.ClickException) as cm:
+                load_template(filename, ['title'])
+            self.assertIn('$subtitle', cm.exception.message)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_package_templates(self):
+        templates = load_templates(pkg_config_dir)
+        self.assertIn('author_affiliation_block', templates['tex'].names)
+        self.assertEqual(frozenset(['master_bib', 'master_bib_name',
+                                    'bib_mode', 'doc_name']),
+                         templates['fabfile'].placeholders)
+        # fab runs the fabfile with Python 2, where print is a statement
+        with io.open(str(pkg_config_dir/'fabfile.py')) as f:
+            self.assertIn(u"from __future__ import print_function", f.read())
@@ -0,0 +1,56 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from newtex.timing import Timer, percentile, aggregate, write_profile
+
+
+class TestTiming(unittest.TestCase):
+    def test_percentile(self):
+        self.assertEqual(2.5, percentile([4, 1, 3, 2], 50))
+        self.assertEqual(4, percentile([4, 1, 3, 2], 100))
+        self.assertEqual(1, percentile([1], 90))
+
+    def test_timer(self):
+        timer = Timer('doc')
+        with timer.phase('copy'):
+            pass
+        timer.add('git', 0.0, 0.2)
+        timer.add('git/init', 0.0, 0.1)
+        timer.add('git/mkdir', 0.0, 0.15)
+        self.assertEqual(['copy', 'git', 'git/init', 'git/mkdir'],
+                         [name for name, seconds in timer.totals()])
+        self.assertAlmostEqual(0.2, timer.total, places=2)
+        self.assertIn('  init', timer.report())
+
+    def test_aggregate(self):
+        timers = []
+        for seconds in (0.1, 0.2, 0.3):
+            timers.append(Timer())
+            timers[-1].add('copy', 0.0, seconds)
+        stats = dict(aggregate(timers))
+        self.assertEqual(['copy', 'total'],
+                         [name for name, row in aggregate(timers)])
+        self.assertEqual(3, stats['copy']['count'])
+        self.assertAlmostEqual(0.2, stats['copy']['p50'])
+        self.assertAlmostEqual(0.3, stats['total']['max'])
+
+    def test_write_profile(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            timer = Timer()
+            timer.add('copy', 1.0, 0.5)
+            filename = os.path.join(tmpdir, 'trace.json')
+            write_profile(filename, [timer], 'chrome')
+            event = json.load(open(filename))['traceEvents'][0]
+            self.assertEqual(('copy', 'X', 1e6, 5e5),
+                             (event['name'], event['ph'], event['ts'],
+                              event['dur']))
+            write_profile(filename, [timer, timer], 'json')
+            data = json.load(open(filename))
+            self.assertEqual(2, len(data['documents']))
+            self.assertEqual(2, data['percentiles_ms']['copy']['count'])
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,116 @@
+import io
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+from newtex import new_path
+from newtex import _git
+from newtex.scaffold import create_document
+from newtex.registry import Registry
+from newtex.timing import Timer
+from newtex.transaction import Transaction, rollback, staging_prefix
+from newtex.tests.test_batch import make_config
+
+
+class TestTransaction(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+            os.environ.setdefault(var, 'newtex')
+        for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+            os.environ.setdefault(var, 'newtex@example.com')
+        self.config_dir, self.config = make_config(self.tmpdir)
+        self.destination = self.tmpdir/'docs'
+        self.dropbox = new_path(self.config['dropbox'])
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def create(self, **kwargs):
+        return create_document(self.config, self.config_dir, 'RP', 'doc',
+                               'Title', destination=str(self.destination),
+                               date=datetime.date(2015, 9, 1),
+                               out=io.StringIO(), **kwargs)
+
+    def test_publish(self):
+        paths = self.create()
+        self.assertEqual(['_JAM_RP__Dwyer201509__doc'],
+                         os.listdir(str(self.destination)))
+        self.assertTrue((paths['doc_dir']/'.git').is_dir())
+        self.assertEqual(1, len(Registry(self.config['registry']).find()))
+
+    def create_flaky(self, failures, **kwargs):
+        """Create the document with a git setup that fails (after creating
+        the repositories) the first failures times; returns (paths, number
+        of git setups)."""
+        setup_repositories = _git.setup_repositories
+        calls = []
+
+        def flaky(*args, **kwargs):
+            calls.append(args)
+            setup_repositories(*args, **kwargs)
+            if len(calls) <= failures:
+                raise OSError("No space left on device")
+
+        _git.setup_repositories = flaky
+        try:
+            return self.create(**kwargs), len(calls)
+        finally:
+            _git.setup_repositories = setup_repositories
+
+    def test_failure_leaves_nothing(self):
+        with self.assertRaises(OSError):
+            self.create_flaky(1)
+        self.assertEqual([], os.listdir(str(self.destination)))
+        self.assertEqual([], os.listdir(str(self.dropbox)))
+
+    def test_retry_reuses_staged_copy(self):
+        self.config['git_retries'] = 1
+        timer = Timer()
+        paths, calls = self.create_flaky(1, timer=timer)
+        self.assertEqual(2, calls)
+        self.assertEqual(1, sum(1 for span in timer.spans
+                                if span[0] == 'copy_tree'))
+        self.assertTrue(paths['bare_repo'].is_dir())
+        self.assertTrue(paths['large_figs_dir'].is_dir())
+
+    def test_relative_destination(self):
+        os.makedirs(str(self.tmpdir/'other'))
+        self.destination = self.tmpdir/'other'/'..'/'docs'
+        registry = Registry(self.config['registry'])
+
+        publish = Transaction.publish
+
+        def fail(transaction):
+            raise OSError("Disk full")
+
+        Transaction.publish = fail
+        try:
+            with self.assertRaises(OSError):
+                self.create()
+        finally:
+            Transaction.publish = publish
+        self.assertEqual([], registry.find())
+
+        self.create()
+        self.assertEqual(
+            [str(self.tmpdir/'docs'/'_JAM_RP__Dwyer201509__doc')],
+            [row['doc_dir'] for row in registry.find()])
+
+    def test_rollback_journal(self):
+        transaction = Transaction(self.destination, 'doc')
+        bare_repo = self.dropbox/'doc.git'
+        transaction.created(bare_repo)
+        os.mkdir(str(bare_repo))
+        transaction.created(self.dropbox)  # already exists, so not ours
+        staging_dir = transaction.staging_dir
+        self.assertTrue(os.path.basename(staging_dir).startswith(
+            staging_prefix))
+
+        # As if newtex had been killed before it could roll back
+        rollback(staging_dir)
+        self.assertFalse(bare_repo.exists())
+        self.assertTrue(self.dropbox.exists())
+        self.assertFalse(os.path.exists(staging_dir))
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import click
+
+from newtex import pkg_config_dir, new_path
+from newtex._tree import copy_tree
+
+
+class TestCopyTree(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.src = self.tmpdir/'template'
+        shutil.copytree(str(pkg_config_dir), str(self.src))
+        open(str(self.src/'config.yaml'), 'w').write('authors:\n')
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def same_file(self, dst, rel):
+        return os.path.samefile(str(self.src/rel), str(dst/rel))
+
+    def test_copy(self):
+        dst = self.tmpdir/'doc'
+        counts = copy_tree(self.src, dst, exclude=['config.yaml'])
+        self.assertFalse(self.same_file(dst, 'bst/naturemag_jm.bst'))
+        self.assertTrue((dst/'bib'/'.keep').exists())
+        self.assertFalse((dst/'config.yaml').exists())
+        self.assertEqual(0, counts['hardlink'] + counts['reflink'])
+
+    def test_hardlink(self):
+        dst = self.tmpdir/'doc'
+        counts = copy_tree(self.src, dst, link_mode='hardlink')
+        self.assertTrue(self.same_file(dst, 'bst/naturemag_jm.bst'))
+        self.assertTrue(self.same_file(dst, 'figs/ex.pdf'))
+        for rel in ('template.tex', 'fabfile.py', 'gitignore'):
+            self.assertFalse(self.same_file(dst, rel))
+        self.assertEqual(3, counts['copy'])
+
+    def test_auto(self):
+        dst = self.tmpdir/'doc'
+        counts = copy_tree(self.src, dst, link_mode='auto')
+        # Either every file is reflinked, or the fallbacks are used
+        if counts['reflink'] == 0:
+            self.assertTrue(self.same_file(dst, 'figs/ex.pdf'))
+        self.assertFalse(self.same_file(dst, 'template.tex'))
+        self.assertEqual(open(str(self.src/'template.tex')).read(),
+                         open(str(dst/'template.tex')).read())
+
+    def test_unknown_mode(self):
+        with self.assertRaises(click.ClickException):
+            copy_tree(self.src, self.tmpdir/'doc', link_mode='symlink')
@@ -0,0 +1,70 @@
+import io
+import sys
+import time
+import threading
+import unittest
+import subprocess
+
+from newtex.util import run, run_many, check_output
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+class TestRun(unittest.TestCase):
+    def test_result(self):
+        lines = []
+        result = run(python("print('a'); print('bc')"), log=lines.append)
+        self.assertEqual(0, result.returncode)
+        self.assertEqual(['a', 'bc'], result.output)
+        self.assertEqual(['', result.command, 'a', 'bc'], lines)
+        self.assertGreaterEqual(result.bytes, len('a\nbc\n'))
+        self.assertGreater(result.seconds, 0)
+
+    def test_failure(self):
+        result = run(python("import sys; sys.stderr.write('oops\\n'); "
+                            "sys.exit(3)"))
+        self.assertEqual(3, result.returncode)
+        self.assertEqual(['oops'], result.output)
+        self.assertRaises(subprocess.CalledProcessError, result.check)
+
+    def test_long_lines(self):
+        result = run(python("print('x' * 200000); print('end', end='')"))
+        self.assertEqual(0, result.returncode)
+        self.assertEqual(['x' * 200000, 'end'], result.output)
+
+    def test_timeout(self):
+        result = run(python("import time; time.sleep(10)"), timeout=0.2)
+        self.assertTrue(result.timed_out)
+        self.assertLess(result.seconds, 5)
+        self.assertRaises(subprocess.TimeoutExpired, result.check)
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        threading.Timer(0.2, cancel.set).start()
+        result = run(python("import time; time.sleep(10)"), cancel=cancel)
+        self.assertTrue(result.cancelled)
+        self.assertFalse(result.timed_out)
+        self.assertLess(result.seconds, 5)
+        self.assertRaises(subprocess.CalledProcessError, result.check)
+
+        result = run(python("print('done')"), cancel=threading.Event())
+        self.assertEqual((0, ['done']), (result.returncode, result.output))
+
+    def test_run_many(self):
+        start = time.time()
+        results = run_many([python("import time; time.sleep(0.3); print(1)"),
+                            python("import time; time.sleep(0.3); print(2)"),
+                            python("import time; time.sleep(0.3); print(3)")],
+                           jobs=3)
+        self.assertLess(time.time() - start, 0.85)
+        self.assertEqual([['1'], ['2'], ['3']],
+                         [result.output for result in results])
+
+    def test_check_output(self):
+        out = io.StringIO()
+        args = python("print('hi')")
+        self.assertEqual(['hi'], check_output(args, out=out))
+        self.assertEqual(['', ' '.join(args), 'hi'],
+                         out.getvalue().splitlines())
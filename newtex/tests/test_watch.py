@@ -0,0 +1,201 @@
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from newtex import new_path
+from newtex.watch import (Sources, PollingWatcher, InotifyWatcher,
+                          ContentFilter, coalesce, graphics_paths,
+                          watch_document, Builder, known_hashes)
+
+
+class FakeWatcher(object):
+    def __init__(self, batches):
+        self.batches = list(batches)
+
+    def read(self, timeout=None):
+        return set(self.batches.pop(0)) if self.batches else set()
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = new_path(tempfile.mkdtemp())
+        self.doc_dir = self.tmpdir/'doc'
+        os.makedirs(str(self.doc_dir/'figs'))
+        os.makedirs(str(self.doc_dir/'.git'))
+        self.write('doc.tex', u"\\documentclass{article}\n")
+        self.sources = Sources(self.doc_dir)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmpdir))
+
+    def write(self, name, text):
+        path = str(self.doc_dir/name)
+        io.open(path, 'w').write(text)
+        return path
+
+    def test_sources(self):
+        path = lambda name: str(self.doc_dir/name)
+        for name in ('doc.tex', 'chapters/intro.tex', 'bib/master.bib',
+                     'figs/plot.png', 'figs/data/raw.csv'):
+            self.assertTrue(self.sources.is_source(path(name)), name)
+        for name in ('doc.aux', 'doc.pdf', '.#doc.tex', 'doc.tex~',
+                     '.doc.tex.swp', '4913', 'figs/.DS_Store', 'doc.tex.tmp'):
+            self.assertFalse(self.sources.is_source(path(name)), name)
+
+    def test_graphics_paths(self):
+        figs = self.tmpdir/'Dropbox'/'doc__figs'
+        os.makedirs(str(figs))
+        self.write('doc.tex', u"\\graphicspath{\n{%s}\n{missing/}}\n" % figs)
+        self.assertEqual([str(figs)], graphics_paths(self.doc_dir, 'doc.tex'))
+        self.assertIn(str(figs), Sources(self.doc_dir, [figs]).roots)
+
+    def test_content_filter(self):
+        path = self.write('doc.tex', u"a")
+        content = ContentFilter()
+        self.assertEqual(set([path]), content.changed([path]))
+        # Touched but not changed, as by a sync
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(set(), content.changed([path]))
+        self.write('doc.tex', u"b")
+        self.assertEqual(set([path]), content.changed([path]))
+        os.remove(path)
+        self.assertEqual(set([path]), content.changed([path]))
+
+    def test_coalesce(self):
+        watcher = FakeWatcher([['a'], ['b', 'c'], [], ['d']])
+        self.assertEqual(set(['a', 'b', 'c', 'x']),
+                         coalesce(watcher, ['x'], debounce=0.01))
+
+    def check_watcher(self, watcher):
+        try:
+            self.assertEqual(set(), watcher.read(0.05))
+            path = self.write('doc.tex', u"changed")
+            self.write('.doc.tex.swp', u"swap")
+            self.assertEqual(set([path]), watcher.read(2))
+
+            os.makedirs(str(self.doc_dir/'figs'/'new'))
+            time.sleep(0.05)
+            path = self.write('figs/new/plot.png', u"png")
+            changes = set()
+            deadline = time.time() + 2
+            while path not in changes and time.time() < deadline:
+                changes |= watcher.read(0.2)
+            self.assertIn(path, changes)
+        finally:
+            watcher.close()
+
+    def test_polling_watcher(self):
+        self.check_watcher(PollingWatcher(self.sources, interval=0.02))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "inotify")
+    def test_inotify_watcher(self):
+        watcher = InotifyWatcher(self.sources)
+        self.assertNotIn(str(self.doc_dir/'.git'), watcher.dirs.values())
+        self.check_watcher(watcher)
+
+    def test_build_errors(self):
+        results = [OSError(2, "No such file or directory: 'pdflatex'"),
+                   "built"]
+
+        def build(cancel):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        lines = []
+        builder = Builder(build, echo=lines.append)
+        for i in range(2):
+            builder.start(set())
+            builder.wait()
+        self.assertEqual(["Error: FileNotFoundError: [Errno 2] No such file "
+                          "or directory: 'pdflatex'", "built"], lines)
+
+    def test_rebuild_outside_change(self):
+        from newtex.build import build_document
+        from newtex.tests.test_build import engine, bibtex
+
+        figs = self.tmpdir/'Dropbox'/'doc__figs'
+        os.makedirs(str(figs))
+        io.open(str(figs/'plot.pdf'), 'w').write(u"first plot")
+        self.write('doc.tex', u"\\documentclass{article}\n"
+                              u"\\graphicspath{{%s/}}\n"
+                              u"\\includegraphics{plot.pdf}\n" % figs)
+        pdf = str(self.doc_dir/'doc.pdf')
+
+        def build(cancel):
+            return build_document(self.doc_dir, 'doc.tex', engine, bibtex,
+                                  cancel=cancel).summary()
+
+        def wait_for(text, builds):
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                if len([line for line in lines if line.startswith('Ran')]) \
+                        >= builds and text in io.open(pdf).read():
+                    return True
+                time.sleep(0.02)
+            return False
+
+        stop = threading.Event()
+        lines = []
+        thread = threading.Thread(target=watch_document, kwargs=dict(
+            doc_dir=self.doc_dir, build=build,
+            sources=Sources(self.doc_dir,
+                            graphics_paths(self.doc_dir, 'doc.tex')),
+            poll=True, interval=0.02, debounce=0.05, echo=lines.append,
+            stop=stop))
+        thread.start()
+        try:
+            self.assertTrue(wait_for("first plot", 1), lines)
+            # The figure in Dropbox changes: the PDF is rebuilt
+            io.open(str(figs/'plot.pdf'), 'w').write(u"second plot")
+            self.assertTrue(wait_for("second plot", 2), lines)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertFalse(any('up to date' in line for line in lines), lines)
+        self.assertIn(str(figs/'plot.pdf'), known_hashes(self.doc_dir))
+
+    def test_cancel_and_rebuild(self):
+        started = []
+        finished = []
+
+        def build(cancel):
+            started.append(time.time())
+            if len(started) == 2:
+                # The build for the first change is slow
+                if cancel.wait(5):
+                    from newtex.build import BuildCancelled
+                    raise BuildCancelled()
+            finished.append(len(started))
+            return "built"
+
+        stop = threading.Event()
+        lines = []
+        thread = threading.Thread(target=watch_document, kwargs=dict(
+            doc_dir=self.doc_dir, build=build, sources=self.sources,
+            poll=True, interval=0.02, debounce=0.05, echo=lines.append,
+            stop=stop))
+        thread.start()
+        try:
+            deadline = time.time() + 5
+            while not finished and time.time() < deadline:
+                time.sleep(0.01)
+            self.write('doc.tex', u"first")
+            while len(started) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            self.write('doc.tex', u"second")
+            while len(started) < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual([1, 3], finished)
+        self.assertIn("Build cancelled; sources changed", lines)
+        self.assertIn("Changed: doc.tex", lines)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Time the phases of creating a document.
+
+create_document records how long each phase takes (copying the template,
+the bib file, rendering, git setup and its individual steps) in a Timer.
+newtex --profile prints the breakdown and can write it as JSON or in the
+Chrome trace event format (open it in chrome://tracing or Perfetto), and
+batch runs aggregate percentiles across documents with aggregate.
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import time
+import threading
+import contextlib
+
+
+profile_formats = ('json', 'chrome')
+
+
+class Timer(object):
+    """Records named spans. Names containing '/' are sub-phases of the
+    phase named before the '/', and may overlap each other."""
+
+    def __init__(self, label=None):
+        self.label = label
+        self.spans = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start)
+
+    def add(self, name, start, seconds):
+        """Record a span that started at start (a time.perf_counter value)
+        and took seconds."""
+        self.spans.append((name, start, seconds,
+                           threading.current_thread().ident))
+
+    def totals(self):
+        """Return a list of (name, seconds), in the order the phases were
+        first recorded, with repeated phases summed."""
+        totals = {}
+        order = []
+        for name, start, seconds, thread in self.spans:
+            if name not in totals:
+                order.append(name)
+                totals[name] = 0.0
+            totals[name] += seconds
+        return [(name, totals[name]) for name in order]
+
+    @property
+    def total(self):
+        return sum(seconds for name, seconds in self.totals()
+                   if '/' not in name)
+
+    def report(self):
+        """Return the breakdown as text, one line per phase."""
+        total = self.total
+        lines = []
+        for name, seconds in self.totals():
+            parent, sep, child = name.rpartition('/')
+            lines.append("{0:40s} {1:9.1f} ms {2:5.1f}%".format(
+                ('  ' + child) if sep else name, 1000 * seconds,
+                100 * seconds / total if total else 0))
+        lines.append("{0:40s} {1:9.1f} ms".format('total', 1000 * total))
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {'label': self.label, 'total_ms': 1000 * self.total,
+                'phases': [{'name': name, 'ms': 1000 * seconds}
+                           for name, seconds in self.totals()]}
+
+    def trace_events(self):
+        """Return the spans as Chrome trace 'complete' events."""
+        pid = os.getpid()
+        return [{'name': name, 'cat': self.label or 'newtex', 'ph': 'X',
+                 'ts': 1e6 * start, 'dur': 1e6 * seconds, 'pid': pid,
+                 'tid': thread}
+                for name, start, seconds, thread in self.spans]
+
+
+def percentile(values, q):
+    """Return the q'th percentile (0 <= q <= 100) of values, interpolating
+    linearly between the closest ranks."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = (len(values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def aggregate(timers, percentiles=(50, 90, 99)):
+    """Return a list of (name, {'count', 'p50', ..., 'max'}) in seconds for
+    each phase across timers, with 'total' for the whole of each timer."""
+    samples = {}
+    order = []
+    for timer in timers:
+        for name, seconds in timer.totals() + [('total', timer.total)]:
+            if name not in samples:
+                order.append(name)
+                samples[name] = []
+            samples[name].append(seconds)
+    if 'total' in order:
+        order.remove('total')
+        order.append('total')
+
+    stats = []
+    for name in order:
+        values = samples[name]
+        row = {'count': len(values), 'max': max(values)}
+        for q in percentiles:
+            row['p{0}'.format(q)] = percentile(values, q)
+        stats.append((name, row))
+    return stats
+
+
+def aggregate_report(timers, percentiles=(50, 90, 99)):
+    """Return the percentiles of each phase across timers as a table."""
+    columns = ['p{0}'.format(q) for q in percentiles] + ['max']
+    lines = ["{0:40s} {1:>5s}".format('phase', 'n') +
+             ''.join("{0:>10s}".format(c + ' ms') for c in columns)]
+    for name, row in aggregate(timers, percentiles):
+        lines.append("{0:40s} {1:5d}".format(name, row['count']) +
+                     ''.join("{0:10.1f}".format(1000 * row[c])
+                             for c in columns))
+    return "\n".join(lines)
+
+
+def write_profile(filename, timers, profile_format='json'):
+    """Write timers to filename as JSON (each timer's phases, plus
+    percentiles if there are several) or as a Chrome trace."""
+    import json
+
+    if profile_format == 'chrome':
+        data = {'traceEvents': [event for timer in timers
+                                for event in timer.trace_events()],
+                'displayTimeUnit': 'ms'}
+    elif profile_format == 'json':
+        data = {'documents': [timer.to_dict() for timer in timers]}
+        if len(timers) > 1:
+            data['percentiles_ms'] = dict(
+                (name, dict((key, 1000 * value if key != 'count' else value)
+                            for key, value in row.items()))
+                for name, row in aggregate(timers))
+    else:
+        raise ValueError("Unknown profile format '{0}'".format(profile_format))
+    with open(str(filename), 'w') as f:
+        json.dump(data, f, indent=1)
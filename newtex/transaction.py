@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Create a document all at once, or not at all.
+
+A new document is built in a staging directory inside its destination
+(.newtex-staging-*/<dir_name>, so it is on the same filesystem), and moved
+into place with a single rename once everything else has succeeded. Paths
+created outside the staging directory (the bare repository and large
+figures directory in Dropbox, the registry entry) are recorded in a
+journal, journal.json in the staging directory, just before they are
+created. If anything fails, they are removed again along with the staging
+directory, so a failed newtex leaves nothing behind.
+
+If newtex is killed before it can roll back, the staging directory and its
+journal are left behind (they are hidden from newtex reindex and name
+checks); rollback(staging_dir) undoes them.
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import json
+import shutil
+import tempfile
+
+import click
+
+
+staging_prefix = '.newtex-staging-'
+journal_name = 'journal.json'
+
+
+def _read_journal(staging_dir):
+    try:
+        with open(os.path.join(str(staging_dir), journal_name)) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (IOError, OSError):
+        return []
+
+
+def _undo(entry):
+    path = entry['path']
+    if entry['action'] == 'unregister':
+        from newtex.registry import Registry
+        Registry(entry['registry']).remove(path)
+    elif os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def rollback(staging_dir):
+    """Undo everything recorded in the journal in staging_dir, newest
+    first, and remove the staging directory."""
+    for entry in reversed(_read_journal(staging_dir)):
+        _undo(entry)
+    shutil.rmtree(str(staging_dir), ignore_errors=True)
+
+
+class Transaction(object):
+    """Stage the document dir_name for destination.
+
+    Build the document in staged, record each outside path with created
+    (or registered) before creating it, and call publish to move the
+    document into place. Used as a context manager, the transaction is
+    rolled back unless it was published."""
+
+    def __init__(self, destination, dir_name):
+        destination = str(destination)
+        if not os.path.isdir(destination):
+            os.makedirs(destination)
+        self.target = os.path.join(destination, dir_name)
+        self.staging_dir = tempfile.mkdtemp(dir=destination,
+                                            prefix=staging_prefix)
+        self.staged = os.path.join(self.staging_dir, dir_name)
+        self.journal = []
+        self.published = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.published:
+            self.rollback()
+
+    def _record(self, entry):
+        self.journal.append(entry)
+        with open(os.path.join(self.staging_dir, journal_name), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def created(self, path):
+        """Record that path is about to be created outside the staging
+        directory. A path that already exists isn't ours, and isn't
+        recorded."""
+        path = os.path.abspath(str(path))
+        if not os.path.lexists(path):
+            self._record({'action': 'create', 'path': path})
+
+    def registered(self, registry, doc_dir):
+        """Record that doc_dir is about to be added to registry."""
+        self._record({'action': 'unregister',
+                      'path': os.path.abspath(str(doc_dir)),
+                      'registry': registry.path})
+
+    def undo(self):
+        """Remove everything recorded so far, keeping the staged document
+        (to retry the steps that failed)."""
+        for entry in reversed(self.journal):
+            _undo(entry)
+        self.journal = []
+        journal = os.path.join(self.staging_dir, journal_name)
+        if os.path.exists(journal):
+            os.remove(journal)
+
+    def rollback(self):
+        """Remove everything recorded and the staged document."""
+        rollback(self.staging_dir)
+        self.journal = []
+
+    def publish(self):
+        """Move the staged document to its destination."""
+        if os.path.lexists(self.target):
+            raise click.ClickException(
+                "{0} already exists".format(self.target))
+        os.rename(self.staged, self.target)
+        self.published = True
+        shutil.rmtree(self.staging_dir)
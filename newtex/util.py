@@ -1,4 +1,17 @@
 # -*- coding: utf-8 -*-
+"""
+Run the external commands (git, and later LaTeX tools) that newtex uses.
+
+run and run_async stream a command's output line by line to a log as it is
+produced, rather than buffering it, and return a CommandResult recording
+the exit code, duration, output and byte count, so that callers can decide
+what to print. run_many runs many commands concurrently.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import asyncio
 import pathlib
 
 
@@ -12,11 +25,168 @@ except:
 cwd = pathlib.Path('.')
 
 
+class CommandResult(object):
+    """The outcome of running a command: its exit code (None if it timed
+    out; negative if it was killed because it was cancelled), how long it
+    took, its output lines and the number of bytes it wrote."""
+
+    def __init__(self, args, cwd=None):
+        self.args = list(args)
+        self.cwd = cwd
+        self.returncode = None
+        self.seconds = 0.0
+        self.output = []
+        self.bytes = 0
+        self.timeout = None
+        self.timed_out = False
+        self.cancelled = False
+
+    @property
+    def command(self):
+        return ' '.join(self.args)
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def check(self):
+        """Raise subprocess.TimeoutExpired or CalledProcessError if the
+        command didn't succeed; otherwise return self."""
+        output = '\n'.join(self.output).encode('utf-8')
+        if self.timed_out:
+            raise subprocess.TimeoutExpired(self.args, self.timeout, output)
+        if self.returncode:
+            raise subprocess.CalledProcessError(self.returncode, self.args,
+                                                output)
+        return self
+
+    def __repr__(self):
+        return "<CommandResult {0!r} exit {1} in {2:.3f} s>".format(
+            self.command, self.returncode, self.seconds)
+
+
+def _log_line(log, line):
+    if log is None:
+        return
+    if callable(log):
+        log(line)
+    else:
+        print(line, file=log)
+
+
+async def _wait_cancelled(cancel, interval=0.05):
+    while not cancel.is_set():
+        await asyncio.sleep(interval)
+
+
+async def run_async(args, cwd=None, env=None, timeout=None, log=None,
+                    echo=True, stderr=True, cancel=None):
+    """Run args without blocking the event loop and return a CommandResult.
+
+    Output lines are sent to log (a file-like object or a callable taking
+    a line) as they are produced, preceded by the command if echo is True;
+    log=None runs silently. With stderr=True, stderr is captured with
+    stdout; otherwise it is passed through. A command still running after
+    timeout seconds, or when cancel (a threading.Event) is set, is killed."""
+    result = CommandResult(args, None if cwd is None else str(cwd))
+    result.timeout = timeout
+    if echo:
+        _log_line(log, '')
+        _log_line(log, result.command)
+
+    start = time.time()
+    process = await asyncio.create_subprocess_exec(
+        *result.args, cwd=result.cwd, env=env, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if stderr else None)
+
+    def emit(line):
+        text = line.decode('utf-8', 'replace').rstrip('\r\n')
+        result.output.append(text)
+        _log_line(log, text)
+
+    async def read():
+        # Read in chunks rather than with readline, which fails on lines
+        # longer than the stream's buffer limit
+        partial = b''
+        while True:
+            chunk = await process.stdout.read(1 << 16)
+            if not chunk:
+                break
+            result.bytes += len(chunk)
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            for line in lines:
+                emit(line)
+        if partial:
+            emit(partial)
+        return await process.wait()
+
+    try:
+        if cancel is None:
+            result.returncode = await asyncio.wait_for(read(), timeout)
+        else:
+            reading = asyncio.ensure_future(read())
+            cancelled = asyncio.ensure_future(_wait_cancelled(cancel))
+            done, pending = await asyncio.wait(
+                [reading, cancelled], timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED)
+            cancelled.cancel()
+            if reading in done:
+                result.returncode = reading.result()
+            else:
+                result.cancelled = cancel.is_set()
+                result.timed_out = not result.cancelled
+                process.kill()
+                returncode = await reading
+                if result.cancelled:
+                    result.returncode = returncode
+    except asyncio.TimeoutError:
+        result.timed_out = True
+        process.kill()
+        await process.wait()
+    finally:
+        # Don't leave the process running if reading its output failed
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+    result.seconds = time.time() - start
+    return result
+
+
+def run(args, **kwargs):
+    """Run args and return a CommandResult; see run_async for the options."""
+    return asyncio.run(run_async(args, **kwargs))
+
+
+async def _run_many(commands, jobs, kwargs):
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def run_one(args):
+        async with semaphore:
+            return await run_async(args, **kwargs)
+
+    return await asyncio.gather(*[run_one(args) for args in commands])
+
+
+def run_many(commands, jobs=4, **kwargs):
+    """Run each of commands (lists of arguments), at most jobs at a time,
+    and return their CommandResults in order. kwargs are passed to
+    run_async."""
+    return asyncio.run(_run_many(commands, jobs, kwargs))
+
+
 def check_output(*args, **kwargs):
     """Subprocess check_output, but prints commands and output by default.
     Also allows printing of error message for helpful debugging.
 
-    Use print_all=False to turn off all printing."""
+    Use print_all=False to turn off all printing, or out=file to print to a
+    file-like object other than stdout. When out is given, stderr is printed
+    there too. Returns the output lines; see run for more control."""
+    out = kwargs.pop('out', None)
+    stderr = kwargs.pop('stderr', None)
     print_all = kwargs.pop('print_all', None)
     if print_all is not None:
         print_in = print_all
@@ -25,19 +195,12 @@ def check_output(*args, **kwargs):
         print_in = kwargs.pop('print_in', True)
         print_out = kwargs.pop('print_out', True)
 
+    log = out if out is not None else sys.stdout
     if print_in:
-        print('')
-        print(' '.join(args[0]))
-
-    try:
-        out_bytes = subprocess.check_output(*args, **kwargs)
-        out_lines = out_bytes.decode('utf-8').splitlines()
-    except subprocess.CalledProcessError as e:
-        # Wrap in try/except so that check_output can print
-        raise e
-
-    if print_out:
-        for line in out_lines:
-            print(line)
+        _log_line(log, '')
+        _log_line(log, ' '.join(args[0]))
 
-    return out_lines
\ No newline at end of file
+    result = run(args[0], log=log if print_out else None, echo=False,
+                 stderr=out is not None or stderr == subprocess.STDOUT,
+                 **kwargs)
+    return result.check().output
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+"""
+Rebuild a document whenever its sources change.
+
+newtex watch watches the document's .tex files and its bib/, bst/ and
+figs/ trees, plus the directories in the document's \\graphicspath (the
+large figures directory in Dropbox), and runs the incremental build
+(newtex.build) after each change.
+
+- On Linux, directories are watched with inotify (one watch per directory,
+  however many files it holds); elsewhere, or with --poll, the trees are
+  scanned every --interval seconds.
+- Editor backup and swap files, build outputs and other files that can't
+  affect the document are ignored, and a file whose contents haven't
+  changed (Dropbox sync and touch only change the modification time)
+  doesn't trigger a build.
+- A burst of changes (an editor saving several files, a sync) is coalesced
+  into one build, started once nothing has changed for --debounce seconds.
+- If sources change while a build is running, the build is cancelled and a
+  new one started.
+"""
+from __future__ import print_function, division, absolute_import
+
+import io
+import os
+import re
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+
+import click
+
+from newtex.styles import file_hash
+
+
+# Directories of the document that are watched recursively
+source_dirs = ('bib', 'bst', 'figs')
+# Files elsewhere in the document that can affect the build
+source_exts = ('.tex', '.bib', '.bst', '.cls', '.sty', '.clo', '.def')
+
+# Editor swap / backup files and sync droppings
+ignored_re = re.compile(r'(^\.#|^#.*#$|~$|\.sw[a-p]$|\.sw[x-z]$|^4913$|'
+                        r'\.tmp$|^\.DS_Store$|^\.dropbox|^\.~|\.crdownload$)')
+ignored_dirs = ('.git', '__pycache__', '.newtex-staging', '.newtex_figs')
+
+graphicspath_re = re.compile(r'\\graphicspath\s*\{((?:\s*\{[^{}]*\})*)\s*\}')
+
+
+def graphics_paths(doc_dir, tex_file):
+    """Return the directories in tex_file's \\graphicspath that exist,
+    resolved against doc_dir."""
+    try:
+        with io.open(os.path.join(str(doc_dir), tex_file), encoding='utf-8',
+                     errors='replace') as f:
+            match = graphicspath_re.search(f.read())
+    except (IOError, OSError):
+        return []
+    if match is None:
+        return []
+    paths = []
+    for path in re.findall(r'\{([^{}]*)\}', match.group(1)):
+        path = os.path.join(str(doc_dir), os.path.expanduser(path.strip()))
+        if os.path.isdir(path):
+            paths.append(os.path.abspath(path))
+    return paths
+
+
+class Sources(object):
+    """Decides which paths are sources of the document in doc_dir."""
+
+    def __init__(self, doc_dir, extra_dirs=()):
+        self.doc_dir = os.path.abspath(str(doc_dir))
+        self.trees = [os.path.join(self.doc_dir, d) for d in source_dirs]
+        self.trees.extend(os.path.abspath(str(d)) for d in extra_dirs)
+
+    @property
+    def roots(self):
+        """The directories to watch: the document directory (for files
+        anywhere in it with a source extension) and the source trees."""
+        roots = [self.doc_dir]
+        roots.extend(tree for tree in self.trees
+                     if os.path.isdir(tree) and not
+                     tree.startswith(self.doc_dir + os.sep))
+        return roots
+
+    def ignored_dir(self, name):
+        return name in ignored_dirs or name.startswith('.newtex-staging')
+
+    def is_source(self, path):
+        name = os.path.basename(path)
+        if ignored_re.search(name):
+            return False
+        if any(path.startswith(tree + os.sep) for tree in self.trees):
+            return True
+        return name.endswith(source_exts)
+
+
+class PollingWatcher(object):
+    """Watch trees by scanning them every interval seconds."""
+
+    def __init__(self, sources, interval=1.0):
+        self.sources = sources
+        self.interval = interval
+        self.files = self._scan()
+
+    def _scan(self):
+        files = {}
+        stack = list(self.sources.roots)
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not self.sources.ignored_dir(entry.name):
+                            stack.append(entry.path)
+                    elif self.sources.is_source(entry.path):
+                        st = entry.stat()
+                        files[entry.path] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        return files
+
+    def read(self, timeout=None):
+        """Return the set of paths changed (or created or removed) since the
+        last call, waiting up to timeout seconds for one."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            files = self._scan()
+            changed = set(path for path in set(files) | set(self.files)
+                          if files.get(path) != self.files.get(path))
+            self.files = files
+            if changed:
+                return changed
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    return set()
+            time.sleep(wait)
+
+    def close(self):
+        pass
+
+
+# inotify, through libc with ctypes
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+watch_mask = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF)
+
+_event = struct.Struct('iIII')
+
+
+class InotifyWatcher(object):
+    """Watch trees with inotify, with one watch per directory."""
+
+    def __init__(self, sources):
+        import ctypes
+        import ctypes.util
+
+        self.sources = sources
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                 use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                                 ctypes.c_uint32]
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._error()
+        self.dirs = {}
+        self._changed = set()
+        for root in sources.roots:
+            self._add_tree(root)
+
+    def _error(self, path=None):
+        import ctypes
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+    def _add_tree(self, root):
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            wd = self._libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), watch_mask)
+            if wd < 0:
+                import ctypes
+                if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                self._error(directory)
+            self.dirs[wd] = directory
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            stack.extend(entry.path for entry in entries
+                         if entry.is_dir(follow_symlinks=False) and
+                         not self.sources.ignored_dir(entry.name))
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event.unpack_from(data, offset)
+            offset += _event.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Too many events to tell what changed; assume everything
+                self._changed.add(self.sources.doc_dir)
+                continue
+            directory = self.dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and \
+                        not self.sources.ignored_dir(name):
+                    self._add_tree(path)
+                    self._changed.update(self._files_below(path))
+            elif name and self.sources.is_source(path):
+                self._changed.add(path)
+
+    def _files_below(self, directory):
+        found = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [d for d in dirnames
+                           if not self.sources.ignored_dir(d)]
+            found.extend(os.path.join(dirpath, f) for f in filenames
+                         if self.sources.is_source(os.path.join(dirpath, f)))
+        return found
+
+    def read(self, timeout=None):
+        """Return the set of paths changed (or created or removed) since the
+        last call, waiting up to timeout seconds for one."""
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._changed:
+            wait = None if deadline is None else deadline - time.time()
+            if wait is not None and wait <= 0:
+                break
+            readable, _, _ = select.select([self.fd], [], [], wait)
+            if readable:
+                self._read_events()
+        changed, self._changed = self._changed, set()
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def open_watcher(sources, poll=False, interval=1.0):
+    """Return an InotifyWatcher for sources if possible (and poll is
+    False), otherwise a PollingWatcher."""
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(sources)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(sources, interval)
+
+
+class ContentFilter(object):
+    """Drop changes that leave a file's contents as they were, remembering
+    each file's size, modification time and hash."""
+
+    def __init__(self, known=None):
+        self.known = dict(known or {})
+
+    def changed(self, paths):
+        """Return the paths in paths whose contents really changed."""
+        result = set()
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Removed
+                self.known.pop(path, None)
+                result.add(path)
+                continue
+            old = self.known.get(path)
+            if old is not None and old[:2] == [st.st_size, st.st_mtime_ns]:
+                continue
+            try:
+                sha = file_hash(path)
+            except (IOError, OSError):
+                continue
+            self.known[path] = [st.st_size, st.st_mtime_ns, sha]
+            if old is None or old[2] != sha:
+                result.add(path)
+        return result
+
+
+def known_hashes(doc_dir):
+    """Return the hashes newtex build recorded for doc_dir's sources (in
+    doc_dir or not), as {absolute path: [size, mtime_ns, sha256]}, so that
+    the first touch of an unchanged file isn't taken for a change."""
+    from newtex.build import _read_state, _full_path
+
+    state = _read_state(doc_dir)
+    known = {}
+    for key in ('inputs', 'bib_files'):
+        for path, entry in (state.get(key) or {}).items():
+            if entry is not None:
+                known[_full_path(os.path.abspath(str(doc_dir)),
+                                 path)] = entry
+    return known
+
+
+def coalesce(watcher, changes, debounce=0.3, max_delay=5.0, filter=None):
+    """Collect changes from watcher, adding to changes until nothing has
+    changed for debounce seconds (or max_delay seconds have passed). Returns
+    the set of changed paths."""
+    changes = set(changes)
+    start = time.time()
+    while True:
+        wait = min(debounce, max_delay - (time.time() - start))
+        if wait <= 0:
+            break
+        more = watcher.read(wait)
+        if filter is not None:
+            more = filter.changed(more)
+        if not more:
+            break
+        changes |= more
+    return changes
+
+
+class Builder(object):
+    """Runs builds in a background thread, one at a time, cancelling the
+    running build when a new one is requested."""
+
+    def __init__(self, build, echo=print):
+        self.build = build
+        self.echo = echo
+        self.thread = None
+        self.cancel = None
+        self.builds = 0
+        self.cancelled = 0
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, changes):
+        self.stop()
+        self.cancel = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                                       args=(changes, self.cancel))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Cancel the running build, if there is one, and wait for it."""
+        if self.running:
+            self.cancel.set()
+            self.thread.join()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self, changes, cancel):
+        from newtex.build import BuildCancelled
+
+        self.builds += 1
+        try:
+            self.echo(self.build(cancel))
+        except BuildCancelled:
+            self.cancelled += 1
+            self.echo("Build cancelled; sources changed")
+        except click.ClickException as e:
+            self.echo("Error: {0}".format(e.format_message()))
+        except Exception as e:
+            # Such as pdflatex not being installed; keep watching
+            self.echo("Error: {0}: {1}".format(type(e).__name__, e))
+
+
+def watch_document(doc_dir, build, sources=None, poll=False, interval=1.0,
+                   debounce=0.3, echo=print, stop=None):
+    """Run build(cancel) (which returns a line to echo) whenever the
+    sources of the document in doc_dir change, until stop (a
+    threading.Event) is set or KeyboardInterrupt."""
+    if sources is None:
+        sources = Sources(doc_dir)
+    watcher = open_watcher(sources, poll, interval)
+    content = ContentFilter(known_hashes(doc_dir))
+    builder = Builder(build, echo)
+    echo("Watching {0} ({1})".format(', '.join(sources.roots), 'inotify'
+                                     if isinstance(watcher, InotifyWatcher)
+                                     else 'polling'))
+    try:
+        builder.start(set())
+        while stop is None or not stop.is_set():
+            changes = content.changed(watcher.read(0.2))
+            if not changes:
+                continue
+            # Cancel now, rather than after the burst is over
+            builder.stop()
+            changes = coalesce(watcher, changes, debounce, filter=content)
+            echo("Changed: {0}".format(', '.join(sorted(
+                os.path.relpath(path, sources.doc_dir) for path in changes))))
+            builder.start(changes)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        builder.stop()
+        watcher.close()
+    return builder
+
+
+@click.command(help="Rebuild a document whenever its sources change")
+@click.argument('doc_dir', default='.', type=click.Path(file_okay=False,
+                                                        exists=True))
+@click.option('--tex', default=None,
+              help="Main .tex file (default: the one with a \\documentclass)")
+@click.option('--engine', default='pdflatex', show_default=True,
+              help="LaTeX command")
+@click.option('--bibtex', default='bibtex', show_default=True,
+              help="BibTeX command")
+@click.option('--debounce', default=0.3, type=click.FloatRange(0),
+              show_default=True,
+              help="Seconds without changes before building")
+@click.option('--poll', is_flag=True,
+              help="Scan for changes instead of using inotify")
+@click.option('--interval', default=1.0, type=click.FloatRange(0.05),
+              show_default=True, help="Seconds between scans with --poll")
+@click.option('--draft', is_flag=True,
+              help="Use the draft previews of the figures (see newtex figs)")
+def watch(doc_dir, tex, engine, bibtex, debounce, poll, interval, draft):
+    from newtex.build import build_document, find_main
+    from newtex.cache import get_cache
+    from newtex.figs import update_figures
+
+    if tex is None:
+        tex = find_main(doc_dir)
+    sources = Sources(doc_dir, graphics_paths(doc_dir, tex))
+
+    def build(cancel):
+        update_figures(doc_dir, tex, draft, get_cache(), echo=click.echo)
+        return build_document(doc_dir, tex, engine, bibtex, cache=get_cache(),
+                              cancel=cancel, draft=draft).summary()
+
+    watch_document(doc_dir, build, sources, poll, interval, debounce,
+                   echo=click.echo)
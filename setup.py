@@ -47,7 +47,8 @@ setup(
     packages=['newtex'],
     setup_requires=["setuptools_git >= 0.3"],
     include_package_data=True,
-    install_requires=['click', 'PyYAML', 'pathlib'],
+    python_requires='>=3.8',
+    install_requires=['click', 'PyYAML'],
     tests_require=['nose>=1.0'],
     test_suite='nose.collector',
     license='MIT',
@@ -55,7 +56,7 @@ setup(
     cmdclass=versioneer.get_cmdclass(),
     entry_points="""
         [console_scripts]
-        newtex=newtex:cli
+        newtex=newtex.__main__:main
     """,
     classifiers=[
         'Development Status :: 3 - Alpha',
@@ -64,5 +65,6 @@ setup(
         'Operating System :: MacOS :: MacOS X',
         'Operating System :: Microsoft :: Windows',
         'Operating System :: POSIX',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7'],)
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8'],)